@@ -1,4 +1,9 @@
 # -*- coding: utf-8 -*-
 from .registry import registry, register, autodiscover
 
-__all__ = ['registry', 'register', 'autodiscover']
+__all__ = ['registry', 'register', 'autodiscover', 'evaluate_user']
+
+
+def evaluate_user(*args, **kwargs):
+    from .realtime import evaluate_user as _evaluate_user
+    return _evaluate_user(*args, **kwargs)
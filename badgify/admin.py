@@ -4,6 +4,7 @@ from django.utils.html import format_html
 
 from badgify.compat import gettext_lazy as _
 
+from .catalogue import catalogue
 from .models import Badge, Award
 from . import settings
 
@@ -38,7 +39,8 @@ class AwardAdmin(admin.ModelAdmin):
     """
     Award model admin options.
     """
-    list_display = ('user', 'badge', 'awarded_at')
+    list_display = ('user', 'award_badge', 'awarded_at')
+    list_select_related = ('user',)
     date_hierarchy = 'awarded_at'
     list_filter = ('badge',)
     search_fields = (
@@ -50,6 +52,11 @@ class AwardAdmin(admin.ModelAdmin):
         'badge__slug',
         'badge__description')
 
+    def award_badge(self, obj):
+        return catalogue.get_by_id(obj.badge_id)
+    award_badge.short_description = _('badge')
+    award_badge.admin_order_field = 'badge'
+
 
 if settings.REGISTER_ADMIN:
     admin.site.register(Badge, BadgeAdmin)
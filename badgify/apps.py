@@ -8,3 +8,8 @@ class BadgifyConfig(AppConfig):
     def ready(self):
         super().ready()
         self.module.autodiscover()
+
+        from . import settings
+        if settings.REALTIME:
+            from .realtime import connect_triggers
+            connect_triggers()
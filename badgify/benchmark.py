@@ -0,0 +1,230 @@
+import json
+import logging
+import platform
+import time
+import tracemalloc
+
+from contextlib import contextmanager
+
+from django.db import connection
+from django.db.models import F
+from django.template import Context, Template
+
+from . import commands
+from . import registry
+from .models import Badge, Award
+from .compat import get_user_model
+from .instrumentation import QueryCounter, count_queries
+from .recipe import BaseRecipe
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger('badgify')
+
+USERNAME_PREFIX = 'badgify-benchmark-'
+
+TEMPLATE = Template('''
+    {% load badgify_tags %}
+    {% for user in users %}
+        {% badgify_badges user=user as badges %}
+        {% for badge in badges %}{{ badge.slug }}{% endfor %}
+    {% endfor %}
+''')
+
+
+class BenchmarkRecipe(BaseRecipe):
+    """
+    Synthetic recipe: benchmark users with an even id.
+    """
+    name = 'Badgify Benchmark'
+    slug = 'badgify-benchmark'
+    description = 'Synthetic badge created by badgify_benchmark'
+    image = None
+
+    @property
+    def user_ids(self):
+        return (get_user_model().objects.filter(username__startswith=USERNAME_PREFIX)
+                                        .annotate(parity=F('pk') % 2)
+                                        .filter(parity=0)
+                                        .values_list('pk', flat=True))
+
+
+def get_peak_rss():
+    """
+    Returns the peak resident set size of the process in kilobytes (over
+    the whole life of the process, not per phase).
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if platform.system() == 'Darwin':
+        peak = peak // 1024
+    return peak
+
+
+@contextmanager
+def measure(report, phase, trace_memory=False):
+    """
+    Measures wall time, queries and rows of a benchmark phase, and the peak
+    of Python allocations during the phase if ``trace_memory`` is ``True``
+    (``tracemalloc`` slows the phase down).
+    """
+    counter = QueryCounter()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.time()
+    try:
+        with count_queries(counter):
+            yield
+    finally:
+        peak_memory = None
+        if trace_memory:
+            peak_memory = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+    report['phases'][phase] = {
+        'time': round(time.time() - start, 6),
+        'queries': counter.queries,
+        'rows': counter.rows,
+        'peak_memory_kb': peak_memory,
+    }
+    logger.info('⚐ Benchmark %-20s %10.3f s %8d queries %10d rows',
+                phase,
+                report['phases'][phase]['time'],
+                counter.queries,
+                counter.rows)
+
+
+def create_users(count, batch_size=10000):
+    """
+    Creates ``count`` synthetic users with bulk inserts.
+    """
+    User = get_user_model()
+    for start in range(0, count, batch_size):
+        User.objects.bulk_create([
+            User(username='%s%d' % (USERNAME_PREFIX, i), password='!')
+            for i in range(start, min(start + batch_size, count))
+        ], batch_size=batch_size)
+
+
+def create_awards(badge, ratio=3, batch_size=10000):
+    """
+    Awards one synthetic user out of ``ratio`` (obsolete awards for the sync).
+    """
+    User = get_user_model()
+    user_ids = (User.objects.filter(username__startswith=USERNAME_PREFIX)
+                            .annotate(modulo=F('pk') % ratio)
+                            .filter(modulo=0)
+                            .values_list('pk', flat=True)
+                            .iterator(chunk_size=batch_size))
+    awards = []
+    for user_id in user_ids:
+        awards.append(Award(user_id=user_id, badge=badge))
+        if len(awards) >= batch_size:
+            Award.objects.bulk_create(awards, batch_size=batch_size)
+            awards = []
+    Award.objects.bulk_create(awards, batch_size=batch_size)
+
+
+def cleanup():
+    """
+    Deletes synthetic users, awards and badge (without loading them).
+    """
+    User = get_user_model()
+    awards = Award.objects.filter(badge__slug=BenchmarkRecipe.slug)
+    awards._raw_delete(awards.db)
+    users = User.objects.filter(username__startswith=USERNAME_PREFIX)
+    users._raw_delete(users.db)
+    Badge.objects.filter(slug=BenchmarkRecipe.slug).delete()
+
+
+def run(users=10000, batch_size=None, diff_engine=None, rendered_users=100, keep=False,
+        trace_memory=False):
+    """
+    Synthesizes ``users`` users and runs each sync phase. Returns the report
+    (a dict ready to be dumped as JSON).
+    """
+    report = {
+        'users': users,
+        'vendor': connection.vendor,
+        'batch_size': batch_size,
+        'diff_engine': diff_engine or BenchmarkRecipe.diff_engine,
+        'python': platform.python_version(),
+        'phases': {},
+    }
+
+    cleanup()
+    registry.register(BenchmarkRecipe)
+
+    try:
+        with measure(report, 'create_users', trace_memory):
+            create_users(users)
+
+        with measure(report, 'sync_badges', trace_memory):
+            commands.sync_badges(badges=[BenchmarkRecipe.slug])
+
+        badge = Badge.objects.get(slug=BenchmarkRecipe.slug)
+
+        with measure(report, 'create_awards', trace_memory):
+            create_awards(badge)
+
+        options = {
+            'badges': [BenchmarkRecipe.slug],
+            'batch_size': batch_size,
+            'diff_engine': diff_engine,
+        }
+
+        with measure(report, 'sync_awards', trace_memory):
+            commands.sync_awards(**options)
+
+        with measure(report, 'sync_awards_noop', trace_memory):
+            commands.sync_awards(**options)
+
+        with measure(report, 'sync_counts', trace_memory):
+            commands.sync_counts(badges=[BenchmarkRecipe.slug])
+
+        users_list = list(get_user_model().objects.filter(username__startswith=USERNAME_PREFIX)
+                                                  .order_by('pk')[:rendered_users])
+
+        with measure(report, 'templatetag', trace_memory):
+            TEMPLATE.render(Context({'users': users_list}))
+
+        with measure(report, 'reset_awards', trace_memory):
+            commands.reset_awards(badges=[BenchmarkRecipe.slug])
+    finally:
+        registry.unregister(BenchmarkRecipe)
+        if not keep:
+            cleanup()
+
+    report['peak_rss_kb'] = get_peak_rss()
+
+    return report
+
+
+def compare(old, new):
+    """
+    Compares two reports and returns a dict: phase -> metric -> ratio
+    (new / old).
+    """
+    results = {}
+    for phase, metrics in new['phases'].items():
+        if phase not in old['phases']:
+            continue
+        results[phase] = {}
+        for metric, value in metrics.items():
+            old_value = old['phases'][phase].get(metric)
+            if old_value and value is not None:
+                results[phase][metric] = round(float(value) / old_value, 3)
+    return results
+
+
+def dump(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,129 @@
+import logging
+
+from django.core.cache import caches
+
+from . import settings
+
+logger = logging.getLogger('badgify')
+
+VERSION_KEY = '%s:version'
+USER_BADGES_KEY = '%s:%s:user:%s:badges'
+USERNAME_KEY = '%s:%s:username:%s'
+
+
+def get_cache():
+    """
+    Returns the cache backend used by badgify.
+    """
+    return caches[settings.CACHE_ALIAS]
+
+
+def get_version():
+    """
+    Returns the current version of cached data.
+    """
+    cache = get_cache()
+    key = VERSION_KEY % settings.CACHE_KEY_PREFIX
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, timeout=None)
+        version = cache.get(key, 1)
+    return version
+
+
+def invalidate_all():
+    """
+    Invalidates all cached data at once (bumps the version).
+    """
+    if not settings.CACHE_ENABLED:
+        return
+    cache = get_cache()
+    key = VERSION_KEY % settings.CACHE_KEY_PREFIX
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, get_version() + 1, timeout=None)
+
+
+def get_user_badges_key(user_id, version=None):
+    return USER_BADGES_KEY % (settings.CACHE_KEY_PREFIX,
+                              version or get_version(),
+                              user_id)
+
+
+def get_users_badge_ids(user_ids):
+    """
+    Returns a dict: user id -> list of awarded badge ids. Users missing from
+    the cache are fetched with a single query.
+    """
+    from .models import Award
+
+    user_ids = list(user_ids)
+    results = dict((user_id, []) for user_id in user_ids)
+
+    if not settings.CACHE_ENABLED:
+        missing = user_ids
+    else:
+        version = get_version()
+        keys = dict((get_user_badges_key(user_id, version), user_id) for user_id in user_ids)
+        cached = get_cache().get_many(list(keys))
+        for key, badge_ids in cached.items():
+            results[keys[key]] = badge_ids
+        missing = [user_id for key, user_id in keys.items() if key not in cached]
+
+    if not missing:
+        return results
+
+    awards = (Award.objects.filter(user_id__in=missing)
+                           .order_by('awarded_at', 'pk')
+                           .values_list('user_id', 'badge_id'))
+    for user_id, badge_id in awards:
+        results[user_id].append(badge_id)
+
+    if settings.CACHE_ENABLED:
+        get_cache().set_many(
+            dict((get_user_badges_key(user_id, version), results[user_id]) for user_id in missing),
+            timeout=settings.CACHE_TIMEOUT)
+
+    return results
+
+
+def get_user_badge_ids(user_id):
+    """
+    Returns awarded badge ids of the given user.
+    """
+    return get_users_badge_ids([user_id])[user_id]
+
+
+def invalidate_user_badges(user_ids):
+    """
+    Invalidates cached badge ids of the given users.
+    """
+    if not settings.CACHE_ENABLED:
+        return
+    version = get_version()
+    get_cache().delete_many([get_user_badges_key(user_id, version) for user_id in user_ids])
+
+
+def get_user_id_for_username(username):
+    """
+    Returns the id of the user with the given username or ``None``.
+    """
+    from .compat import get_user_model
+
+    User = get_user_model()
+
+    if settings.CACHE_ENABLED:
+        key = USERNAME_KEY % (settings.CACHE_KEY_PREFIX, get_version(), username)
+        user_id = get_cache().get(key)
+        if user_id is not None:
+            return user_id
+
+    user_id = (User.objects.filter(username=username)
+                           .values_list('pk', flat=True)
+                           .first())
+
+    if settings.CACHE_ENABLED and user_id is not None:
+        get_cache().set(key, user_id, timeout=settings.CACHE_TIMEOUT)
+
+    return user_id
@@ -0,0 +1,152 @@
+import logging
+import time
+import uuid
+
+from django.db import DEFAULT_DB_ALIAS
+
+from . import settings
+from .cache import get_cache
+
+logger = logging.getLogger('badgify')
+
+VERSION_KEY = '%s:catalogue:version'
+
+
+class BadgeCatalogue(object):
+    """
+    Process-wide catalogue of badges (slug -> badge and id -> badge) loaded
+    with a single query per database. The catalogue is reloaded when its
+    version (stored in the cache and bumped when a badge is saved or deleted)
+    differs, checked at most every ``BADGIFY_CATALOGUE_CHECK_INTERVAL``
+    seconds, or after ``BADGIFY_CATALOGUE_TIMEOUT`` seconds (award counts
+    are refreshed this way).
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """
+        Empties the catalogue (reloaded on next access).
+        """
+        self._catalogues = {}
+
+    @property
+    def version_key(self):
+        return VERSION_KEY % settings.CACHE_KEY_PREFIX
+
+    def get_version(self):
+        """
+        Returns the current version of the catalogue.
+        """
+        cache = get_cache()
+        version = cache.get(self.version_key)
+        if version is None:
+            cache.add(self.version_key, uuid.uuid4().hex, timeout=None)
+            version = cache.get(self.version_key)
+        return version
+
+    def bump_version(self):
+        """
+        Invalidates catalogues of all processes sharing the cache.
+        """
+        get_cache().set(self.version_key, uuid.uuid4().hex, timeout=None)
+        self.clear()
+
+    def load(self, using=DEFAULT_DB_ALIAS):
+        """
+        Loads all badges from the given database.
+        """
+        from .models import Badge
+
+        version = self.get_version()
+        badges = list(Badge.objects.using(using).all())
+        now = time.time()
+        catalogue = {
+            'version': version,
+            'loaded_at': now,
+            'checked_at': now,
+            'slugs': dict((badge.slug, badge) for badge in badges),
+            'ids': dict((badge.pk, badge) for badge in badges),
+        }
+        self._catalogues[using] = catalogue
+        logger.debug('✓ Badge catalogue: %d badges loaded from db (%s)', len(badges), using)
+        return catalogue
+
+    def is_stale(self, catalogue):
+        """
+        Returns ``True`` if the given loaded catalogue must be reloaded.
+        """
+        if catalogue is None or catalogue['version'] is None:
+            return True
+        now = time.time()
+        if now - catalogue['loaded_at'] > settings.CATALOGUE_TIMEOUT:
+            return True
+        if now - catalogue['checked_at'] < settings.CATALOGUE_CHECK_INTERVAL:
+            return False
+        catalogue['checked_at'] = now
+        return catalogue['version'] != self.get_version()
+
+    def get_catalogue(self, using=DEFAULT_DB_ALIAS):
+        """
+        Returns the loaded catalogue of the given database (reloads it if
+        stale).
+        """
+        catalogue = self._catalogues.get(using)
+        if self.is_stale(catalogue):
+            catalogue = self.load(using=using)
+        return catalogue
+
+    def all(self, using=DEFAULT_DB_ALIAS):
+        """
+        Returns all badges.
+        """
+        return list(self.get_catalogue(using)['ids'].values())
+
+    def get(self, slug, using=DEFAULT_DB_ALIAS):
+        """
+        Returns the badge with the given slug or ``None``.
+        """
+        badge = self.get_catalogue(using)['slugs'].get(slug)
+        if badge is None:
+            badge = self._reload_if_exists(using, slug=slug)
+        return badge
+
+    def get_by_id(self, pk, using=DEFAULT_DB_ALIAS):
+        """
+        Returns the badge with the given id or ``None``.
+        """
+        badge = self.get_catalogue(using)['ids'].get(pk)
+        if badge is None:
+            badge = self._reload_if_exists(using, pk=pk)
+        return badge
+
+    def in_bulk(self, pks, using=DEFAULT_DB_ALIAS):
+        """
+        Returns a dict: id -> badge for the given badge ids.
+        """
+        badges = self.get_catalogue(using)['ids']
+        if any(pk not in badges for pk in pks):
+            self._reload_if_exists(using, pk__in=pks)
+            badges = self.get_catalogue(using)['ids']
+        return dict((pk, badges[pk]) for pk in pks if pk in badges)
+
+    def _reload_if_exists(self, using, **lookup):
+        """
+        Handles catalogue misses: badges created by another process are
+        loaded without waiting for the catalogue timeout.
+        """
+        from .models import Badge
+
+        if not Badge.objects.using(using).filter(**lookup).exists():
+            return None
+
+        catalogue = self.load(using=using)
+        if 'slug' in lookup:
+            return catalogue['slugs'].get(lookup['slug'])
+        if 'pk' in lookup:
+            return catalogue['ids'].get(lookup['pk'])
+        return None
+
+
+catalogue = BadgeCatalogue()
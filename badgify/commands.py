@@ -1,11 +1,20 @@
 import logging
+import time
+import traceback
 
-from django.db import reset_queries, DEFAULT_DB_ALIAS
-from django.db.models import Count, signals
+from concurrent import futures
+
+from django.db import connections, reset_queries, router, transaction, DEFAULT_DB_ALIAS
+from django.db.models import Count
 
 from . import registry
 from . import settings
-from .models import Badge, Award
+from .cache import invalidate_all
+from .instrumentation import RecipeMetrics, format_batch_sizes, format_executions, write_metrics
+from .membership import membership
+from .models import Badge, Award, Checkpoint
+from .recipe import TieredRecipe, set_awards_changed_at
+from .routers import get_read_database
 from .utils import log_queries
 
 logger = logging.getLogger('badgify')
@@ -33,21 +42,52 @@ def sync_counts(**kwargs):
     """
     Iterates over registered recipes and denormalizes ``Badge.users.count()``
     into ``Badge.users_count`` field.
+
+    Counts of all badges are computed with one grouped aggregate on ``Award``
+    and changed ones are saved with a single ``UPDATE``.
     """
     badges = kwargs.get('badges')
     excluded = kwargs.get('exclude_badges')
 
     instances = registry.get_recipe_instances(badges=badges, excluded=excluded)
+    slugs = [instance.slug for instance in instances]
     updated_badges, unchanged_badges = [], []
 
-    for instance in instances:
-        reset_queries()
-        badge, updated = instance.update_badge_users_count()
-        if updated:
+    badge_objects = {badge.slug: badge for badge in Badge.objects.filter(slug__in=slugs)}
+
+    users_counts = dict(Award.objects.filter(badge__slug__in=slugs)
+                                     .order_by()
+                                     .values('badge_id')
+                                     .annotate(users_count=Count('id'))
+                                     .values_list('badge_id', 'users_count'))
+
+    for slug in slugs:
+        badge = badge_objects.get(slug)
+
+        if not badge:
+            logger.debug(
+                '✘ Badge %s: does not exist in the database (run badgify_sync badges)',
+                slug)
+            unchanged_badges.append(slug)
+            continue
+
+        old_value, new_value = badge.users_count, users_counts.get(badge.id, 0)
+
+        if old_value != new_value:
+            badge.users_count = new_value
             updated_badges.append(badge)
+            logger.debug('✓ Badge %s: updated users count (from %d to %d)',
+                         slug,
+                         old_value,
+                         new_value)
         else:
             unchanged_badges.append(badge)
-        log_queries(instance)
+            logger.debug('✓ Badge %s: users count up-to-date (%d)',
+                         slug,
+                         new_value)
+
+    if updated_badges:
+        Badge.objects.bulk_update(updated_badges, ['users_count'])
 
     return (updated_badges, unchanged_badges)
 
@@ -55,12 +95,31 @@ def sync_counts(**kwargs):
 def sync_awards(**kwargs):
     """
     Iterates over registered recipes and possibly creates awards.
+    With ``use_replicas``, recipes read from the first replica that is not
+    lagging (see ``badgify.routers.get_read_database()``).
+    Recipes are sorted by dependency (``depends_on``): recipes of a level are
+    run in ``workers`` processes (or threads if ``worker_type`` is
+    ``"thread"``) when ``workers`` is greater than 1. Recipes whose
+    dependencies did not change are skipped.
+    Returns a list of per-recipe results (``badge``, ``duration``,
+    ``error``, ``metrics`` and ``unchanged`` keys, ``skipped`` for skipped recipes).
+    Recipes whose awards match ``user_ids`` checksums are ``unchanged``. Metrics are written to
+    ``metrics_file`` (in ``metrics_format``) if given.
     """
     badges = kwargs.get('badges')
     excluded = kwargs.get('exclude_badges')
     disable_signals = kwargs.get('disable_signals')
     batch_size = kwargs.get('batch_size', None)
     db_read = kwargs.get('db_read', None)
+    diff_engine = kwargs.get('diff_engine', None)
+    incremental = kwargs.get('incremental', False)
+    loader = kwargs.get('loader', None)
+    adaptive_batch_size = kwargs.get('adaptive_batch_size', None)
+    use_replicas = kwargs.get('use_replicas', False)
+    workers = kwargs.get('workers', None) or 1
+    worker_type = kwargs.get('worker_type', None) or 'process'
+    metrics_file = kwargs.get('metrics_file', None)
+    metrics_format = kwargs.get('metrics_format', None) or 'prometheus'
 
     award_post_save = True
 
@@ -69,14 +128,251 @@ def sync_awards(**kwargs):
         award_post_save = False
 
     instances = registry.get_recipe_instances(badges=badges, excluded=excluded)
+    levels = registry.get_recipe_levels(instances)
 
+    # Scores of tiered recipes are evaluated once per run
     for instance in instances:
-        reset_queries()
-        instance.create_awards(
-            batch_size=batch_size,
-            db_read=db_read,
-            post_save_signal=award_post_save)
-        log_queries(instance)
+        if isinstance(instance, TieredRecipe):
+            instance.clear_scores()
+
+    options = {
+        'batch_size': batch_size,
+        'db_read': db_read,
+        'post_save_signal': award_post_save,
+        'diff_engine': diff_engine,
+        'incremental': incremental,
+        'loader': loader,
+        'adaptive_batch_size': adaptive_batch_size,
+        'use_replicas': use_replicas,
+    }
+
+    results = []
+    changed = {}
+
+    # Recipes of a level only depend on recipes of previous levels
+    for level in levels:
+        slugs, skipped = [], []
+        for instance in level:
+            if _can_skip_recipe(instance, changed):
+                skipped.append(instance.slug)
+            else:
+                slugs.append(instance.slug)
+
+        if workers > 1 and len(slugs) > 1:
+            level_results = _sync_awards_in_pool(slugs, options, workers=workers, worker_type=worker_type)
+        else:
+            level_results = [_sync_recipe_awards(slug, options) for slug in slugs]
+
+        for slug in skipped:
+            level_results.append({'badge': slug,
+                                  'duration': 0,
+                                  'error': None,
+                                  'metrics': None,
+                                  'skipped': True})
+
+        for result in level_results:
+            changed[result['badge']] = _has_changed(result)
+
+        # Awards changed without signals (or by failed syncs) are recorded too
+        changed_slugs = [result['badge'] for result in level_results if changed[result['badge']]]
+        if changed_slugs:
+            set_awards_changed_at(changed_slugs)
+
+        results.extend(level_results)
+
+    # Without signals, cached badges of awarded / unawarded users are unknown
+    if disable_signals:
+        invalidate_all()
+
+    for result in results:
+        if result['error']:
+            logger.error('✘ Badge %s: failed after %.2f second(s)\n%s',
+                         result['badge'],
+                         result['duration'],
+                         result['error'])
+        elif result.get('skipped'):
+            logger.debug('✓ Badge %s: skipped (awards of its dependencies did not change)',
+                         result['badge'])
+        elif result.get('unchanged'):
+            logger.debug('✓ Badge %s: unchanged (checksum) in %.2f second(s)',
+                         result['badge'],
+                         result['duration'])
+        else:
+            logger.debug('✓ Badge %s: awards synced in %.2f second(s)',
+                         result['badge'],
+                         result['duration'])
+            executions = (result.get('metrics') or {}).get('executions')
+            if executions:
+                logger.debug('✓ Badge %s: recipe queries executed (%s)',
+                             result['badge'],
+                             format_executions(executions))
+            batch_sizes = (result.get('metrics') or {}).get('batch_sizes', {})
+            for name, sizes in sorted(batch_sizes.items()):
+                if sizes['batches']:
+                    logger.debug('✓ Badge %s: %s batch sizes %s',
+                                 result['badge'],
+                                 name,
+                                 format_batch_sizes(sizes))
+
+    if metrics_file:
+        write_metrics(results, metrics_file, metrics_format=metrics_format)
+
+    return results
+
+
+def _can_skip_recipe(instance, changed):
+    """
+    Returns ``True`` if all dependencies of the recipe have been synced in
+    this run without changing their awards and if their awards did not
+    change since the last successful sync of the recipe (in a run where the
+    recipe failed, by ``evaluate_user``, the admin...).
+    """
+    if not instance.depends_on:
+        return False
+    for slug in instance.depends_on:
+        if slug not in changed or changed[slug]:
+            return False
+    synced_at = instance.get_last_synced_at()
+    if synced_at is None:
+        return False
+    changed_at = dict(Checkpoint.objects.filter(slug__in=instance.depends_on)
+                                        .values_list('slug', 'awards_changed_at'))
+    return all(changed_at.get(slug) is not None and changed_at[slug] < synced_at
+               for slug in instance.depends_on)
+
+
+def _has_changed(result):
+    """
+    Returns ``True`` if awards may have changed during the given sync result
+    (failed syncs are considered changed).
+    """
+    if result.get('skipped'):
+        return False
+    if result['error'] or not result.get('metrics'):
+        return True
+    counters = result['metrics']['counters']
+    return bool(counters.get('awarded') or counters.get('unawarded'))
+
+
+def _sync_recipe_awards(slug, options, close_connections=False):
+    """
+    Creates awards for the given recipe slug. Exceptions are caught and
+    returned in the result so that one broken recipe does not stop the run.
+    """
+    result = {'badge': slug, 'duration': 0, 'error': None}
+    start = time.time()
+
+    metrics = RecipeMetrics(slug)
+    options = dict(options)
+
+    try:
+        # Replicas lag is checked before each recipe
+        if options.pop('use_replicas', False) and not options.get('db_read'):
+            options['db_read'] = get_read_database()
+        instance = registry.get_recipe_instance(slug)
+        instance.create_awards(metrics=metrics, **options)
+        # Bulk syncs do not know awarded users: membership is rebuilt when
+        # awards changed (or when it is missing)
+        changed = bool(metrics.counters.get('awarded') or metrics.counters.get('unawarded'))
+        if membership.enabled and (changed or not membership.exists(slug)):
+            with metrics.phase('membership'):
+                membership.build(slug, force=changed)
+    except Exception:
+        result['error'] = traceback.format_exc()
+    finally:
+        metrics.log()
+        result['metrics'] = metrics.as_dict()
+        result['unchanged'] = bool(metrics.counters.get('unchanged'))
+        if close_connections:
+            connections.close_all()
+
+    result['duration'] = time.time() - start
+
+    return result
+
+
+def _init_sync_worker(auto_denormalize):
+    """
+    Initializes a worker process (Django setup and settings of the parent).
+    """
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+
+    settings.AUTO_DENORMALIZE = auto_denormalize
+
+
+def _get_sync_jobs(slugs):
+    """
+    Groups the given recipe slugs in jobs (lists of slugs): tiers of the
+    same family are synced by the same job, so that their scores are
+    evaluated once.
+    """
+    jobs, families = [], {}
+    for slug in slugs:
+        instance = registry.get_recipe_instance(slug)
+        if isinstance(instance, TieredRecipe):
+            job = families.get(id(instance._family))
+            if job is not None:
+                job.append(slug)
+                continue
+            job = families[id(instance._family)] = [slug]
+        else:
+            job = [slug]
+        jobs.append(job)
+    return jobs
+
+
+def _sync_recipes_awards(slugs, options, close_connections=False):
+    """
+    Creates awards for the given recipe slugs, one after the other.
+    """
+    try:
+        return [_sync_recipe_awards(slug, options) for slug in slugs]
+    finally:
+        if close_connections:
+            connections.close_all()
+
+
+def _sync_awards_in_pool(slugs, options, workers, worker_type='process'):
+    """
+    Fans recipes out to a process (or thread) pool and gathers results in
+    the recipes order. Each worker uses its own database connections. Tiers
+    of a family are synced by the same worker.
+    """
+    jobs = _get_sync_jobs(slugs)
+    if len(jobs) == 1:
+        return _sync_recipes_awards(jobs[0], options)
+
+    if worker_type == 'thread':
+        executor = futures.ThreadPoolExecutor(max_workers=workers)
+    else:
+        # Forked processes must not share the parent connections.
+        connections.close_all()
+        executor = futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_sync_worker,
+            initargs=(settings.AUTO_DENORMALIZE, ))
+
+    with executor:
+        futures_jobs = [executor.submit(_sync_recipes_awards, job, options, close_connections=True)
+                        for job in jobs]
+
+        results = {}
+        for job, future in zip(jobs, futures_jobs):
+            try:
+                results.update((result['badge'], result) for result in future.result())
+            except Exception:
+                # The worker itself died (eg. killed process)
+                error = traceback.format_exc()
+                results.update((slug, {'badge': slug,
+                                       'duration': 0,
+                                       'error': error,
+                                       'metrics': None}) for slug in job)
+
+    return [results[slug] for slug in slugs]
 
 
 def show_stats(**kwargs):
@@ -109,24 +405,29 @@ def reset_awards(**kwargs):
             if not isinstance(option, (list, tuple)):
                 option = [option]
 
-    signals.pre_delete.disconnect(sender=Award,
-                                  dispatch_uid='badgify.award.pre_delete.decrement_badge_users_count')
-
     award_qs = Award.objects.all()
     badge_qs = Badge.objects.all()
 
     if filter_badges:
-        award_qs = award_qs.filter(badge__slug__in=filter_badges)
         badge_qs = badge_qs.filter(slug__in=filter_badges)
 
     if exclude_badges:
-        award_qs = award_qs.exclude(badge__slug__in=exclude_badges)
         badge_qs = badge_qs.exclude(slug__in=exclude_badges)
 
-    awards_count = award_qs.count()
-    award_qs.delete()
-    logger.info('✓ Deleted %d awards', awards_count)
+    if filter_badges or exclude_badges:
+        award_qs = award_qs.filter(badge_id__in=list(badge_qs.values_list('pk', flat=True)))
 
-    badges_count = badge_qs.count()
-    badge_qs.update(users_count=0)
+    # Set-based: awards are neither loaded nor sent to delete signals,
+    # counts are reset below.
+    using = router.db_for_write(Award)
+    with transaction.atomic(using=using):
+        awards_count = award_qs._raw_delete(using)
+        badges_count = badge_qs.update(users_count=0)
+        set_awards_changed_at(badge_qs.values('slug'))
+
+    invalidate_all()
+    if membership.enabled:
+        for slug in badge_qs.values_list('slug', flat=True):
+            membership.invalidate(slug)
+    logger.info('✓ Deleted %d awards', awards_count)
     logger.info('✓ Reseted Badge.users_count field of %d badge(s)', badges_count)
@@ -20,3 +20,18 @@ try:
     from django.utils.translation import gettext_lazy as gettext_lazy
 except ImportError:
     from django.utils.translation import gettext_lazy  # noqa
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyroaring
+except ImportError:
+    pyroaring = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
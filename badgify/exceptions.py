@@ -1,2 +1,6 @@
 class BadgeNotFound(Exception):
     pass
+
+
+class CircularDependency(Exception):
+    pass
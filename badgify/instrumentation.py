@@ -0,0 +1,241 @@
+import logging
+import os
+import tempfile
+import time
+
+from contextlib import contextmanager, nullcontext, ExitStack
+
+from django.db import connections
+
+logger = logging.getLogger('badgify')
+
+METRICS_FORMATS = ('prometheus', 'statsd')
+
+
+class QueryCounter(object):
+    """
+    Counts queries and rows (DB-API ``rowcount``, when reported by the
+    backend) executed on connections. Works with ``DEBUG = False``.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        self.queries += 1
+        rowcount = getattr(context['cursor'], 'rowcount', -1)
+        if rowcount and rowcount > 0:
+            self.rows += rowcount
+        return result
+
+
+@contextmanager
+def count_queries(counter, aliases=None):
+    """
+    Installs ``counter`` as execute wrapper of the given database
+    connections (all of them by default).
+    """
+    with ExitStack() as stack:
+        for alias in aliases or connections:
+            stack.enter_context(connections[alias].execute_wrapper(counter))
+        yield counter
+
+
+class RecipeMetrics(object):
+    """
+    Timers, query and row counts of each phase of a recipe sync (badge,
+    diff, delete, insert, denormalize...) and counters (awarded, unawarded...).
+    """
+
+    def __init__(self, slug):
+        self.slug = slug
+        self.phases = {}
+        self.counters = {}
+        # BatchSize objects of award writes ("insert" and "delete")
+        self.batch_sizes = {}
+        # How many times each recipe query (user_ids...) was executed
+        self.executions = {}
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Measures the wrapped block as the ``name`` phase (accumulated if the
+        phase is run several times, for each batch).
+        """
+        counter = QueryCounter()
+        start = time.time()
+        try:
+            with count_queries(counter):
+                yield
+        finally:
+            phase = self.phases.setdefault(name, {'time': 0.0, 'queries': 0, 'rows': 0})
+            phase['time'] += time.time() - start
+            phase['queries'] += counter.queries
+            phase['rows'] += counter.rows
+
+    @contextmanager
+    def query(self, name):
+        """
+        Counts queries executed by the wrapped block as executions of the
+        ``name`` recipe query.
+        """
+        counter = QueryCounter()
+        try:
+            with count_queries(counter):
+                yield
+        finally:
+            self.executions[name] = self.executions.get(name, 0) + counter.queries
+
+    def incr(self, name, value=1):
+        """
+        Increments the ``name`` counter.
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    @property
+    def time(self):
+        return sum(phase['time'] for phase in self.phases.values())
+
+    @property
+    def queries(self):
+        return sum(phase['queries'] for phase in self.phases.values())
+
+    def as_dict(self):
+        return {
+            'badge': self.slug,
+            'phases': dict((name, dict(phase)) for name, phase in self.phases.items()),
+            'counters': dict(self.counters),
+            'batch_sizes': dict((name, batch_size.as_dict())
+                                for name, batch_size in self.batch_sizes.items()),
+            'executions': dict(self.executions),
+        }
+
+    def log(self):
+        for name, phase in sorted(self.phases.items()):
+            logger.debug('⚐ Badge %s: %s %.2f second(s), %d queries, %d rows',
+                         self.slug,
+                         name,
+                         phase['time'],
+                         phase['queries'],
+                         phase['rows'])
+        if self.executions:
+            logger.debug('⚐ Badge %s: recipe queries executed (%s)',
+                         self.slug,
+                         format_executions(self.executions))
+        for name, batch_size in sorted(self.batch_sizes.items()):
+            logger.debug('⚐ Badge %s: %s batch sizes %s',
+                         self.slug,
+                         name,
+                         format_batch_sizes(batch_size.as_dict()))
+
+
+def format_executions(executions):
+    """
+    Formats recipe queries executions for humans.
+    """
+    return ', '.join('%s: %d' % (name, count) for name, count in sorted(executions.items()))
+
+
+def format_batch_sizes(batch_sizes):
+    """
+    Formats a ``BatchSize.as_dict()`` for humans.
+    """
+    return '%(batches)d batch(es), %(min)d-%(max)d rows, last %(last)d' % batch_sizes
+
+
+def measure_query(metrics, name):
+    """
+    Returns ``metrics.query(name)`` or a no-op context manager if
+    ``metrics`` is ``None``.
+    """
+    if metrics is None:
+        return nullcontext()
+    return metrics.query(name)
+
+
+def measure_phase(metrics, name):
+    """
+    Returns ``metrics.phase(name)`` or a no-op context manager if
+    ``metrics`` is ``None``.
+    """
+    if metrics is None:
+        return nullcontext()
+    return metrics.phase(name)
+
+
+def format_prometheus(results):
+    """
+    Formats sync results (with metrics dicts) in Prometheus text format.
+    """
+    lines = [
+        '# TYPE badgify_recipe_duration_seconds gauge',
+        '# TYPE badgify_recipe_failed gauge',
+        '# TYPE badgify_phase_duration_seconds gauge',
+        '# TYPE badgify_phase_queries gauge',
+        '# TYPE badgify_phase_rows gauge',
+        '# TYPE badgify_counter gauge',
+        '# TYPE badgify_batch_size gauge',
+        '# TYPE badgify_query_executions gauge',
+    ]
+    for result in results:
+        badge = result['badge']
+        lines.append('badgify_recipe_duration_seconds{badge="%s"} %f' % (badge, result['duration']))
+        lines.append('badgify_recipe_failed{badge="%s"} %d' % (badge, 1 if result['error'] else 0))
+        metrics = result.get('metrics') or {}
+        for name, phase in sorted(metrics.get('phases', {}).items()):
+            labels = 'badge="%s",phase="%s"' % (badge, name)
+            lines.append('badgify_phase_duration_seconds{%s} %f' % (labels, phase['time']))
+            lines.append('badgify_phase_queries{%s} %d' % (labels, phase['queries']))
+            lines.append('badgify_phase_rows{%s} %d' % (labels, phase['rows']))
+        for name, value in sorted(metrics.get('counters', {}).items()):
+            lines.append('badgify_counter{badge="%s",name="%s"} %s' % (badge, name, value))
+        for name, batch_size in sorted(metrics.get('batch_sizes', {}).items()):
+            lines.append('badgify_batch_size{badge="%s",operation="%s"} %d' % (badge, name, batch_size['last']))
+        for name, count in sorted(metrics.get('executions', {}).items()):
+            lines.append('badgify_query_executions{badge="%s",query="%s"} %d' % (badge, name, count))
+    return '\n'.join(lines) + '\n'
+
+
+def format_statsd(results):
+    """
+    Formats sync results (with metrics dicts) as StatsD lines.
+    """
+    lines = []
+    for result in results:
+        prefix = 'badgify.%s' % result['badge']
+        lines.append('%s.duration:%d|ms' % (prefix, result['duration'] * 1000))
+        lines.append('%s.failed:%d|g' % (prefix, 1 if result['error'] else 0))
+        metrics = result.get('metrics') or {}
+        for name, phase in sorted(metrics.get('phases', {}).items()):
+            lines.append('%s.%s.duration:%d|ms' % (prefix, name, phase['time'] * 1000))
+            lines.append('%s.%s.queries:%d|g' % (prefix, name, phase['queries']))
+            lines.append('%s.%s.rows:%d|g' % (prefix, name, phase['rows']))
+        for name, value in sorted(metrics.get('counters', {}).items()):
+            lines.append('%s.%s:%s|g' % (prefix, name, value))
+        for name, batch_size in sorted(metrics.get('batch_sizes', {}).items()):
+            lines.append('%s.%s.batch_size:%d|g' % (prefix, name, batch_size['last']))
+        for name, count in sorted(metrics.get('executions', {}).items()):
+            lines.append('%s.queries.%s:%d|g' % (prefix, name, count))
+    return '\n'.join(lines) + '\n'
+
+
+def write_metrics(results, path, metrics_format='prometheus'):
+    """
+    Writes sync results metrics to the given file (atomic file replacement,
+    collectors never read a partially written file).
+    """
+    formatter = format_statsd if metrics_format == 'statsd' else format_prometheus
+    content = formatter(results)
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.%s.' % os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        # mkstemp() creates files only readable by their owner
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
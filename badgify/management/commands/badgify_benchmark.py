@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import json
+
+from django.core.management.base import BaseCommand
+
+from badgify import benchmark
+
+
+class Command(BaseCommand):
+    """
+    Command that benchmarks the awarding pipeline.
+    """
+    help = 'Benchmarks the awarding pipeline on synthetic users'
+
+    def add_arguments(self, parser):
+        """
+        Command arguments.
+        """
+        parser.add_argument('--users',
+                            action='store',
+                            dest='users',
+                            default=10000,
+                            type=int)
+
+        parser.add_argument('--batch-size',
+                            action='store',
+                            dest='batch_size',
+                            type=int)
+
+        parser.add_argument('--diff-engine',
+                            action='store',
+                            dest='diff_engine',
+                            choices=['sql', 'python', 'numpy', 'stream'],
+                            type=str)
+
+        parser.add_argument('--output',
+                            action='store',
+                            dest='output',
+                            type=str)
+
+        parser.add_argument('--compare',
+                            action='store',
+                            dest='compare',
+                            type=str)
+
+        parser.add_argument('--keep',
+                            action='store_true',
+                            dest='keep')
+
+        parser.add_argument('--trace-memory',
+                            action='store_true',
+                            dest='trace_memory')
+
+    def handle(self, **options):
+        """
+        Command handler.
+        """
+        report = benchmark.run(users=options['users'],
+                               batch_size=options['batch_size'],
+                               diff_engine=options['diff_engine'],
+                               keep=options['keep'],
+                               trace_memory=options['trace_memory'])
+
+        if options['output']:
+            benchmark.dump(report, options['output'])
+
+        self.stdout.write(json.dumps(report, indent=2, sort_keys=True))
+
+        if options['compare']:
+            ratios = benchmark.compare(benchmark.load(options['compare']), report)
+            self.stdout.write(json.dumps(ratios, indent=2, sort_keys=True))
@@ -27,6 +27,10 @@ class Command(LabelCommand):
                             dest='db_read',
                             type=str)
 
+        parser.add_argument('--use-replicas',
+                            action='store_true',
+                            dest='use_replicas')
+
         parser.add_argument('--disable-signals',
                             action='store_true',
                             dest='disable_signals')
@@ -36,6 +40,49 @@ class Command(LabelCommand):
                             dest='batch_size',
                             type=int)
 
+        parser.add_argument('--adaptive-batch-size',
+                            action='store_true',
+                            dest='adaptive_batch_size',
+                            default=None)
+
+        parser.add_argument('--diff-engine',
+                            action='store',
+                            dest='diff_engine',
+                            choices=['sql', 'python', 'numpy', 'stream'],
+                            type=str)
+
+        parser.add_argument('--loader',
+                            action='store',
+                            dest='loader',
+                            choices=['batch', 'copy'],
+                            type=str)
+
+        parser.add_argument('--incremental',
+                            action='store_true',
+                            dest='incremental')
+
+        parser.add_argument('--workers',
+                            action='store',
+                            dest='workers',
+                            type=int)
+
+        parser.add_argument('--worker-type',
+                            action='store',
+                            dest='worker_type',
+                            choices=['process', 'thread'],
+                            type=str)
+
+        parser.add_argument('--metrics-file',
+                            action='store',
+                            dest='metrics_file',
+                            type=str)
+
+        parser.add_argument('--metrics-format',
+                            action='store',
+                            dest='metrics_format',
+                            choices=['prometheus', 'statsd'],
+                            type=str)
+
         parser.add_argument('--update',
                             action='store_true',
                             dest='update')
@@ -52,4 +99,9 @@ class Command(LabelCommand):
         if not hasattr(commands, 'sync_%s' % label):
             raise CommandError('"%s" is not a valid command.' % label)
 
-        getattr(commands, 'sync_%s' % label)(**sanitize_command_options(options))
+        results = getattr(commands, 'sync_%s' % label)(**sanitize_command_options(options))
+
+        if label == 'awards':
+            failed = [result['badge'] for result in results if result['error']]
+            if failed:
+                raise CommandError('Awards sync failed for: %s' % ', '.join(failed))
@@ -0,0 +1,296 @@
+import bisect
+import heapq
+import logging
+import mmap
+import os
+import tempfile
+
+from array import array
+from contextlib import contextmanager
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import router
+
+from . import settings
+from .compat import fcntl, pyroaring
+
+logger = logging.getLogger('badgify')
+
+
+class SortedIds(object):
+    """
+    Sorted unique int64 user ids, backed by an ``array`` or by a memory
+    mapped file. Used as bitmap when pyroaring is not installed.
+    """
+
+    extension = 'ids'
+
+    def __init__(self, ids=(), buffer=None):
+        if buffer is not None:
+            self._ids = buffer
+        else:
+            self._ids = array('q', sorted(set(ids)))
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __contains__(self, user_id):
+        i = bisect.bisect_left(self._ids, user_id)
+        return i < len(self._ids) and self._ids[i] == user_id
+
+    def __and__(self, other):
+        small, large = sorted([self, other], key=len)
+        return SortedIds(user_id for user_id in small if user_id in large)
+
+    def __or__(self, other):
+        ids = array('q')
+        for user_id in heapq.merge(self, other):
+            if not ids or ids[-1] != user_id:
+                ids.append(user_id)
+        return SortedIds(buffer=ids)
+
+    def __sub__(self, other):
+        return SortedIds(buffer=array('q', (user_id for user_id in self if user_id not in other)))
+
+    def serialize(self):
+        return array('q', self._ids).tobytes()
+
+    @classmethod
+    def load(cls, path):
+        """
+        Memory maps the given file: ids are not read until accessed.
+        """
+        with open(path, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return cls()
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer=memoryview(buffer).cast('q'))
+
+
+class RoaringIds(object):
+    """
+    Roaring bitmap of user ids (pyroaring).
+    """
+
+    extension = 'roaring'
+
+    def __new__(cls, ids=()):
+        return getattr(pyroaring, 'BitMap64', pyroaring.BitMap)(ids)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size:
+                return cls()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                return getattr(pyroaring, 'BitMap64', pyroaring.BitMap).deserialize(buffer[:])
+
+
+def get_bitmap_class():
+    """
+    Returns ``RoaringIds`` if pyroaring is installed, ``SortedIds`` otherwise.
+    """
+    return RoaringIds if pyroaring is not None else SortedIds
+
+
+class MembershipIndex(object):
+    """
+    Process-wide index of badge holders: one compressed bitmap of user ids
+    per badge, persisted in ``BADGIFY_MEMBERSHIP_PATH`` (rebuilt by
+    ``badgify_sync awards`` and updated by award signals), memory mapped on
+    load and reloaded when the file changes. Writes of a bitmap are
+    serialized across processes with a lock file (POSIX). Missing bitmaps
+    are answered from the database until the next sync rebuilds them.
+    """
+
+    def __init__(self, bitmap_class=None):
+        self.bitmap_class = bitmap_class
+        self.clear()
+
+    def clear(self):
+        """
+        Empties loaded bitmaps (reloaded on next access).
+        """
+        self._bitmaps = {}
+
+    @property
+    def enabled(self):
+        return bool(settings.MEMBERSHIP_PATH)
+
+    def get_bitmap_class(self):
+        return self.bitmap_class or get_bitmap_class()
+
+    def get_path(self, slug):
+        if not settings.MEMBERSHIP_PATH:
+            raise ImproperlyConfigured('BADGIFY_MEMBERSHIP_PATH must be set to use badge membership bitmaps')
+        return os.path.join(settings.MEMBERSHIP_PATH, '%s.%s' % (slug, self.get_bitmap_class().extension))
+
+    @contextmanager
+    def lock(self, slug):
+        """
+        Exclusive lock of the bitmap of the given badge, held while it is
+        rebuilt or written.
+        """
+        path = '%s.lock' % self.get_path(slug)
+        directory = os.path.dirname(path)
+        if fcntl is None:
+            yield
+            return
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'a') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def exists(self, slug):
+        """
+        Returns ``True`` if the bitmap of the given badge has been persisted.
+        """
+        return os.path.exists(self.get_path(slug))
+
+    def load(self, slug):
+        """
+        Returns the persisted bitmap of the given badge or ``None``.
+        """
+        path = self.get_path(slug)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        loaded = self._bitmaps.get(slug)
+        if loaded is None or loaded[0] != mtime:
+            loaded = (mtime, self.get_bitmap_class().load(path))
+            self._bitmaps[slug] = loaded
+        return loaded[1]
+
+    def get(self, slug):
+        """
+        Returns the bitmap of user ids holding the given badge (queried from
+        awards, not persisted, if it is missing).
+        """
+        bitmap = self.load(slug)
+        if bitmap is None:
+            bitmap = self.get_bitmap_class()(self._get_awards(slug).values_list('user_id', flat=True)
+                                                                   .iterator(chunk_size=settings.BATCH_SIZE))
+        return bitmap
+
+    def save(self, slug, bitmap):
+        """
+        Persists the given bitmap (atomic file replacement).
+        """
+        path = self.get_path(slug)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.%s.' % slug)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(bitmap.serialize())
+        os.replace(tmp_path, path)
+        self._bitmaps.pop(slug, None)
+        return bitmap
+
+    def build(self, slug, using=None, force=True):
+        """
+        Rebuilds the bitmap of the given badge from its awards (user ids are
+        streamed from the database). Holds the lock of the bitmap, so that
+        it is not updated while being rebuilt. Unless ``force`` is ``True``,
+        a bitmap persisted by another process while waiting for the lock is
+        kept.
+        """
+        with self.lock(slug):
+            if not force and self.exists(slug):
+                return self.load(slug)
+            user_ids = (self._get_awards(slug, using=using)
+                            .values_list('user_id', flat=True)
+                            .iterator(chunk_size=settings.BATCH_SIZE))
+            bitmap = self.save(slug, self.get_bitmap_class()(user_ids))
+        logger.debug('✓ Badge %s: membership bitmap built (%d users)', slug, len(bitmap))
+        return bitmap
+
+    def invalidate(self, slug):
+        """
+        Deletes the bitmap of the given badge (answered from the database
+        until rebuilt).
+        """
+        self._bitmaps.pop(slug, None)
+        with self.lock(slug):
+            try:
+                os.remove(self.get_path(slug))
+            except OSError:
+                pass
+
+    def add(self, slug, user_ids):
+        """
+        Adds the given user ids to the persisted bitmap of the given badge
+        (missing bitmaps are left to the next rebuild).
+        """
+        return self._update(slug, lambda bitmap: bitmap | self.get_bitmap_class()(user_ids))
+
+    def discard(self, slug, user_ids):
+        """
+        Removes the given user ids from the persisted bitmap of the given
+        badge (missing bitmaps are left to the next rebuild).
+        """
+        return self._update(slug, lambda bitmap: bitmap - self.get_bitmap_class()(user_ids))
+
+    def _update(self, slug, func):
+        with self.lock(slug):
+            path = self.get_path(slug)
+            if not os.path.exists(path):
+                return None
+            return self.save(slug, func(self.get_bitmap_class().load(path)))
+
+    def _get_awards(self, slug, using=None):
+        from .models import Award
+
+        using = using or router.db_for_read(Award)
+        return Award.objects.using(using).filter(badge__slug=slug).order_by()
+
+    def has_badge(self, user_id, slug):
+        bitmap = self.load(slug)
+        if bitmap is None:
+            return self._get_awards(slug).filter(user_id=user_id).exists()
+        return user_id in bitmap
+
+    def count(self, slug):
+        bitmap = self.load(slug)
+        if bitmap is None:
+            return self._get_awards(slug).count()
+        return len(bitmap)
+
+    def intersection(self, *slugs):
+        """
+        Returns user ids holding all the given badges.
+        """
+        bitmaps = sorted((self.get(slug) for slug in slugs), key=len)
+        result = bitmaps[0]
+        for bitmap in bitmaps[1:]:
+            result = result & bitmap
+        return result
+
+    def union(self, *slugs):
+        """
+        Returns user ids holding any of the given badges.
+        """
+        result = self.get_bitmap_class()()
+        for slug in slugs:
+            result = result | self.get(slug)
+        return result
+
+    def difference(self, slug, *slugs):
+        """
+        Returns user ids holding the first badge but none of the others.
+        """
+        result = self.get(slug)
+        for other in slugs:
+            result = result - self.get(other)
+        return result
+
+
+membership = MembershipIndex()
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('badgify', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Checkpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slug', models.SlugField(help_text='The badge slug', max_length=255, unique=True, verbose_name='slug')),
+                ('synced_at', models.DateTimeField(help_text='Start date of the last successful awards sync', verbose_name='synced at')),
+            ],
+            options={
+                'verbose_name': 'checkpoint',
+                'verbose_name_plural': 'checkpoints',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('badgify', '0002_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='checkpoint',
+            name='awards_changed_at',
+            field=models.DateTimeField(help_text='Date of the last change of the badge awards', null=True, verbose_name='awards changed at'),
+        ),
+    ]
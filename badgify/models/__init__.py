@@ -8,6 +8,8 @@ from ..utils import load_class
 Badge = load_class(settings.BADGE_MODEL)
 Award = load_class(settings.AWARD_MODEL)
 
+from .checkpoint import Checkpoint  # noqa
+
 if django.VERSION < (1, 7):
     from .. import autodiscover
     autodiscover()
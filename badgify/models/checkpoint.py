@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from django.db import models
+
+from badgify.compat import gettext_lazy as _
+
+
+class Checkpoint(models.Model):
+    """
+    Last successful awards sync of a badge (high-water mark of incremental
+    recipes) and last change of its awards (checked before skipping recipes
+    depending on it).
+    """
+    slug = models.SlugField(
+        max_length=255,
+        unique=True,
+        verbose_name=_('slug'),
+        help_text=_('The badge slug'))
+
+    synced_at = models.DateTimeField(
+        verbose_name=_('synced at'),
+        help_text=_('Start date of the last successful awards sync'))
+
+    awards_changed_at = models.DateTimeField(
+        null=True,
+        verbose_name=_('awards changed at'),
+        help_text=_('Date of the last change of the badge awards'))
+
+    class Meta:
+        app_label = 'badgify'
+        verbose_name = _('checkpoint')
+        verbose_name_plural = _('checkpoints')
+
+    def __str__(self):
+        return '%s synced at %s' % (self.slug, self.synced_at)
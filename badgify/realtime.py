@@ -0,0 +1,222 @@
+import logging
+import threading
+import time
+
+from django.apps import apps
+from django.core.cache import caches
+from django.db import connections, transaction
+from django.db.models import signals
+from django.utils.module_loading import import_string
+
+from . import settings
+from .registry import registry
+
+logger = logging.getLogger('badgify')
+
+DEBOUNCE_KEY = '%s:debounce:%s:%s'
+DEBOUNCE_PENDING_KEY = '%s:debounce:%s:%s:pending'
+
+DEFAULT_TRIGGER_SIGNALS = (signals.post_save, signals.post_delete)
+
+# Maximum number of pending timers of timer_scheduler (per process)
+MAX_TIMERS = 100
+
+_timers = threading.BoundedSemaphore(MAX_TIMERS)
+
+# (model, signal) -> recipe slugs
+_triggers = {}
+
+
+def get_recipe_instances(recipes=None):
+    """
+    Returns recipe instances from badge slugs, recipe classes or instances.
+    Returns all registered recipes if ``recipes`` is ``None``.
+    """
+    from .recipe import BaseRecipe
+
+    if recipes is None:
+        return list(registry.get_recipe_instances())
+
+    if not isinstance(recipes, (list, tuple)):
+        recipes = [recipes]
+
+    instances = []
+    for recipe in recipes:
+        if isinstance(recipe, BaseRecipe):
+            instances.append(recipe)
+        elif isinstance(recipe, type):
+            instances.extend(registry.get_recipe_instances_from_class(recipe))
+        else:
+            instances.append(registry.get_recipe_instance(recipe))
+
+    return instances
+
+
+def evaluate_user(user, recipes=None, on_commit=False, debounce=True):
+    """
+    Checks the given recipes (all registered recipes by default) for a single
+    user (object or id) and awards / unawards the user.
+
+    If ``on_commit`` is ``True``, evaluation is delayed until the current
+    transaction is committed and ``None`` is returned. Otherwise, returns a
+    dict: badge slug -> ``True`` (awarded), ``False`` (unawarded) or ``None``
+    (unchanged). Recipes debounced for this user are not in the dict: they
+    are evaluated again once their ``debounce`` window ends.
+    """
+    user_id = getattr(user, 'pk', user)
+    instances = get_recipe_instances(recipes)
+
+    if on_commit:
+        transaction.on_commit(lambda: _evaluate_user(user_id, instances, debounce))
+        return None
+
+    return _evaluate_user(user_id, instances, debounce)
+
+
+def _evaluate_user(user_id, instances, debounce=True):
+    results = {}
+
+    for instance in instances:
+        if debounce and instance.debounce:
+            delay = _acquire_debounce(instance, user_id)
+            if delay is not None:
+                logger.debug('✘ Badge %s: user %s debounced', instance.slug, user_id)
+                _defer_evaluation(instance, user_id, delay)
+                continue
+        results[instance.slug] = instance.evaluate_user(user_id)
+
+    return results
+
+
+def _get_debounce_key(recipe, user_id, key=DEBOUNCE_KEY):
+    return key % (settings.CACHE_KEY_PREFIX, recipe.slug, user_id)
+
+
+def _acquire_debounce(recipe, user_id):
+    """
+    Returns ``None`` if the user has not been evaluated for the recipe
+    during the last ``recipe.debounce`` seconds (a new window starts),
+    otherwise the seconds left before the current window ends.
+    """
+    cache = caches[settings.CACHE_ALIAS]
+    key = _get_debounce_key(recipe, user_id)
+    now = time.time()
+    if cache.add(key, now, timeout=recipe.debounce):
+        return None
+    started_at = cache.get(key, now)
+    return max(started_at + recipe.debounce - now, 0)
+
+
+def _defer_evaluation(recipe, user_id, delay):
+    """
+    Evaluates the user again for the recipe once the debounce window ends
+    (trailing edge), with the ``BADGIFY_REALTIME_SCHEDULER`` scheduler: the
+    last change of the window is never lost. Only one evaluation is
+    deferred per window.
+    """
+    cache = caches[settings.CACHE_ALIAS]
+    if not cache.add(_get_debounce_key(recipe, user_id, key=DEBOUNCE_PENDING_KEY), 1,
+                     timeout=max(int(delay) + 1, 1)):
+        return
+    get_scheduler()(delay, recipe.slug, user_id)
+
+
+def evaluate_deferred(slug, user_id):
+    """
+    Evaluates a debounced user for the given badge slug and starts a new
+    debounce window. Called by schedulers once the window ends.
+    """
+    recipe = registry.get_recipe_instance(slug)
+    cache = caches[settings.CACHE_ALIAS]
+    cache.delete(_get_debounce_key(recipe, user_id, key=DEBOUNCE_PENDING_KEY))
+    cache.delete(_get_debounce_key(recipe, user_id))
+    return _evaluate_user(user_id, [recipe])
+
+
+def get_scheduler():
+    """
+    Returns the ``BADGIFY_REALTIME_SCHEDULER`` callable (or dotted path):
+    ``scheduler(delay, slug, user_id)`` must call
+    ``evaluate_deferred(slug, user_id)`` after ``delay`` seconds.
+    """
+    scheduler = settings.REALTIME_SCHEDULER
+    if scheduler is None:
+        return synchronous_scheduler
+    if isinstance(scheduler, str):
+        scheduler = import_string(scheduler)
+    return scheduler
+
+
+def synchronous_scheduler(delay, slug, user_id):
+    """
+    Default scheduler: evaluates right away, in the current process.
+    """
+    return evaluate_deferred(slug, user_id)
+
+
+def timer_scheduler(delay, slug, user_id):
+    """
+    Best-effort scheduler: evaluates after ``delay`` seconds in a daemon
+    thread of the current process. Pending evaluations are lost when the
+    process exits. Beyond ``MAX_TIMERS`` pending timers, evaluates right
+    away.
+    """
+    if not _timers.acquire(blocking=False):
+        return evaluate_deferred(slug, user_id)
+    timer = threading.Timer(delay, _run_in_thread, args=(evaluate_deferred, slug, user_id))
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+def _run_in_thread(func, *args):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('✘ Deferred evaluation failed')
+    finally:
+        _timers.release()
+        # Connections of the timer thread
+        connections.close_all()
+
+
+def _trigger_receiver(sender, instance, signal, **kwargs):
+    for slug in _triggers.get((sender, signal), ()):
+        if slug not in registry.recipes:
+            continue
+        recipe = registry.recipes[slug]
+        for user_id in recipe.get_triggered_user_ids(instance):
+            evaluate_user(user_id,
+                          recipes=[recipe],
+                          on_commit=settings.REALTIME_ON_COMMIT)
+
+
+def connect_triggers(recipes=None):
+    """
+    Connects signals of models declared in recipes ``triggers`` so that
+    affected users are evaluated in real-time.
+    """
+    for recipe in get_recipe_instances(recipes):
+        for trigger in recipe.triggers:
+            if isinstance(trigger, (list, tuple)):
+                model, trigger_signals = trigger[0], trigger[1:]
+            else:
+                model, trigger_signals = trigger, DEFAULT_TRIGGER_SIGNALS
+
+            if isinstance(model, str):
+                model = apps.get_model(model)
+
+            for signal in trigger_signals:
+                slugs = _triggers.setdefault((model, signal), [])
+                if recipe.slug not in slugs:
+                    slugs.append(recipe.slug)
+                signal.connect(_trigger_receiver, sender=model)
+
+
+def disconnect_triggers():
+    """
+    Disconnects all signals connected by ``connect_triggers()``.
+    """
+    for model, signal in _triggers:
+        signal.disconnect(_trigger_receiver, sender=model)
+    _triggers.clear()
@@ -1,18 +1,31 @@
+import bisect
+import io
+import itertools
 import logging
+import time
 
-from django.db import DEFAULT_DB_ALIAS, IntegrityError
-from django.db.models import signals
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections, router, transaction
+from django.db.models import DateTimeField, Exists, IntegerField, OuterRef, Value, signals
+from django.db.models.constants import OnConflict
+from django.db.models.functions import Coalesce
+from django.db.models.query import QuerySet
+from django.utils import timezone
 from django.utils.functional import cached_property
 
 from . import settings
-from .compat import get_user_model
-from .models import Badge, Award
-from .utils import chunks
+from .catalogue import catalogue
+from .compat import get_user_model, numpy
+from .instrumentation import (QueryCounter, RecipeMetrics, count_queries, measure_phase,
+                              measure_query)
+from .models import Badge, Award, Checkpoint
+from .signals import awards_bulk_created, awards_bulk_deleted
+from .utils import (BatchSize, chunks, get_checksum, get_max_batch_size, get_values_list_field,
+                    iter_batches, merge_sorted_diff, to_list)
 
 logger = logging.getLogger('badgify')
 
-PRE_DELETE_UID = 'badgify.award.pre_delete.decrement_badge_users_count'
-
 
 class BaseRecipe(object):
     """
@@ -34,6 +47,47 @@ class BaseRecipe(object):
     # How many awards to create at once
     batch_size = settings.BATCH_SIZE
 
+    # Whether batch_size is adjusted after each batch toward batch_target_time
+    # seconds per write query
+    adaptive_batch_size = settings.ADAPTIVE_BATCH_SIZE
+
+    batch_target_time = settings.BATCH_TARGET_TIME
+
+    # How to compute user ids to award / unaward: "sql" (in the database),
+    # "python" (in memory), "numpy" (in NumPy arrays, if installed) or
+    # "stream" (sorted merge-join, bounded memory)
+    diff_engine = settings.DIFF_ENGINE
+
+    # Whether full syncs compare checksums of user_ids and of awarded user
+    # ids (computed by the database) first, skipping the diff when they match
+    checksum = settings.CHECKSUM
+
+    # Whether awards are created / deleted with INSERT ... SELECT and DELETE
+    # queries, no user id leaving the database: True, False or None (when
+    # user_ids is a flat values_list() queryset and signals are disabled)
+    sql_mode = settings.SQL_MODE
+
+    # How to insert awards: "batch" (bulk INSERT of batch_size awards) or
+    # "copy" (COPY FROM STDIN on PostgreSQL, "batch" elsewhere)
+    loader = settings.LOADER
+
+    # Models (or "app_label.Model" strings) whose saves / deletes may change
+    # user_ids, for real-time awarding. Items can also be (model, signal)
+    # tuples; a model alone means post_save and post_delete.
+    triggers = ()
+
+    # Seconds during which a user is not evaluated again for this recipe
+    # (real-time awarding)
+    debounce = 0
+
+    # Slugs of badges whose awards are read by user_ids: they are synced
+    # first and this recipe is skipped if none of their awards changed
+    depends_on = ()
+
+    # Whether audit() needs user objects (otherwise they are only loaded
+    # when the "badgify" logger is enabled for DEBUG)
+    audit_users = False
+
     @property
     def image(self):
         raise NotImplementedError('Image must be implemented')
@@ -44,7 +98,7 @@ class BaseRecipe(object):
 
     @property
     def badge(self):
-        return self.cached_badge or self.uncached_badge
+        return self.get_badge()
 
     @cached_property
     def cached_badge(self):
@@ -52,12 +106,15 @@ class BaseRecipe(object):
 
     @property
     def uncached_badge(self):
-        return self.get_badge()
+        return self.get_badge(use_catalogue=False)
 
-    def get_badge(self):
+    def get_badge(self, use_catalogue=True):
         """
-        The related ``Badge`` object.
+        The related ``Badge`` object (from the badge catalogue, unless
+        ``use_catalogue`` is ``False``).
         """
+        if use_catalogue:
+            return catalogue.get(self.slug, using=self.db_read)
         try:
             obj = Badge.objects.using(self.db_read).get(slug=self.slug)
             logger.debug('✓ Badge %s: fetched from db (%s)', obj.slug, self.db_read)
@@ -82,7 +139,9 @@ class BaseRecipe(object):
                     if attr != badge_attr:
                         to_update[field] = attr
                         logger.debug('✓ Badge %s: updated "%s" field', self.slug, field)
-                Badge.objects.filter(id=badge.id).update(**to_update)
+                if to_update:
+                    Badge.objects.filter(id=badge.id).update(**to_update)
+                    catalogue.bump_version()
         else:
             kwargs = {'name': self.name, 'image': self.image}
             optional_fields = ['slug', 'description']
@@ -95,13 +154,24 @@ class BaseRecipe(object):
             logger.debug('✓ Badge %s: created', badge.slug)
         return (badge, created)
 
-    def can_perform_awarding(self):
+    def can_perform_awarding(self, db_read=None, metrics=None):
         """
         Checks if we can perform awarding process (is ``user_ids`` property
         defined? Does Badge object exists? and so on). If we can perform db
         operations safely, returns ``True``. Otherwise, ``False``.
+        Querysets are probed with ``exists()``, not evaluated.
         """
-        if not self.user_ids:
+        # Recipes returning lists (or tiered recipes) run their queries here
+        with measure_query(metrics, 'user_ids'):
+            current_ids = self.get_current_user_ids(db_read=db_read)
+
+        if isinstance(current_ids, QuerySet):
+            with measure_query(metrics, 'user_ids.exists'):
+                empty = not current_ids.exists()
+        else:
+            empty = not current_ids
+
+        if empty:
             logger.debug(
                 '✘ Badge %s: no users to check (empty user_ids property)',
                 self.slug)
@@ -121,7 +191,7 @@ class BaseRecipe(object):
         """
         logger.debug('→ Badge %s: syncing users count...', self.slug)
 
-        badge, updated = self.badge, False
+        badge, updated = self.uncached_badge, False
 
         if not badge:
             logger.debug(
@@ -149,14 +219,17 @@ class BaseRecipe(object):
 
         return (badge, updated)
 
-    def get_already_awarded_user_ids(self, db_read=None, show_log=True):
+    def get_already_awarded_user_ids(self, db_read=None, show_log=True, user_ids=None):
         """
-        Returns already awarded user ids and the count.
+        Returns already awarded user ids and the count (only among
+        ``user_ids`` if given).
         """
 
         db_read = db_read or self.db_read
 
         already_awarded_ids = self.badge.users.using(db_read).values_list('id', flat=True)
+        if user_ids is not None:
+            already_awarded_ids = already_awarded_ids.filter(id__in=user_ids)
         already_awarded_ids_count = len(already_awarded_ids)
 
         if show_log:
@@ -168,23 +241,296 @@ class BaseRecipe(object):
 
         return already_awarded_ids
 
+    @contextmanager
+    def evaluation(self):
+        """
+        Per-run evaluation context: ``user_ids`` is only built once (a
+        queryset is then evaluated at most once, its results being cached).
+        """
+        self._evaluation = {}
+        try:
+            yield
+        finally:
+            self._evaluation = None
+
     def get_current_user_ids(self, db_read=None):
         """
-        Returns current user ids and the count.
+        Returns current user ids (memoised in ``evaluation()`` context).
+        """
+        db_read = db_read or self.db_read
+
+        evaluation = getattr(self, '_evaluation', None)
+        if evaluation is not None and db_read in evaluation:
+            return evaluation[db_read]
+
+        user_ids = self.get_user_ids(db_read)
+        if evaluation is not None and user_ids is not None and not isinstance(user_ids, QuerySet):
+            # Iterators can only be consumed once
+            user_ids = list(user_ids)
+
+        if evaluation is not None:
+            evaluation[db_read] = user_ids
+
+        return user_ids
+
+    def get_user_ids(self, db_read):
+        """
+        Builds ``user_ids`` for the given database.
+        """
+        user_ids = self.user_ids
+        if isinstance(user_ids, QuerySet):
+            user_ids = user_ids.using(db_read)
+        return user_ids
+
+    def can_diff_in_database(self, current_ids, diff_engine=None):
+        """
+        Returns ``True`` if user ids to award / unaward can be computed by
+        the database (``user_ids`` is a flat ``values_list()`` queryset and
+        the "sql" diff engine is enabled).
+        """
+        diff_engine = diff_engine or self.diff_engine
+        if diff_engine != 'sql':
+            return False
+        return get_values_list_field(current_ids) is not None
+
+    def get_unawarded_user_ids_queryset(self, current_ids, db_read=None):
+        """
+        Returns a queryset of current user ids without award for this badge
+        (``NOT EXISTS`` anti-join performed by the database).
+        """
+        db_read = db_read or self.db_read
+        field = get_values_list_field(current_ids)
+        awards = Award.objects.using(db_read).filter(
+            badge_id=self.badge.id,
+            user_id=OuterRef(field))
+        return current_ids.order_by().filter(~Exists(awards)).distinct()
+
+    def get_obsolete_user_ids_queryset(self, current_ids, db_read=None):
+        """
+        Returns a queryset of awarded user ids that are not in current user
+        ids anymore (``NOT EXISTS`` anti-join performed by the database).
+        """
+        db_read = db_read or self.db_read
+        field = get_values_list_field(current_ids)
+        current = current_ids.order_by().filter(**{field: OuterRef('user_id')})
+        return (Award.objects.using(db_read)
+                             .filter(badge_id=self.badge.id)
+                             .filter(~Exists(current))
+                             .values_list('user_id', flat=True))
+
+    def has_unchanged_awards(self, current_ids, db_read=None, metrics=None):
+        """
+        Returns ``True`` if checksums (see ``utils.get_checksum()``) of
+        current user ids and of awarded user ids match: awards are up to date.
+        Only available when ``user_ids`` is a flat ``values_list()``
+        queryset (``False`` otherwise).
+        """
+        db_read = db_read or self.db_read
+        field = get_values_list_field(current_ids)
+        if field is None:
+            return False
+
+        # Checksums need integer user ids
+        if not isinstance(Award._meta.get_field('user').target_field, IntegerField):
+            return False
+
+        with measure_query(metrics, 'user_ids.checksum'):
+            current = get_checksum(current_ids.distinct(), field)
+        with measure_query(metrics, 'awarded_ids.checksum'):
+            awarded = get_checksum(Award.objects.using(db_read).filter(badge_id=self.badge.id),
+                                   'user_id')
+
+        return current == awarded
+
+    def can_award_in_database(self, current_ids, db_read=None, diff_engine=None,
+                              post_save_signal=True):
+        """
+        Returns ``True`` if awards can be created / deleted by the database
+        itself (see ``sql_mode``): ``user_ids`` is a flat ``values_list()``
+        queryset read from the database awards are written to. Unless
+        ``sql_mode`` is ``True``, ``post_save_signal`` must be ``False``
+        (``post_save`` needs award objects) and the diff engine "sql".
+        Awarded / unawarded users are not known in the database: never when
+        they are reported (see ``is_reported()``).
+        """
+        db_read = db_read or self.db_read
+        if self.sql_mode is False or get_values_list_field(current_ids) is None:
+            return False
+        if self.is_reported():
+            logger.debug('→ Badge %s: awarded users are reported, not syncing awards in the database',
+                         self.slug)
+            return False
+        if db_read != router.db_for_write(Award):
+            return False
+        if self.sql_mode:
+            return True
+        return not post_save_signal and (diff_engine or self.diff_engine) == 'sql'
+
+    def sync_awards_in_database(self, current_ids, db_read=None,
+                                post_save_signal=True, metrics=None):
+        """
+        Deletes obsolete awards with a ``DELETE ... WHERE NOT EXISTS`` query
+        and creates missing ones with an ``INSERT ... SELECT ... WHERE NOT
+        EXISTS`` query: no user id leaves the database. ``post_save`` is not
+        sent, ``awards_bulk_deleted`` and ``awards_bulk_created`` (if
+        ``post_save_signal`` is ``True``) are sent with ``user_ids=None``, only
+        if awards were deleted / created. Returns awarded and unawarded counts.
+        """
+        db_read = db_read or self.db_read
+        badge = self.badge
+        connection = connections[db_read]
+        quote_name = connection.ops.quote_name
+        opts = Award._meta
+
+        field = get_values_list_field(current_ids)
+        current = current_ids.order_by().filter(**{field: OuterRef('user_id')})
+        obsolete = (Award.objects.using(db_read)
+                                 .filter(badge_id=badge.pk)
+                                 .filter(~Exists(current)))
+
+        unawarded = (self.get_unawarded_user_ids_queryset(current_ids, db_read=db_read)
+                         .annotate(badgify_badge_id=Value(badge.pk, output_field=IntegerField()),
+                                   badgify_awarded_at=Value(timezone.now(), output_field=DateTimeField()))
+                         .values_list(field, 'badgify_badge_id', 'badgify_awarded_at'))
+        select_sql, params = unawarded.query.sql_with_params()
+        columns = [opts.get_field(name).column for name in ('user', 'badge', 'awarded_at')]
+        insert_sql = '%s %s (%s) %s %s' % (
+            connection.ops.insert_statement(on_conflict=OnConflict.IGNORE),
+            quote_name(opts.db_table),
+            ', '.join(quote_name(column) for column in columns),
+            select_sql,
+            connection.ops.on_conflict_suffix_sql([], OnConflict.IGNORE, [], []))
+
+        with transaction.atomic(using=db_read):
+            with measure_phase(metrics, 'delete'), measure_query(metrics, 'obsolete_ids'):
+                unawarded_count = obsolete._raw_delete(db_read)
+            if unawarded_count > 0:
+                with measure_phase(metrics, 'denormalize'):
+                    awards_bulk_deleted.send(sender=Award,
+                                             badge=badge,
+                                             count=unawarded_count,
+                                             user_ids=None)
+            with measure_phase(metrics, 'insert'), measure_query(metrics, 'unawarded_ids'):
+                with connection.cursor() as cursor:
+                    cursor.execute(insert_sql, params)
+                    awarded_count = cursor.rowcount
+            if post_save_signal and awarded_count > 0:
+                with measure_phase(metrics, 'denormalize'):
+                    awards_bulk_created.send(sender=Award,
+                                             badge=badge,
+                                             count=awarded_count,
+                                             user_ids=None)
+
+        logger.debug('→ Badge %s: %d users awarded, %d unawarded (sql mode)',
+                     self.slug,
+                     awarded_count,
+                     unawarded_count)
+
+        return awarded_count, unawarded_count
+
+    def get_user_ids_diff(self, db_read=None, diff_engine=None, user_ids=None, metrics=None):
+        """
+        Returns a tuple of two lists (sorted NumPy arrays with the "numpy"
+        diff engine): user ids to award and user ids to unaward. Current and
+        already awarded user ids are only fetched once.
+        If ``user_ids`` is given, only these users are considered.
+        """
+        db_read = db_read or self.db_read
+
+        current_ids = self.get_current_user_ids(db_read=db_read)
+        diff_engine = diff_engine or self.diff_engine
+
+        if diff_engine == 'numpy' and numpy is None:
+            logger.debug('→ Badge %s: NumPy is not installed, using python diff engine', self.slug)
+            diff_engine = 'python'
+
+        if diff_engine == 'numpy':
+            unawarded_ids, obsolete_ids = self.get_user_ids_diff_arrays(current_ids,
+                                                                        db_read=db_read,
+                                                                        user_ids=user_ids,
+                                                                        metrics=metrics)
+        elif self.can_diff_in_database(current_ids, diff_engine=diff_engine):
+            if user_ids is not None:
+                field = get_values_list_field(current_ids)
+                current_ids = current_ids.filter(**{'%s__in' % field: user_ids})
+            unawarded_ids = self.get_unawarded_user_ids_queryset(current_ids, db_read=db_read)
+            obsolete_ids = self.get_obsolete_user_ids_queryset(current_ids, db_read=db_read)
+            if user_ids is not None:
+                obsolete_ids = obsolete_ids.filter(user_id__in=user_ids)
+            with measure_query(metrics, 'unawarded_ids'):
+                unawarded_ids = list(unawarded_ids)
+            with measure_query(metrics, 'obsolete_ids'):
+                obsolete_ids = list(obsolete_ids)
+        else:
+            with measure_query(metrics, 'awarded_ids'):
+                already_awarded_ids = set(self.get_already_awarded_user_ids(db_read=db_read,
+                                                                            user_ids=user_ids))
+            with measure_query(metrics, 'user_ids'):
+                current_ids = set(current_ids)
+            if user_ids is not None:
+                current_ids &= set(user_ids)
+            unawarded_ids = list(current_ids - already_awarded_ids)
+            obsolete_ids = list(already_awarded_ids - current_ids)
+
+        logger.debug(
+            '→ Badge %s: %d users need to be awarded',
+            self.slug,
+            len(unawarded_ids))
+
+        logger.debug(
+            '→ Badge %s: %d users need to be unawarded',
+            self.slug,
+            len(obsolete_ids))
+
+        return (unawarded_ids, obsolete_ids)
+
+    def get_user_ids_diff_arrays(self, current_ids, db_read=None, user_ids=None, metrics=None):
+        """
+        Loads current and already awarded user ids into int64 NumPy arrays
+        (streamed from the cursors) and returns sorted arrays of user ids to
+        award and to unaward (``setdiff1d()`` of unique sorted arrays).
         """
         db_read = db_read or self.db_read
+        chunk_size = self.batch_size
+
+        already_awarded_ids = (Award.objects.using(db_read)
+                                            .filter(badge_id=self.badge.id)
+                                            .values_list('user_id', flat=True))
+        if user_ids is not None:
+            already_awarded_ids = already_awarded_ids.filter(user_id__in=user_ids)
+
+        if isinstance(current_ids, QuerySet):
+            current_ids = current_ids.order_by().iterator(chunk_size=chunk_size)
+
+        with measure_query(metrics, 'awarded_ids'):
+            already_awarded_ids = numpy.unique(numpy.fromiter(
+                already_awarded_ids.order_by().iterator(chunk_size=chunk_size),
+                dtype=numpy.int64))
+        with measure_query(metrics, 'user_ids'):
+            current_ids = numpy.unique(numpy.fromiter(current_ids, dtype=numpy.int64))
 
-        return self.user_ids.using(db_read)
+        if user_ids is not None:
+            current_ids = current_ids[numpy.isin(current_ids, numpy.fromiter(user_ids, dtype=numpy.int64))]
 
-    def get_unawarded_user_ids(self, db_read=None):
+        unawarded_ids = numpy.setdiff1d(current_ids, already_awarded_ids, assume_unique=True)
+        obsolete_ids = numpy.setdiff1d(already_awarded_ids, current_ids, assume_unique=True)
+
+        return (unawarded_ids, obsolete_ids)
+
+    def get_unawarded_user_ids(self, db_read=None, diff_engine=None):
         """
         Returns unawarded user ids (need to be saved) and the count.
         """
         db_read = db_read or self.db_read
 
-        already_awarded_ids = self.get_already_awarded_user_ids(db_read=db_read)
         current_ids = self.get_current_user_ids(db_read=db_read)
-        unawarded_ids = list(set(current_ids) - set(already_awarded_ids))
+
+        if self.can_diff_in_database(current_ids, diff_engine=diff_engine):
+            unawarded_ids = list(self.get_unawarded_user_ids_queryset(current_ids, db_read=db_read))
+        else:
+            already_awarded_ids = self.get_already_awarded_user_ids(db_read=db_read)
+            unawarded_ids = list(set(current_ids) - set(already_awarded_ids))
+
         unawarded_ids_count = len(unawarded_ids)
 
         logger.debug(
@@ -194,15 +540,20 @@ class BaseRecipe(object):
 
         return (unawarded_ids, unawarded_ids_count)
 
-    def get_obsolete_user_ids(self, db_read=None):
+    def get_obsolete_user_ids(self, db_read=None, diff_engine=None):
         """
         Returns obsolete users IDs to unaward.
         """
         db_read = db_read or self.db_read
 
-        already_awarded_ids = self.get_already_awarded_user_ids(db_read=db_read, show_log=False)
         current_ids = self.get_current_user_ids(db_read=db_read)
-        obsolete_ids = list(set(already_awarded_ids) - set(current_ids))
+
+        if self.can_diff_in_database(current_ids, diff_engine=diff_engine):
+            obsolete_ids = list(self.get_obsolete_user_ids_queryset(current_ids, db_read=db_read))
+        else:
+            already_awarded_ids = self.get_already_awarded_user_ids(db_read=db_read, show_log=False)
+            obsolete_ids = list(set(already_awarded_ids) - set(current_ids))
+
         obsolete_ids_count = len(obsolete_ids)
 
         logger.debug(
@@ -212,61 +563,701 @@ class BaseRecipe(object):
 
         return (obsolete_ids, obsolete_ids_count)
 
+    def iter_user_ids_diff(self, db_read=None, batch_size=None, batch_sizes=None):
+        """
+        Walks current and already awarded user ids in sorted order (streamed
+        with server-side cursors) and merge-joins them. Yields
+        ``(unawarded_ids, obsolete_ids)`` tuples as soon as one of the lists
+        reaches ``batch_size`` (or the current size of the "insert" /
+        "delete" ``batch_sizes``), so memory does not depend on how many
+        users the badge has.
+        """
+        db_read = db_read or self.db_read
+        batch_size = batch_size or self.batch_size
+
+        current_ids = self.get_current_user_ids(db_read=db_read)
+        field = get_values_list_field(current_ids)
+        if field is not None:
+            current_ids = (current_ids.order_by(field)
+                                      .distinct()
+                                      .iterator(chunk_size=batch_size))
+        else:
+            current_ids = sorted(set(current_ids))
+
+        already_awarded_ids = (Award.objects.using(db_read)
+                                            .filter(badge_id=self.badge.id)
+                                            .order_by('user_id')
+                                            .values_list('user_id', flat=True)
+                                            .iterator(chunk_size=batch_size))
+
+        unawarded_ids, obsolete_ids = [], []
+        unawarded_ids_count, obsolete_ids_count = 0, 0
+        insert_size = delete_size = batch_size
+
+        for user_id, is_current in merge_sorted_diff(current_ids, already_awarded_ids):
+            if is_current:
+                unawarded_ids.append(user_id)
+                unawarded_ids_count += 1
+            else:
+                obsolete_ids.append(user_id)
+                obsolete_ids_count += 1
+
+            if batch_sizes is not None:
+                insert_size, delete_size = batch_sizes['insert'].size, batch_sizes['delete'].size
+
+            if len(unawarded_ids) >= insert_size or len(obsolete_ids) >= delete_size:
+                yield (unawarded_ids, obsolete_ids)
+                unawarded_ids, obsolete_ids = [], []
+
+        if unawarded_ids or obsolete_ids:
+            yield (unawarded_ids, obsolete_ids)
+
+        logger.debug(
+            '→ Badge %s: %d users awarded, %d users unawarded (streamed)',
+            self.slug,
+            unawarded_ids_count,
+            obsolete_ids_count)
+
+    def get_triggered_user_ids(self, instance):
+        """
+        Returns ids of users to evaluate when one of ``triggers`` is saved or
+        deleted: the instance itself if it is a user, its ``user_id``
+        otherwise.
+        """
+        if isinstance(instance, get_user_model()):
+            return [instance.pk]
+        user_id = getattr(instance, 'user_id', None)
+        if user_id is None:
+            return []
+        return [user_id]
+
+    def is_user_eligible(self, user_id, db_read=None):
+        """
+        Returns ``True`` if the given user is in ``user_ids`` (probes the
+        database for this single user when ``user_ids`` is a queryset).
+        """
+        db_read = db_read or self.db_read
+
+        current_ids = self.get_current_user_ids(db_read=db_read)
+        if current_ids is None:
+            return False
+
+        field = get_values_list_field(current_ids)
+        if field is None:
+            return user_id in set(current_ids)
+
+        return current_ids.filter(**{field: user_id}).exists()
+
+    def evaluate_user(self, user_id, db_read=None):
+        """
+        Awards or unawards a single user. Returns ``True`` if the user has
+        been awarded, ``False`` if unawarded and ``None`` if nothing changed.
+        """
+        badge = self.badge
+        if not badge:
+            return None
+
+        eligible = self.is_user_eligible(user_id, db_read=db_read)
+        awards = Award.objects.filter(badge_id=badge.id, user_id=user_id)
+
+        if eligible and not awards.exists():
+            award, created = Award.objects.get_or_create(badge=badge, user_id=user_id)
+            if created:
+                logger.debug('✓ Badge %s: awarded user %s', self.slug, user_id)
+                return True
+
+        if not eligible and awards.exists():
+            awards.delete()
+            logger.debug('✓ Badge %s: unawarded user %s', self.slug, user_id)
+            return False
+
+        return None
+
+    def changed_user_ids(self, since):
+        """
+        Incremental recipes return ids (queryset or list) of users whose data
+        may have changed since ``since`` (datetime of the last successful
+        sync). Only these users are then checked by ``create_awards``.
+        Returns ``None`` (full sync) by default.
+        """
+        return None
+
+    def get_last_synced_at(self):
+        """
+        Returns the start date of the last successful awards sync or ``None``.
+        """
+        checkpoint = Checkpoint.objects.filter(slug=self.slug).first()
+        if checkpoint:
+            return checkpoint.synced_at
+        return None
+
+    def set_last_synced_at(self, synced_at):
+        """
+        Persists the start date of a successful awards sync. Awards of a
+        badge synced for the first time are considered changed at this date.
+        """
+        updated = Checkpoint.objects.filter(slug=self.slug).update(
+            synced_at=synced_at,
+            awards_changed_at=Coalesce('awards_changed_at', Value(synced_at, output_field=DateTimeField())))
+        if not updated:
+            Checkpoint.objects.get_or_create(slug=self.slug,
+                                             defaults={'synced_at': synced_at,
+                                                       'awards_changed_at': synced_at})
+
     def create_awards(self, db_read=None, batch_size=None,
-                      post_save_signal=True):
+                      post_save_signal=True, diff_engine=None,
+                      incremental=False, metrics=None, loader=None,
+                      adaptive_batch_size=None):
+        """
+        Create awards. If ``incremental`` is ``True`` and the recipe
+        implements ``changed_user_ids()``, only users changed since the last
+        successful sync are checked.
+
+        Returns a ``RecipeMetrics`` instance (timers, queries and rows of
+        each phase, awarded and unawarded counters).
+        """
+        if metrics is None:
+            metrics = RecipeMetrics(self.slug)
+
+        with self.evaluation():
+            return self._create_awards(db_read=db_read,
+                                       batch_size=batch_size,
+                                       post_save_signal=post_save_signal,
+                                       diff_engine=diff_engine,
+                                       incremental=incremental,
+                                       metrics=metrics,
+                                       loader=loader,
+                                       adaptive_batch_size=adaptive_batch_size)
+
+    def _create_awards(self, db_read, batch_size, post_save_signal, diff_engine,
+                       incremental, metrics, loader, adaptive_batch_size):
+        db_read = db_read or self.db_read
+
+        with metrics.phase('badge'):
+            can_perform_awarding = self.can_perform_awarding(db_read=db_read, metrics=metrics)
+
+        if not can_perform_awarding:
+            return metrics
+        batch_size = batch_size or self.batch_size
+        diff_engine = diff_engine or self.diff_engine
+        loader = loader or self.loader
+
+        if loader == 'copy' and not can_copy_awards():
+            logger.debug('→ Badge %s: COPY is not supported, using batch loader', self.slug)
+            loader = 'batch'
+
+        started_at = timezone.now()
+        changed_ids = None
+
+        if incremental:
+            with metrics.phase('checkpoint'):
+                since = self.get_last_synced_at()
+                if since is not None:
+                    changed_ids = self.changed_user_ids(since)
+            if changed_ids is None:
+                logger.debug('→ Badge %s: full sync (no checkpoint or not incremental)', self.slug)
+            else:
+                logger.debug('→ Badge %s: incremental sync (changes since %s)', self.slug, since)
+
+        if changed_ids is None:
+            current_ids = self.get_current_user_ids(db_read=db_read)
+            if self.checksum:
+                with metrics.phase('checksum'):
+                    unchanged = self.has_unchanged_awards(current_ids, db_read=db_read, metrics=metrics)
+                if unchanged:
+                    logger.debug('✓ Badge %s: unchanged (checksum)', self.slug)
+                    metrics.incr('unchanged')
+                    with metrics.phase('checkpoint'):
+                        self.set_last_synced_at(started_at)
+                    return metrics
+            if self.can_award_in_database(current_ids,
+                                          db_read=db_read,
+                                          diff_engine=diff_engine,
+                                          post_save_signal=post_save_signal):
+                awarded, unawarded = self.sync_awards_in_database(current_ids,
+                                                                  db_read=db_read,
+                                                                  post_save_signal=post_save_signal,
+                                                                  metrics=metrics)
+                metrics.incr('awarded', awarded)
+                metrics.incr('unawarded', unawarded)
+                with metrics.phase('checkpoint'):
+                    self.set_last_synced_at(started_at)
+                return metrics
+
+        batch_sizes = self.get_batch_sizes(batch_size, adaptive=adaptive_batch_size)
+        metrics.batch_sizes = batch_sizes
+
+        if diff_engine == 'stream' and changed_ids is None:
+            batches = self.iter_user_ids_diff(db_read=db_read,
+                                              batch_size=batch_size,
+                                              batch_sizes=batch_sizes)
+        else:
+            with metrics.phase('diff'):
+                unawarded_ids, obsolete_ids = self.get_user_ids_diff(db_read=db_read,
+                                                                     diff_engine=diff_engine,
+                                                                     user_ids=changed_ids,
+                                                                     metrics=metrics)
+            if loader == 'batch':
+                unawarded_batches = iter_batches(unawarded_ids, batch_sizes['insert'])
+            else:
+                # COPY loads all awards at once
+                unawarded_batches = [to_list(unawarded_ids)] if len(unawarded_ids) else []
+            batches = itertools.chain(
+                (([], user_ids) for user_ids in iter_batches(obsolete_ids, batch_sizes['delete'])),
+                ((user_ids, []) for user_ids in unawarded_batches))
+
+        while True:
+            # The stream engine computes the diff lazily, batch per batch
+            with metrics.phase('diff'):
+                batch = next(batches, None)
+            if batch is None:
+                break
+            unawarded_ids, obsolete_ids = batch
+            if obsolete_ids:
+                start = time.time()
+                self.unaward_users(obsolete_ids, db_read=db_read, metrics=metrics)
+                batch_sizes['delete'].record(len(obsolete_ids), time.time() - start)
+            if unawarded_ids:
+                start = time.time()
+                self.award_users(unawarded_ids,
+                                 db_read=db_read,
+                                 batch_size=len(unawarded_ids),
+                                 post_save_signal=post_save_signal,
+                                 metrics=metrics,
+                                 loader=loader)
+                batch_sizes['insert'].record(len(unawarded_ids), time.time() - start)
+
+        with metrics.phase('checkpoint'):
+            self.set_last_synced_at(started_at)
+
+        return metrics
+
+    def get_batch_sizes(self, batch_size=None, adaptive=None):
+        """
+        Returns "insert" and "delete" ``BatchSize`` objects, starting at
+        ``batch_size`` and capped to the parameter limit of the database.
+        """
+        batch_size = batch_size or self.batch_size
+        if adaptive is None:
+            adaptive = self.adaptive_batch_size
+        connection = connections[router.db_for_write(Award)]
+        max_params = get_max_batch_size(connection, 1)
+        return {
+            # user_id, badge_id and awarded_at per award
+            'insert': BatchSize(batch_size,
+                                maximum=get_max_batch_size(connection, 3),
+                                adaptive=adaptive,
+                                target_time=self.batch_target_time),
+            # user ids (and the badge id) of the IN clause
+            'delete': BatchSize(batch_size,
+                                maximum=max_params - 1 if max_params else None,
+                                adaptive=adaptive,
+                                target_time=self.batch_target_time),
+        }
+
+    def unaward_users(self, user_ids, db_read=None, metrics=None):
         """
-        Create awards.
+        Deletes awards of the given user ids.
         """
-        if not self.can_perform_awarding():
-            return
+        db_read = db_read or self.db_read
+
+        count = bulk_delete_awards(badge=self.badge, user_ids=user_ids, metrics=metrics)
+
+        if metrics is not None:
+            metrics.incr('unawarded', count)
 
-        User = get_user_model()
+        with measure_phase(metrics, 'report'):
+            self.report('unawarded', user_ids, db_read=db_read)
 
+    def award_users(self, user_ids, db_read=None, batch_size=None,
+                    post_save_signal=True, metrics=None, loader=None):
+        """
+        Creates awards for the given user ids.
+        """
         db_read = db_read or self.db_read
         batch_size = batch_size or self.batch_size
+        loader = loader or self.loader
+
+        if loader == 'copy' and can_copy_awards():
+            count = copy_awards(badge=self.badge,
+                                user_ids=user_ids,
+                                signal=post_save_signal,
+                                metrics=metrics)
+        else:
+            objects = [Award(user_id=user_id, badge=self.badge) for user_id in user_ids]
+            count = bulk_create_awards(objects=objects,
+                                       batch_size=batch_size,
+                                       post_save_signal=post_save_signal,
+                                       metrics=metrics)
+
+        if metrics is not None:
+            metrics.incr('awarded', count)
+
+        with measure_phase(metrics, 'report'):
+            self.report('awarded', user_ids, db_read=db_read)
+
+    def is_reported(self):
+        """
+        Returns ``True`` if awarded / unawarded users are reported: ``audit()``
+        is implemented, ``audit_users`` is ``True`` or the "badgify" logger is
+        enabled for DEBUG.
+        """
+        if type(self).audit is not BaseRecipe.audit or self.audit_users:
+            return True
+        return logger.isEnabledFor(logging.DEBUG)
+
+    def report(self, action, user_ids, db_read=None):
+        """
+        Reports awarded / unawarded users (``action``). User objects are only
+        fetched if the "badgify" logger is enabled for DEBUG or if
+        ``audit_users`` is ``True``.
+        """
+        debug = logger.isEnabledFor(logging.DEBUG)
+        users = None
+
+        if debug or self.audit_users:
+            User = get_user_model()
+            users = list(User.objects.using(db_read or self.db_read)
+                                     .in_bulk(user_ids)
+                                     .values())
+
+        if debug:
+            logger.debug("→ Badge %s (db_read: %s): %s %s",
+                         self.slug,
+                         db_read,
+                         action,
+                         ' '.join(['%s' % user for user in users]))
+
+        self.audit(action, user_ids, users=users)
+
+    def audit(self, action, user_ids, users=None):
+        """
+        Hook called for each batch of awarded / unawarded users (``action``).
+        ``users`` are user objects if ``audit_users`` is ``True`` (or DEBUG
+        logging enabled), ``None`` otherwise. Does nothing by default.
+        """
+        pass
+
+
+class TieredRecipe(BaseRecipe):
+    """
+    Base class for families of badges awarded above thresholds of the same
+    score ("10 posts", "100 posts", "1000 posts"). Each tier of ``tiers`` is
+    registered as a recipe (with its own badge) but ``scores`` is evaluated
+    once and shared by all tiers.
+    """
+
+    # (slug, threshold) of each tier: users whose score is greater than or
+    # equal to the threshold are awarded the tier badge
+    tiers = ()
+
+    # Threshold of this tier (set when instantiated by get_tier_recipes())
+    threshold = None
+
+    def __init__(self, tier=None, family=None):
+        if tier is not None:
+            self.slug, self.threshold = tier
+        # Scores shared by recipes of all tiers
+        self._family = family if family is not None else {}
+
+    @classmethod
+    def get_tier_recipes(cls):
+        """
+        Returns one recipe instance per tier, sharing their scores.
+        """
+        family = {}
+        return [cls(tier=tier, family=family) for tier in cls.tiers]
+
+    @property
+    def scores(self):
+        """
+        Returns ``(user_id, score)`` tuples, usually an annotated
+        ``values_list()`` queryset, for instance::
+
+            User.objects.annotate(score=Count('posts')).values_list('id', 'score')
+        """
+        raise NotImplementedError('Scores must be implemented')
+
+    def get_scores_queryset(self, db_read):
+        """
+        Returns ``scores`` for the given database and the ``(user_id, score)``
+        fields if it is a ``values_list()`` queryset of two fields (``None``
+        otherwise).
+        """
+        scores = self.scores
+        if not isinstance(scores, QuerySet):
+            return scores, None
+        fields = getattr(scores, '_fields', None)
+        if scores.query.is_sliced or scores.query.combinator or not fields or len(fields) != 2:
+            return scores.using(db_read), None
+        return scores.using(db_read).order_by(), fields
+
+    def clear_scores(self):
+        """
+        Forgets evaluated scores (evaluated again by the next tier synced).
+        """
+        self._family.clear()
+
+    def get_scores(self, db_read=None):
+        """
+        Returns evaluated scores: ``(scores, user_ids)`` lists sorted by
+        score. Scores are evaluated once for all tiers: they are evaluated
+        again only when a tier which already used them asks for them (next
+        sync).
+        """
+        db_read = db_read or self.db_read
+
+        evaluated = self._family.get(db_read)
+        if evaluated is None or self.slug in evaluated['tiers']:
+            scores, fields = self.get_scores_queryset(db_read)
+            if fields is not None:
+                # Users below the lowest threshold are not transferred
+                threshold = min(threshold for slug, threshold in self.tiers)
+                scores = scores.filter(**{'%s__gte' % fields[1]: threshold})
+            pairs = sorted((score, user_id) for user_id, score in scores)
+            evaluated = {
+                'scores': [score for score, user_id in pairs],
+                'user_ids': [user_id for score, user_id in pairs],
+                'tiers': set(),
+            }
+            self._family[db_read] = evaluated
+            logger.debug('→ Badge %s: scores of %d users evaluated (shared by %d tiers)',
+                         self.slug,
+                         len(pairs),
+                         len(self.tiers))
+
+        evaluated['tiers'].add(self.slug)
 
-        unawarded_ids, unawarded_ids_count = self.get_unawarded_user_ids(db_read=db_read)
-        obsolete_ids, obsolete_ids_count = self.get_obsolete_user_ids(db_read=db_read)
+        return evaluated['scores'], evaluated['user_ids']
 
-        if obsolete_ids:
-            for user_ids in chunks(obsolete_ids, batch_size):
-                obsolete_users = User.objects.using(db_read).in_bulk(user_ids).values()
+    def get_user_ids(self, db_read):
+        scores, user_ids = self.get_scores(db_read=db_read)
+        return sorted(user_ids[bisect.bisect_left(scores, self.threshold):])
 
-                signals.pre_delete.disconnect(sender=Award, dispatch_uid=PRE_DELETE_UID)
-                Award.objects.filter(user__in=user_ids).delete()
+    @property
+    def user_ids(self):
+        return self.get_user_ids(self.db_read)
 
-                logger.debug("→ Badge %s (db_read: %s): unawarded %s",
-                             self.slug,
-                             db_read,
-                             ' '.join(['%s' % user for user in obsolete_users]))
+    def is_user_eligible(self, user_id, db_read=None):
+        """
+        Probes the database for this single user's score when ``scores`` is
+        a ``values_list()`` queryset (scores of all users otherwise).
+        """
+        db_read = db_read or self.db_read
 
-        if unawarded_ids:
-            for user_ids in chunks(unawarded_ids, batch_size):
-                unwarded_users = User.objects.using(db_read).in_bulk(user_ids).values()
-                objects = [Award(user_id=user_id, badge=self.badge) for user_id in user_ids]
+        scores, fields = self.get_scores_queryset(db_read)
+        if fields is None:
+            return any(pk == user_id and score >= self.threshold for pk, score in scores)
 
-                bulk_create_awards(objects=objects,
-                                   batch_size=batch_size,
-                                   post_save_signal=post_save_signal)
+        return scores.filter(**{fields[0]: user_id, '%s__gte' % fields[1]: self.threshold}).exists()
 
-                logger.debug("→ Badge %s (db_read: %s): awarded %s",
-                             self.slug,
-                             db_read,
-                             ' '.join(['%s' % user for user in unwarded_users]))
 
+def set_awards_changed_at(slugs):
+    """
+    Records that awards of the given badges (list or queryset of slugs)
+    changed now: recipes depending on them are not skipped until synced
+    again. Only badges synced before (with a checkpoint) are updated.
+    """
+    return Checkpoint.objects.filter(slug__in=slugs).update(awards_changed_at=timezone.now())
 
-def bulk_create_awards(objects, batch_size=500, post_save_signal=True):
+
+def bulk_create_awards(objects, batch_size=500, post_save_signal=True, metrics=None):
     """
-    Saves award objects.
+    Saves award objects of a badge. Awards that already exist (eg. created
+    by a concurrent sync) are skipped: ``ON CONFLICT DO NOTHING`` (or an
+    equivalent) where the backend supports it, row by row otherwise.
+
+    If ``post_save_signal`` is ``True``, sends ``post_save`` for each created
+    object (flagged with ``bulk=True``) and ``awards_bulk_created`` once, so
+    ``Badge.users_count`` is updated with a single query. When some awards
+    already existed and created ones cannot be told apart (``ON CONFLICT DO
+    NOTHING``), ``post_save`` is not sent and ``awards_bulk_created`` is sent
+    with ``user_ids=None``.
+    Returns the number of created awards.
     """
-    count = len(objects)
-    if not count:
-        return
+    if not objects:
+        return 0
     badge = objects[0].badge
+    using = router.db_for_write(Award)
+    with measure_phase(metrics, 'insert'):
+        created, count = _insert_awards(objects, batch_size=batch_size, using=using)
+    if count != len(objects):
+        logger.debug('→ Badge %s: %d awards already exist, skipped',
+                     badge.slug,
+                     len(objects) - count)
+    if post_save_signal and count:
+        with measure_phase(metrics, 'denormalize'):
+            for obj in created or []:
+                signals.post_save.send(sender=obj.__class__, instance=obj, created=True, bulk=True)
+            awards_bulk_created.send(sender=Award,
+                                     badge=badge,
+                                     count=count,
+                                     user_ids=None if created is None else [obj.user_id for obj in created])
+    return count
+
+
+def _insert_awards(objects, batch_size, using):
+    """
+    Inserts award objects of a badge, skipping existing ones. Returns
+    created objects and the number of rows actually inserted. With ``ON
+    CONFLICT DO NOTHING``, only the row count is known: created objects are
+    ``None`` if some rows were skipped (all objects otherwise).
+    """
+    if connections[using].features.supports_ignore_conflicts:
+        # Existing rows (already awarded, or inserted by a concurrent sync)
+        # are skipped: the INSERT row count tells how many rows are ours.
+        counter = QueryCounter()
+        with count_queries(counter, aliases=[using]):
+            Award.objects.using(using).bulk_create(objects, batch_size=batch_size, ignore_conflicts=True)
+        if counter.rows == len(objects):
+            return objects, counter.rows
+        return None, counter.rows
+
+    awards = Award.objects.using(using).filter(badge_id=objects[0].badge_id,
+                                               user_id__in=[obj.user_id for obj in objects])
+
+    existing_ids = _get_awarded_user_ids(awards)
+    objects = [obj for obj in objects if obj.user_id not in existing_ids]
+    if not objects:
+        return objects, 0
+
     try:
-        Award.objects.bulk_create(objects, batch_size=batch_size)
-        if post_save_signal:
-            for obj in objects:
-                signals.post_save.send(sender=obj.__class__, instance=obj, created=True)
+        with transaction.atomic(using=using):
+            Award.objects.using(using).bulk_create(objects, batch_size=batch_size)
+        return objects, len(objects)
     except IntegrityError:
-        logger.error('✘ Badge %s: IntegrityError for %d awards', badge.slug, count)
+        pass
+
+    created = []
+    for obj in objects:
+        try:
+            with transaction.atomic(using=using):
+                Award.objects.using(using).bulk_create([obj])
+        except IntegrityError:
+            continue
+        created.append(obj)
+    return created, len(created)
+
+
+def can_copy_awards(using=None):
+    """
+    Returns ``True`` if awards can be loaded with ``COPY`` (PostgreSQL).
+    """
+    using = using or router.db_for_write(Award)
+    return connections[using].vendor == 'postgresql'
+
+
+def copy_awards(badge, user_ids, signal=True, metrics=None, chunk_size=100000):
+    """
+    Creates awards of ``badge`` for the given user ids on PostgreSQL: ids are
+    streamed with ``COPY ... FROM STDIN`` into a temporary table, then merged
+    into the award table with a single ``INSERT ... SELECT ... ON CONFLICT DO
+    NOTHING``. ``post_save`` is not sent; if ``signal`` is ``True``,
+    ``awards_bulk_created`` is sent once. Returns the number of created awards.
+    """
+    if not user_ids:
+        return 0
+
+    using = router.db_for_write(Award)
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    opts = Award._meta
+
+    insert_sql = (
+        'INSERT INTO %(table)s (%(user)s, %(badge)s, %(awarded_at)s) '
+        'SELECT user_id, %%s, %%s FROM badgify_award_copy '
+        'ON CONFLICT DO NOTHING' % {
+            'table': quote_name(opts.db_table),
+            'user': quote_name(opts.get_field('user').column),
+            'badge': quote_name(opts.get_field('badge').column),
+            'awarded_at': quote_name(opts.get_field('awarded_at').column),
+        })
+
+    with measure_phase(metrics, 'insert'):
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS badgify_award_copy')
+            cursor.execute('CREATE TEMPORARY TABLE badgify_award_copy '
+                           '(user_id bigint NOT NULL) ON COMMIT DROP')
+            _copy_user_ids(cursor.cursor, user_ids, chunk_size)
+            cursor.execute(insert_sql, [badge.pk, timezone.now()])
+            count = cursor.rowcount
+
+    if signal and count:
+        with measure_phase(metrics, 'denormalize'):
+            awards_bulk_created.send(sender=Award,
+                                     badge=badge,
+                                     count=count,
+                                     user_ids=list(user_ids))
+    return count
+
+
+def _copy_user_ids(cursor, user_ids, chunk_size):
+    """
+    Streams user ids to the temporary table with psycopg (3) or psycopg2,
+    ``chunk_size`` ids at a time: ids are not loaded again in memory.
+    """
+    sql = 'COPY badgify_award_copy (user_id) FROM STDIN'
+    if hasattr(cursor, 'copy'):
+        with cursor.copy(sql) as copy:
+            for ids in chunks(user_ids, chunk_size):
+                copy.write(_format_user_ids(ids))
+    else:
+        cursor.copy_expert(sql, _UserIdsReader(user_ids, chunk_size))
+
+
+def _format_user_ids(user_ids):
+    return ''.join('%d\n' % user_id for user_id in user_ids)
+
+
+class _UserIdsReader(object):
+    """
+    File-like object reading user ids (one per line) formatted
+    ``chunk_size`` ids at a time, on demand (psycopg2 ``copy_expert``).
+    """
+
+    def __init__(self, user_ids, chunk_size):
+        self._chunks = (_format_user_ids(ids) for ids in chunks(user_ids, chunk_size))
+        self._chunk = io.StringIO()
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return self._chunk.read() + ''.join(self._chunks)
+        data = self._chunk.read(size)
+        while not data:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return ''
+            self._chunk = io.StringIO(chunk)
+            data = self._chunk.read(size)
+        return data
+
+
+def _get_awarded_user_ids(awards):
+    """
+    Returns the set of user ids of the given awards queryset.
+    """
+    return set(awards.values_list('user_id', flat=True))
+
+
+def bulk_delete_awards(badge, user_ids, metrics=None):
+    """
+    Deletes awards of ``badge`` for the given user ids with a single
+    ``DELETE`` query: awards are not loaded and ``pre_delete`` /
+    ``post_delete`` are not sent. Sends ``awards_bulk_deleted`` once, in the
+    same transaction, so ``Badge.users_count`` is updated with a single query.
+    Returns the number of deleted awards.
+    """
+    if not user_ids:
+        return 0
+    using = router.db_for_write(Award)
+    with transaction.atomic(using=using):
+        with measure_phase(metrics, 'delete'):
+            count = (Award.objects.using(using)
+                                  .filter(badge_id=badge.pk, user_id__in=user_ids)
+                                  ._raw_delete(using))
+        with measure_phase(metrics, 'denormalize'):
+            awards_bulk_deleted.send(sender=Award,
+                                     badge=badge,
+                                     count=count,
+                                     user_ids=list(user_ids))
+    return count
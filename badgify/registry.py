@@ -38,16 +38,16 @@ class BadgifyRegistry(object):
             recipe = [recipe, ]
 
         for item in recipe:
-            recipe = self.get_recipe_instance_from_class(item)
-            self._registry[recipe.slug] = recipe
+            for instance in self.get_recipe_instances_from_class(item):
+                self._registry[instance.slug] = instance
 
     def unregister(self, recipe):
         """
         Unregisters a given recipe class.
         """
-        recipe = self.get_recipe_instance_from_class(recipe)
-        if recipe.slug in self._registry:
-            del self._registry[recipe.slug]
+        for instance in self.get_recipe_instances_from_class(recipe):
+            if instance.slug in self._registry:
+                del self._registry[instance.slug]
 
     def clear(self):
         """
@@ -105,6 +105,42 @@ class BadgifyRegistry(object):
 
         return (valid, invalid)
 
+    def get_recipe_levels(self, instances):
+        """
+        Sorts the given recipe instances by dependency (``depends_on``) and
+        returns a list of levels (lists of recipe instances): recipes of a
+        level only depend on recipes of previous levels (or not selected
+        ones). Raises ``exceptions.CircularDependency`` on cycles.
+        """
+        from .exceptions import CircularDependency
+
+        instances = list(instances)
+        slugs = [instance.slug for instance in instances]
+        dependencies = {}
+
+        for instance in instances:
+            dependencies[instance.slug] = set()
+            for slug in instance.depends_on:
+                if slug not in self._registry:
+                    logger.debug('✘ Badge "%s" depends on "%s" which has not been registered',
+                                 instance.slug,
+                                 slug)
+                elif slug in slugs:
+                    dependencies[instance.slug].add(slug)
+
+        levels, done = [], set()
+
+        while len(done) < len(instances):
+            level = [instance for instance in instances
+                     if instance.slug not in done and dependencies[instance.slug] <= done]
+            if not level:
+                raise CircularDependency('Circular dependency between badges: %s' % ', '.join(
+                    sorted(set(slugs) - done)))
+            levels.append(level)
+            done.update(instance.slug for instance in level)
+
+        return levels
+
     @staticmethod
     def get_recipe_instance_from_class(klass):
         """
@@ -114,6 +150,17 @@ class BadgifyRegistry(object):
         assert issubclass(klass, BaseRecipe)
         return klass()
 
+    @classmethod
+    def get_recipe_instances_from_class(cls, klass):
+        """
+        Returns recipe instances from the given class ``klass`` (one per tier
+        for ``TieredRecipe`` classes).
+        """
+        from .recipe import TieredRecipe
+        if isinstance(klass, type) and issubclass(klass, TieredRecipe):
+            return klass.get_tier_recipes()
+        return [cls.get_recipe_instance_from_class(klass)]
+
 
 def _autodiscover(recipes):
     import copy
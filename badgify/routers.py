@@ -0,0 +1,116 @@
+import logging
+import time
+
+from django.db import connections, DatabaseError, DEFAULT_DB_ALIAS
+
+from . import settings
+
+logger = logging.getLogger('badgify')
+
+
+def get_write_database():
+    """
+    Returns the database alias badgify writes to (the primary).
+    """
+    return settings.DB_WRITE or DEFAULT_DB_ALIAS
+
+
+class BadgifyRouter(object):
+    """
+    Database router sending reads and writes of badgify models to the
+    primary (``BADGIFY_DB_WRITE``, ``"default"`` if not set). Heavy reads of
+    syncs (recipes ``user_ids`` and awards diff) go to replicas with
+    ``badgify_sync awards --use-replicas``.
+    """
+
+    app_label = 'badgify'
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == self.app_label:
+            return get_write_database()
+        return None
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label == self.app_label:
+            return get_write_database()
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == self.app_label and settings.DB_WRITE:
+            return db == settings.DB_WRITE
+        return None
+
+
+def get_replica_lag(alias):
+    """
+    Returns the replication lag of the given database in seconds: ``0`` if
+    it is not a replica, if it replayed all it received (idle primary) or if
+    the backend is not supported (PostgreSQL and MySQL are), ``None`` if it
+    cannot be checked (eg. replication stopped).
+    """
+    connection = connections[alias]
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # The last replayed transaction gets older while the primary is idle
+            cursor.execute(
+                'SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 '
+                'WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+                'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END')
+            lag = cursor.fetchone()[0]
+            return float(lag) if lag is not None else None
+
+        if connection.vendor == 'mysql':
+            try:
+                cursor.execute('SHOW REPLICA STATUS')
+            except DatabaseError:
+                # MySQL < 8.0.22, MariaDB < 10.5.1
+                cursor.execute('SHOW SLAVE STATUS')
+            row = cursor.fetchone()
+            if row is None:
+                return 0
+            columns = [column[0] for column in cursor.description]
+            status = dict(zip(columns, row))
+            if 'Seconds_Behind_Source' in status:
+                lag = status['Seconds_Behind_Source']
+            else:
+                lag = status.get('Seconds_Behind_Master')
+            return float(lag) if lag is not None else None
+
+    return 0
+
+
+def get_read_database(replicas=None, max_lag=None, wait=None, interval=1):
+    """
+    Returns the first replica (``BADGIFY_DB_REPLICAS``) lagging less than
+    ``max_lag`` seconds (``BADGIFY_REPLICA_MAX_LAG``). Replicas are checked
+    again every ``interval`` seconds during ``wait`` seconds
+    (``BADGIFY_REPLICA_LAG_WAIT``), then the primary is returned.
+    """
+    replicas = settings.DB_REPLICAS if replicas is None else replicas
+    max_lag = settings.REPLICA_MAX_LAG if max_lag is None else max_lag
+    wait = settings.REPLICA_LAG_WAIT if wait is None else wait
+
+    deadline = time.time() + wait
+
+    while replicas:
+        for alias in replicas:
+            try:
+                lag = get_replica_lag(alias)
+            except Exception:
+                logger.exception('✘ Replica %s: lag check failed', alias)
+                continue
+            if lag is not None and lag <= max_lag:
+                return alias
+            logger.debug('→ Replica %s: lagging (%s seconds)', alias, lag)
+        if time.time() + interval > deadline:
+            break
+        time.sleep(interval)
+
+    if replicas:
+        logger.warning('✘ Replicas lagging more than %s seconds: reading from primary', max_lag)
+
+    return get_write_database()
@@ -39,7 +39,107 @@ BATCH_SIZE = getattr(
     '%s_BATCH_SIZE' % APP_NAMESPACE,
     500)
 
+ADAPTIVE_BATCH_SIZE = getattr(
+    settings,
+    '%s_ADAPTIVE_BATCH_SIZE' % APP_NAMESPACE,
+    False)
+
+BATCH_TARGET_TIME = getattr(
+    settings,
+    '%s_BATCH_TARGET_TIME' % APP_NAMESPACE,
+    0.2)
+
 AUTO_DENORMALIZE = getattr(
     settings,
     '%s_AUTO_DENORMALIZE' % APP_NAMESPACE,
     True)
+
+DIFF_ENGINE = getattr(
+    settings,
+    '%s_DIFF_ENGINE' % APP_NAMESPACE,
+    'sql')
+
+CHECKSUM = getattr(
+    settings,
+    '%s_CHECKSUM' % APP_NAMESPACE,
+    False)
+
+SQL_MODE = getattr(
+    settings,
+    '%s_SQL_MODE' % APP_NAMESPACE,
+    None)
+
+LOADER = getattr(
+    settings,
+    '%s_LOADER' % APP_NAMESPACE,
+    'batch')
+
+CACHE_ALIAS = getattr(
+    settings,
+    '%s_CACHE_ALIAS' % APP_NAMESPACE,
+    'default')
+
+CACHE_ENABLED = getattr(
+    settings,
+    '%s_CACHE_ENABLED' % APP_NAMESPACE,
+    False)
+
+CACHE_TIMEOUT = getattr(
+    settings,
+    '%s_CACHE_TIMEOUT' % APP_NAMESPACE,
+    300)
+
+CACHE_KEY_PREFIX = getattr(
+    settings,
+    '%s_CACHE_KEY_PREFIX' % APP_NAMESPACE,
+    'badgify')
+
+CATALOGUE_TIMEOUT = getattr(
+    settings,
+    '%s_CATALOGUE_TIMEOUT' % APP_NAMESPACE,
+    300)
+
+CATALOGUE_CHECK_INTERVAL = getattr(
+    settings,
+    '%s_CATALOGUE_CHECK_INTERVAL' % APP_NAMESPACE,
+    5)
+
+REALTIME = getattr(
+    settings,
+    '%s_REALTIME' % APP_NAMESPACE,
+    False)
+
+REALTIME_ON_COMMIT = getattr(
+    settings,
+    '%s_REALTIME_ON_COMMIT' % APP_NAMESPACE,
+    True)
+
+REALTIME_SCHEDULER = getattr(
+    settings,
+    '%s_REALTIME_SCHEDULER' % APP_NAMESPACE,
+    None)
+
+DB_WRITE = getattr(
+    settings,
+    '%s_DB_WRITE' % APP_NAMESPACE,
+    None)
+
+DB_REPLICAS = getattr(
+    settings,
+    '%s_DB_REPLICAS' % APP_NAMESPACE,
+    [])
+
+REPLICA_MAX_LAG = getattr(
+    settings,
+    '%s_REPLICA_MAX_LAG' % APP_NAMESPACE,
+    5)
+
+REPLICA_LAG_WAIT = getattr(
+    settings,
+    '%s_REPLICA_LAG_WAIT' % APP_NAMESPACE,
+    0)
+
+MEMBERSHIP_PATH = getattr(
+    settings,
+    '%s_MEMBERSHIP_PATH' % APP_NAMESPACE,
+    None)
@@ -0,0 +1,31 @@
+from .cache import get_users_badge_ids
+from .catalogue import catalogue
+
+PREFETCH_ATTR = 'awarded_badges'
+
+
+def get_badges_for_users(user_ids):
+    """
+    Takes a list of users (objects or ids) and returns a dict: user id ->
+    list of awarded ``Badge`` objects. Awards of all users are fetched with a
+    single query (or from the cache) and badges come from the badge catalogue.
+    """
+    user_ids = [getattr(user_id, 'pk', user_id) for user_id in user_ids]
+    badge_ids = get_users_badge_ids(user_ids)
+
+    badges = catalogue.in_bulk(set(badge_id for ids in badge_ids.values() for badge_id in ids))
+
+    return dict((user_id, [badges[badge_id] for badge_id in ids if badge_id in badges])
+                for user_id, ids in badge_ids.items())
+
+
+def prefetch_badges(users, to_attr=PREFETCH_ATTR):
+    """
+    Sets the list of awarded badges to the ``to_attr`` attribute of each user
+    of ``users`` (list or queryset) and returns users as a list.
+    """
+    users = list(users)
+    badges = get_badges_for_users(users)
+    for user in users:
+        setattr(user, to_attr, badges[user.pk])
+    return users
@@ -1,21 +1,35 @@
 import logging
 
-from django.dispatch import receiver
-from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver, Signal
+from django.db.models.signals import post_delete, post_save, pre_delete
 
-from .models import Award
+from .models import Badge, Award
 
 logger = logging.getLogger('badgify')
 
 
+# Sent once per batch of awards created in bulk (sync).
+# Arguments: ``badge``, ``count`` and ``user_ids``.
+awards_bulk_created = Signal()
+
+# Sent once per batch of awards deleted in bulk (sync).
+# Arguments: ``badge``, ``count`` and ``user_ids``.
+awards_bulk_deleted = Signal()
+
+
 @receiver(post_save, sender=Award, dispatch_uid='badgify.award.post_save.increment_badge_users_count')
 def increment_badge_users_count(sender, instance, created, **kwargs):
     from django.db.models import F
     from .settings import AUTO_DENORMALIZE
 
+    # Awards created in bulk are counted once per batch (awards_bulk_created)
+    if kwargs.get('bulk'):
+        return
+
+    # Badge objects are shared by the catalogue: update the row, not the object
+    # (catalogue counts are refreshed within BADGIFY_CATALOGUE_TIMEOUT)
     if created and AUTO_DENORMALIZE:
-        instance.badge.users_count = F('users_count') + 1
-        instance.badge.save()
+        Badge.objects.filter(pk=instance.badge_id).update(users_count=F('users_count') + 1)
 
 
 @receiver(pre_delete, sender=Award, dispatch_uid='badgify.award.pre_delete.decrement_badge_users_count')
@@ -23,6 +37,146 @@ def decrement_badge_users_count(sender, instance, **kwargs):
     from django.db.models import F
     from .settings import AUTO_DENORMALIZE
 
-    if AUTO_DENORMALIZE and instance.badge.users_count >= 1:
-        instance.badge.users_count = F('users_count') - 1
-        instance.badge.save()
+    if AUTO_DENORMALIZE:
+        Badge.objects.filter(pk=instance.badge_id, users_count__gte=1).update(
+            users_count=F('users_count') - 1)
+
+
+@receiver(awards_bulk_created, sender=Award, dispatch_uid='badgify.award.bulk_created.increment_badge_users_count')
+def increment_badge_users_count_by(sender, badge, count, **kwargs):
+    from django.db.models import F
+    from .settings import AUTO_DENORMALIZE
+
+    if count and AUTO_DENORMALIZE:
+        Badge.objects.filter(pk=badge.pk).update(users_count=F('users_count') + count)
+
+
+@receiver(awards_bulk_deleted, sender=Award, dispatch_uid='badgify.award.bulk_deleted.decrement_badge_users_count')
+def decrement_badge_users_count_by(sender, badge, count, **kwargs):
+    from django.db.models import F, Value
+    from django.db.models.functions import Greatest
+    from .settings import AUTO_DENORMALIZE
+
+    if count and AUTO_DENORMALIZE:
+        Badge.objects.filter(pk=badge.pk).update(
+            users_count=Greatest(F('users_count') - count, Value(0)))
+
+
+@receiver(post_save, sender=Award, dispatch_uid='badgify.award.post_save.set_awards_changed_at')
+def set_awards_changed_at_on_save(sender, instance, created, **kwargs):
+    from .recipe import set_awards_changed_at
+
+    # Awards created in bulk are recorded once per batch
+    if created and not kwargs.get('bulk'):
+        set_awards_changed_at(Badge.objects.filter(pk=instance.badge_id).values('slug'))
+
+
+@receiver(post_delete, sender=Award, dispatch_uid='badgify.award.post_delete.set_awards_changed_at')
+def set_awards_changed_at_on_delete(sender, instance, **kwargs):
+    from .recipe import set_awards_changed_at
+
+    set_awards_changed_at(Badge.objects.filter(pk=instance.badge_id).values('slug'))
+
+
+@receiver(awards_bulk_created, sender=Award, dispatch_uid='badgify.award.bulk_created.set_awards_changed_at')
+@receiver(awards_bulk_deleted, sender=Award, dispatch_uid='badgify.award.bulk_deleted.set_awards_changed_at')
+def set_badge_awards_changed_at(sender, badge, **kwargs):
+    from .recipe import set_awards_changed_at
+
+    set_awards_changed_at([badge.slug])
+
+
+def _invalidate_users_badges(user_ids=None):
+    """
+    Invalidates cached badges of the given users (everything if users are
+    unknown) once the transaction is committed, so that concurrent readers
+    do not cache awards again before the commit.
+    """
+    from django.db import router, transaction
+    from .cache import invalidate_all, invalidate_user_badges
+
+    if user_ids is None:
+        transaction.on_commit(invalidate_all, using=router.db_for_write(Award))
+    else:
+        transaction.on_commit(lambda: invalidate_user_badges(user_ids), using=router.db_for_write(Award))
+
+
+@receiver(post_save, sender=Award, dispatch_uid='badgify.award.post_save.invalidate_user_badges')
+def invalidate_user_badges_on_save(sender, instance, **kwargs):
+    # Awards created in bulk are invalidated once per batch
+    if not kwargs.get('bulk'):
+        _invalidate_users_badges([instance.user_id])
+
+
+@receiver(post_delete, sender=Award, dispatch_uid='badgify.award.post_delete.invalidate_user_badges')
+def invalidate_user_badges_on_delete(sender, instance, **kwargs):
+    _invalidate_users_badges([instance.user_id])
+
+
+@receiver(awards_bulk_created, sender=Award, dispatch_uid='badgify.award.bulk_created.invalidate_user_badges')
+@receiver(awards_bulk_deleted, sender=Award, dispatch_uid='badgify.award.bulk_deleted.invalidate_user_badges')
+def invalidate_users_badges(sender, user_ids=None, **kwargs):
+    # Unknown users (awards created / deleted by the database): everything
+    _invalidate_users_badges(user_ids)
+
+
+def _update_membership(badge_id=None, slug=None, add=None, discard=None):
+    """
+    Updates the membership bitmap of the given badge once the transaction is
+    committed: adds / discards the given user ids, or deletes the bitmap if
+    users are unknown (rebuilt by the next sync).
+    """
+    from django.db import router, transaction
+    from .catalogue import catalogue
+    from .membership import membership
+
+    if not membership.enabled:
+        return
+
+    if slug is None:
+        badge = catalogue.get_by_id(badge_id)
+        if badge is None:
+            return
+        slug = badge.slug
+
+    def update():
+        if add is not None:
+            membership.add(slug, add)
+        elif discard is not None:
+            membership.discard(slug, discard)
+        else:
+            membership.invalidate(slug)
+
+    transaction.on_commit(update, using=router.db_for_write(Award))
+
+
+@receiver(post_save, sender=Award, dispatch_uid='badgify.award.post_save.update_membership')
+def add_membership(sender, instance, created, **kwargs):
+    # Awards created in bulk are added once per batch
+    if created and not kwargs.get('bulk'):
+        _update_membership(badge_id=instance.badge_id, add=[instance.user_id])
+
+
+@receiver(post_delete, sender=Award, dispatch_uid='badgify.award.post_delete.update_membership')
+def discard_membership(sender, instance, **kwargs):
+    _update_membership(badge_id=instance.badge_id, discard=[instance.user_id])
+
+
+@receiver(awards_bulk_created, sender=Award, dispatch_uid='badgify.award.bulk_created.update_membership')
+@receiver(awards_bulk_deleted, sender=Award, dispatch_uid='badgify.award.bulk_deleted.update_membership')
+def update_membership(sender, signal, badge, user_ids=None, **kwargs):
+    # Unknown users (awards created / deleted by the database): invalidated
+    if user_ids is None:
+        _update_membership(slug=badge.slug)
+    elif signal is awards_bulk_created:
+        _update_membership(slug=badge.slug, add=user_ids)
+    else:
+        _update_membership(slug=badge.slug, discard=user_ids)
+
+
+@receiver(post_save, sender=Badge, dispatch_uid='badgify.badge.post_save.bump_catalogue_version')
+@receiver(post_delete, sender=Badge, dispatch_uid='badgify.badge.post_delete.bump_catalogue_version')
+def bump_catalogue_version(sender, **kwargs):
+    from .catalogue import catalogue
+
+    catalogue.bump_version()
@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 from django import template
 
+from .. import settings
+from ..catalogue import catalogue
+from ..cache import get_user_badge_ids, get_user_id_for_username
 from ..models import Badge, Award
 from ..compat import get_user_model
+from ..shortcuts import PREFETCH_ATTR, prefetch_badges
 
 
 register = template.Library()
@@ -13,17 +17,39 @@ register_tag = register.assignment_tag if hasattr(register, 'assignment_tag') el
 def badgify_badges(**kwargs):
     """
     Returns all badges or only awarded badges for the given user.
+    With ``BADGIFY_CACHE_ENABLED``, awarded badge ids are cached per user.
+    Badges prefetched with ``badgify_prefetch_badges`` are used as is.
     """
     User = get_user_model()
     user = kwargs.get('user', None)
     username = kwargs.get('username', None)
+    if user is not None and hasattr(user, PREFETCH_ATTR):
+        return getattr(user, PREFETCH_ATTR)
+    if settings.CACHE_ENABLED:
+        user_id = getattr(user, 'pk', None)
+        if username:
+            user_id = get_user_id_for_username(username) or user_id
+        if user_id:
+            badge_ids = get_user_badge_ids(user_id)
+            badges = catalogue.in_bulk(badge_ids)
+            return [badges[badge_id] for badge_id in badge_ids if badge_id in badges]
+        return Badge.objects.all()
     if username:
         try:
             user = User.objects.get(username=username)
         except User.DoesNotExist:
             pass
     if user:
-        awards = Award.objects.filter(user=user).select_related('badge')
-        badges = [award.badge for award in awards]
-        return badges
+        badge_ids = list(Award.objects.filter(user=user).values_list('badge_id', flat=True))
+        badges = catalogue.in_bulk(badge_ids)
+        return [badges[badge_id] for badge_id in badge_ids if badge_id in badges]
     return Badge.objects.all()
+
+
+@register_tag
+def badgify_prefetch_badges(users):
+    """
+    Fetches awarded badges of all given users at once. Returns users as a
+    list, with badges in their ``awarded_badges`` attribute.
+    """
+    return prefetch_badges(users)
@@ -1,4 +1,6 @@
-from ..recipe import BaseRecipe
+from django.db.models.functions import Length
+
+from ..recipe import BaseRecipe, TieredRecipe
 from ..compat import get_user_model
 
 
@@ -37,3 +39,81 @@ class Recipe2(BaseRecipe):
     @property
     def user_ids(self):
         return []
+
+
+class BrokenRecipe(BaseRecipe):
+    name = 'Broken Recipe'
+    slug = 'broken-recipe'
+    description = 'Broken Recipe description'
+
+    @property
+    def image(self):
+        return 'image'
+
+    @property
+    def user_ids(self):
+        raise ValueError('Broken recipe')
+
+
+class IncrementalRecipe(Recipe1):
+    name = 'Incremental Recipe'
+    slug = 'incremental-recipe'
+    description = 'Incremental Recipe description'
+
+    def changed_user_ids(self, since):
+        return (get_user_model().objects.filter(last_login__gte=since)
+                                .values_list('id', flat=True))
+
+
+class RealtimeRecipe(Recipe1):
+    name = 'Realtime Recipe'
+    slug = 'realtime-recipe'
+    description = 'Realtime Recipe description'
+    triggers = ['tests.BadgifyUser']
+
+
+class AuditRecipe(Recipe1):
+    name = 'Audit Recipe'
+    slug = 'audit-recipe'
+    description = 'Audit Recipe description'
+    audit_users = True
+
+    def __init__(self):
+        self.events = []
+
+    def audit(self, action, user_ids, users=None):
+        self.events.append((action, list(user_ids), users))
+
+
+class CollectorRecipe(BaseRecipe):
+    name = 'Collector Recipe'
+    slug = 'collector-recipe'
+    description = 'Collector Recipe description'
+    depends_on = ['recipe1']
+
+    @property
+    def image(self):
+        return 'image'
+
+    @property
+    def user_ids(self):
+        return (get_user_model().objects.filter(badges__badge__slug='recipe1')
+                                .values_list('id', flat=True))
+
+
+class UsernameRecipe(TieredRecipe):
+    description = 'Username Recipe description'
+    tiers = [('username-bronze', 2), ('username-silver', 4), ('username-gold', 8)]
+
+    @property
+    def name(self):
+        return 'Username %d' % self.threshold
+
+    @property
+    def image(self):
+        return 'image'
+
+    @property
+    def scores(self):
+        return (get_user_model().objects.annotate(score=Length('username'))
+                                .values_list('id', 'score'))
@@ -5,10 +5,22 @@ ROOT = os.path.dirname(os.path.abspath(__file__))
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": ":memory:",
+        "NAME": os.environ.get("BADGIFY_SQLITE_NAME", ":memory:"),
     }
 }
 
+# Benchmarks need a database file (BADGIFY_SQLITE_NAME=/tmp/badgify.db) or
+# PostgreSQL (BADGIFY_POSTGRESQL_NAME=badgify, tests included)
+if os.environ.get("BADGIFY_POSTGRESQL_NAME"):
+    DATABASES["default"] = {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": os.environ["BADGIFY_POSTGRESQL_NAME"],
+        "USER": os.environ.get("BADGIFY_POSTGRESQL_USER", ""),
+        "PASSWORD": os.environ.get("BADGIFY_POSTGRESQL_PASSWORD", ""),
+        "HOST": os.environ.get("BADGIFY_POSTGRESQL_HOST", ""),
+        "PORT": os.environ.get("BADGIFY_POSTGRESQL_PORT", ""),
+    }
+
 SITE_ID = 1
 
 DEBUG = True
@@ -0,0 +1,59 @@
+import json
+import os
+import tempfile
+
+from imp import reload
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from .. import benchmark
+from .. import settings
+from ..catalogue import catalogue
+from ..compat import get_user_model
+from ..models import Badge
+
+
+class BenchmarkTestCase(TestCase):
+    """
+    Benchmark test case.
+    """
+
+    def setUp(self):
+        reload(settings)
+        catalogue.clear()
+
+    def test_run(self):
+        report = benchmark.run(users=30)
+        self.assertEqual(report['users'], 30)
+        self.assertEqual(
+            sorted(report['phases']),
+            sorted(['create_users', 'sync_badges', 'create_awards', 'sync_awards',
+                    'sync_awards_noop', 'sync_counts', 'templatetag', 'reset_awards']))
+        for metrics in report['phases'].values():
+            self.assertEqual(sorted(metrics), ['peak_memory_kb', 'queries', 'rows', 'time'])
+            self.assertIsNone(metrics['peak_memory_kb'])
+        # Peak RSS of the process, once per run
+        self.assertIn('peak_rss_kb', report)
+        self.assertGreater(report['phases']['sync_awards']['queries'], 0)
+        # Cleaned up
+        self.assertFalse(get_user_model().objects.exists())
+        self.assertFalse(Badge.objects.exists())
+
+    def test_trace_memory(self):
+        report = benchmark.run(users=10, trace_memory=True)
+        for metrics in report['phases'].values():
+            self.assertGreaterEqual(metrics['peak_memory_kb'], 0)
+        self.assertGreater(report['phases']['sync_awards']['peak_memory_kb'], 0)
+
+    def test_command(self):
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            call_command('badgify_benchmark', users=10, output=path, stdout=open(os.devnull, 'w'))
+            with open(path) as f:
+                report = json.load(f)
+            ratios = benchmark.compare(report, report)
+            self.assertEqual(ratios['sync_awards']['queries'], 1)
+        finally:
+            os.remove(path)
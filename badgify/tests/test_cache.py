@@ -0,0 +1,103 @@
+from imp import reload
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from .. import settings
+from ..catalogue import catalogue
+from .. import commands
+from .. import registry
+from ..cache import get_user_badge_ids, get_users_badge_ids, invalidate_all
+from ..models import Badge, Award
+from ..templatetags.badgify_tags import badgify_badges as badges_tag
+
+from .mixins import BadgeFixturesMixin, UserFixturesMixin
+from .recipes import Recipe1
+
+
+class CacheTestCase(TestCase, BadgeFixturesMixin, UserFixturesMixin):
+    """
+    Per-user badges cache test case.
+    """
+
+    def setUp(self):
+        reload(settings)
+        catalogue.clear()
+        settings.CACHE_ENABLED = True
+        cache.clear()
+        registry.clear()
+        self.create_users()
+        badges, slugs = self.get_dummy_badges(count=3)
+        for badge in badges:
+            badge.save()
+        self.badges = badges
+        Award.objects.create(user=self.user1, badge=self.badges[0])
+        Award.objects.create(user=self.user1, badge=self.badges[1])
+        Award.objects.create(user=self.user2, badge=self.badges[2])
+
+    def tearDown(self):
+        registry.clear()
+        reload(settings)
+
+    def test_get_user_badge_ids(self):
+        with self.assertNumQueries(1):
+            badge_ids = get_user_badge_ids(self.user1.pk)
+        self.assertEqual(badge_ids, [self.badges[0].pk, self.badges[1].pk])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user_badge_ids(self.user1.pk), badge_ids)
+
+    def test_get_users_badge_ids(self):
+        get_user_badge_ids(self.user1.pk)
+        # Only missing users are fetched, in one query
+        with self.assertNumQueries(1):
+            badge_ids = get_users_badge_ids([self.user1.pk, self.user2.pk, self.user3.pk])
+        self.assertEqual(badge_ids, {
+            self.user1.pk: [self.badges[0].pk, self.badges[1].pk],
+            self.user2.pk: [self.badges[2].pk],
+            self.user3.pk: [],
+        })
+        with self.assertNumQueries(0):
+            get_users_badge_ids([self.user1.pk, self.user2.pk, self.user3.pk])
+
+    def test_invalidation(self):
+        self.assertEqual(len(get_user_badge_ids(self.user3.pk)), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            award = Award.objects.create(user=self.user3, badge=self.badges[0])
+            # Not invalidated before commit: concurrent readers would cache
+            # the pre-commit awards again
+            with self.assertNumQueries(0):
+                self.assertEqual(len(get_user_badge_ids(self.user3.pk)), 0)
+        self.assertEqual(len(get_user_badge_ids(self.user3.pk)), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Award.objects.get(pk=award.pk).delete()
+        self.assertEqual(len(get_user_badge_ids(self.user3.pk)), 0)
+
+        # Bulk sync
+        registry.register(Recipe1)
+        commands.sync_badges()
+        self.user3.love_python = True
+        self.user3.save()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            commands.sync_awards()
+            self.assertEqual(get_user_badge_ids(self.user3.pk), [])
+        self.assertTrue(callbacks)
+        self.assertEqual(get_user_badge_ids(self.user3.pk),
+                         [Badge.objects.get(slug='recipe1').pk])
+
+        # Everything
+        Award.objects.filter(user=self.user3).update(badge=self.badges[1])
+        self.assertEqual(get_user_badge_ids(self.user3.pk),
+                         [Badge.objects.get(slug='recipe1').pk])
+        invalidate_all()
+        self.assertEqual(get_user_badge_ids(self.user3.pk), [self.badges[1].pk])
+
+    def test_templatetag(self):
+        badges_tag(user=self.user2)
+        badges_tag(username='johndoe')
+        # Cached badge ids and username, badges from the catalogue
+        with self.assertNumQueries(0):
+            badges = badges_tag(username='johndoe')
+        self.assertEqual(badges, self.badges[:2])
+        with self.assertNumQueries(0):
+            badges = badges_tag(user=self.user2)
+        self.assertEqual(badges, self.badges[2:])
@@ -0,0 +1,80 @@
+from imp import reload
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from .. import settings
+from ..catalogue import catalogue
+from ..compat import get_user_model
+from ..models import Award, Badge
+
+from .recipes import Recipe1
+
+
+class CatalogueTestCase(TestCase):
+    """
+    Badge catalogue test case.
+    """
+
+    def setUp(self):
+        reload(settings)
+        cache.clear()
+        catalogue.clear()
+        self.badge = Badge.objects.create(name='Djangonaut', slug='djangonaut')
+
+    def test_get(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(catalogue.get('djangonaut'), self.badge)
+            self.assertEqual(catalogue.get_by_id(self.badge.pk), self.badge)
+            self.assertEqual(catalogue.in_bulk([self.badge.pk]), {self.badge.pk: self.badge})
+            self.assertEqual(catalogue.all(), [self.badge])
+        # Misses are checked in the database
+        with self.assertNumQueries(1):
+            self.assertIsNone(catalogue.get('unknown'))
+
+    def test_version(self):
+        catalogue.get('djangonaut')
+        badge = Badge.objects.create(name='Pythonista', slug='pythonista')
+        # Saved badge: new version, catalogue reloaded
+        with self.assertNumQueries(1):
+            self.assertEqual(catalogue.get('pythonista'), badge)
+            self.assertEqual(catalogue.get('djangonaut'), self.badge)
+
+        # Updated without signals (eg. by another process)
+        Badge.objects.filter(pk=badge.pk).update(name='Pythonist')
+        self.assertEqual(catalogue.get('pythonista').name, 'Pythonista')
+        catalogue.bump_version()
+        self.assertEqual(catalogue.get('pythonista').name, 'Pythonist')
+
+    def test_check_interval(self):
+        settings.CATALOGUE_CHECK_INTERVAL = 60
+        catalogue.get('djangonaut')
+        # Bumped by another process: seen on next version check
+        cache.set(catalogue.version_key, 'other')
+        with self.assertNumQueries(0):
+            self.assertEqual(catalogue.get('djangonaut'), self.badge)
+        settings.CATALOGUE_CHECK_INTERVAL = 0
+        with self.assertNumQueries(1):
+            self.assertEqual(catalogue.get('djangonaut'), self.badge)
+
+    def test_awards_keep_version(self):
+        settings.AUTO_DENORMALIZE = True
+        user = get_user_model().objects.create_user('user', 'user@example.com', '$ecret')
+        version = catalogue.get_version()
+        award = Award.objects.create(user=user, badge=self.badge)
+        award.delete()
+        self.assertEqual(catalogue.get_version(), version)
+
+    def test_miss_reload(self):
+        catalogue.get('djangonaut')
+        Badge.objects.bulk_create([Badge(name='Pythonista', slug='pythonista')])
+        self.assertEqual(catalogue.get('pythonista').name, 'Pythonista')
+
+    def test_recipe(self):
+        recipe = Recipe1()
+        self.assertIsNone(recipe.badge)
+        badge, created = recipe.create_badge()
+        # Reloaded once (new badge), then shared by recipe instances
+        with self.assertNumQueries(1):
+            self.assertEqual(recipe.badge, badge)
+            self.assertEqual(Recipe1().badge, badge)
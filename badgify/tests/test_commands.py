@@ -1,15 +1,22 @@
+import threading
+
 from imp import reload
+from unittest import mock
 
+from django.db import connection
 from django.db.models import signals
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 
 from .. import settings
+from ..catalogue import catalogue
 from .. import commands
 from .. import registry
+from .. import signals as badgify_signals
 from ..models import Badge, Award
 from ..compat import get_user_model
 
-from .recipes import Recipe1, Recipe2
+from .recipes import Recipe1, Recipe2, BrokenRecipe, CollectorRecipe, UsernameRecipe
 
 
 class CommandsTestCase(TestCase):
@@ -19,6 +26,7 @@ class CommandsTestCase(TestCase):
 
     def setUp(self):
         reload(settings)
+        catalogue.clear()
         registry.clear()
 
         self.post_save_count = 0
@@ -70,6 +78,32 @@ class CommandsTestCase(TestCase):
 
         self.assertEqual(len(updated), 1)
         self.assertEqual(len(unchanged), 1)
+        self.assertEqual(Badge.objects.get(slug='recipe1').users_count, 1)
+
+    def test_sync_count_queries(self):
+        settings.AUTO_DENORMALIZE = False
+
+        User = get_user_model()
+        registry.register([Recipe1, Recipe2, BrokenRecipe])
+        commands.sync_badges()
+        for badge in Badge.objects.all():
+            for i in range(2):
+                user = User.objects.create_user('%s-%d' % (badge.slug, i), 'user@example.com', '$ecret')
+                Award.objects.create(user=user, badge=badge)
+
+        # Badges, grouped counts and a single UPDATE for every badge
+        with self.assertNumQueries(3):
+            updated, unchanged = commands.sync_counts()
+
+        self.assertEqual(len(updated), 3)
+        self.assertEqual(len(unchanged), 0)
+        self.assertEqual(set(Badge.objects.values_list('users_count', flat=True)), {2})
+
+        registry.unregister(BrokenRecipe)
+        Badge.objects.filter(slug='recipe2').delete()
+        updated, unchanged = commands.sync_counts()
+        self.assertEqual(len(updated), 0)
+        self.assertEqual(unchanged[1], 'recipe2')
 
     def test_sync_awards_auto_denormalize_false(self):
         settings.AUTO_DENORMALIZE = False
@@ -105,7 +139,7 @@ class CommandsTestCase(TestCase):
         commands.sync_awards()
 
         self.assertEqual(recipe.badge.users.count(), 1)
-        self.assertEqual(recipe.badge.users_count, 1)
+        self.assertEqual(recipe.uncached_badge.users_count, 1)
         self.assertEqual(self.post_save_count, 1)
         self.assertEqual(self.pre_delete_count, 0)
 
@@ -113,7 +147,37 @@ class CommandsTestCase(TestCase):
 
         self.assertEqual(self.pre_delete_count, 1)
         self.assertEqual(recipe.badge.users.count(), 0)
-        self.assertEqual(recipe.badge.users_count, 0)
+        self.assertEqual(recipe.uncached_badge.users_count, 0)
+
+    def test_sync_awards_bulk_denormalize(self):
+        settings.AUTO_DENORMALIZE = True
+
+        User = get_user_model()
+        users = [User.objects.create_user('user%d' % i, 'user%d@example.com' % i, '$ecret', love_python=True)
+                 for i in range(3)]
+        registry.register(Recipe1)
+        commands.sync_badges()
+        recipe = registry.get_recipe_instance('recipe1')
+
+        bulk_counts = []
+
+        def receiver(sender, badge, count, **kwargs):
+            bulk_counts.append(count)
+
+        badgify_signals.awards_bulk_created.connect(receiver)
+        commands.sync_awards()
+        badgify_signals.awards_bulk_created.disconnect(receiver)
+
+        self.assertEqual(bulk_counts, [3])
+        self.assertEqual(self.post_save_count, 3)
+        self.assertEqual(recipe.uncached_badge.users_count, 3)
+
+        users[0].love_python = False
+        users[0].save()
+        commands.sync_awards()
+
+        self.assertEqual(recipe.badge.users.count(), 2)
+        self.assertEqual(recipe.uncached_badge.users_count, 2)
 
     def test_sync_awards_disable_signals(self):
         settings.AUTO_DENORMALIZE = True
@@ -125,12 +189,205 @@ class CommandsTestCase(TestCase):
 
         self.assertEqual(len(created), 1)
         self.assertEqual(self.post_save_count, 0)
-        self.assertEqual(recipe.badge.users_count, 0)
+        self.assertEqual(recipe.uncached_badge.users_count, 0)
 
         user.love_python = True
         user.save()
 
         commands.sync_awards(**{'disable_signals': True})
 
-        self.assertEqual(recipe.badge.users_count, 0)
+        self.assertEqual(recipe.uncached_badge.users_count, 0)
         self.assertEqual(self.post_save_count, 0)
+
+    def test_sync_awards_isolates_failures(self):
+        user = get_user_model().objects.create_user('user', 'user@example.com', '$ecret')
+        user.love_python = True
+        user.save()
+
+        registry.register([BrokenRecipe, Recipe1])
+        commands.sync_badges()
+        with self.assertLogs('badgify', level='ERROR'):
+            results = commands.sync_awards()
+
+        self.assertEqual([r['badge'] for r in results], ['broken-recipe', 'recipe1'])
+        self.assertIn('Broken recipe', results[0]['error'])
+        self.assertIsNone(results[1]['error'])
+        self.assertEqual(Badge.objects.get(slug='recipe1').users.count(), 1)
+
+    def test_sync_awards_dependencies(self):
+        User = get_user_model()
+        User.objects.create_user('user1', 'user1@example.com', '$ecret', love_python=True)
+        user2 = User.objects.create_user('user2', 'user2@example.com', '$ecret')
+        registry.register([CollectorRecipe, Recipe1])
+        commands.sync_badges()
+
+        # Never synced: run after recipe1
+        results = commands.sync_awards()
+        self.assertEqual([(r['badge'], r.get('skipped', False)) for r in results],
+                         [('recipe1', False), ('collector-recipe', False)])
+        self.assertEqual(Badge.objects.get(slug='collector-recipe').users.count(), 1)
+
+        # Awards of recipe1 did not change: skipped
+        with self.assertLogs('badgify', level='DEBUG') as logs, \
+                mock.patch.object(Recipe1, 'checksum', True):
+            results = commands.sync_awards()
+        self.assertEqual([(r['badge'], r.get('skipped', False)) for r in results],
+                         [('recipe1', False), ('collector-recipe', True)])
+        self.assertTrue(results[0]['unchanged'])
+        self.assertTrue([line for line in logs.output if 'recipe1: unchanged (checksum)' in line])
+
+        # Awards of recipe1 changed: run
+        user2.love_python = True
+        user2.save()
+        results = commands.sync_awards()
+        self.assertEqual([(r['badge'], r.get('skipped', False)) for r in results],
+                         [('recipe1', False), ('collector-recipe', False)])
+        self.assertEqual(Badge.objects.get(slug='collector-recipe').users.count(), 2)
+
+        # Dependency not synced in this run: run
+        results = commands.sync_awards(badges=['collector-recipe'])
+        self.assertFalse(results[0].get('skipped', False))
+
+    def test_sync_awards_dependencies_changed_since_checkpoint(self):
+        User = get_user_model()
+        User.objects.create_user('user1', 'user1@example.com', '$ecret', love_python=True)
+        user2 = User.objects.create_user('user2', 'user2@example.com', '$ecret')
+        user3 = User.objects.create_user('user3', 'user3@example.com', '$ecret')
+        registry.register([CollectorRecipe, Recipe1])
+        commands.sync_badges()
+        commands.sync_awards()
+
+        def synced():
+            with mock.patch.object(Recipe1, 'checksum', True):
+                results = commands.sync_awards()
+            self.assertFalse([r for r in results if r['error']])
+            return [(r['badge'], r.get('skipped', False)) for r in results]
+
+        # Awards of recipe1 changed in a run where collector-recipe failed
+        user2.love_python = True
+        user2.save()
+        with mock.patch.object(CollectorRecipe, 'get_current_user_ids', side_effect=Exception('Broken')), \
+                self.assertLogs('badgify', level='ERROR'):
+            results = commands.sync_awards()
+        self.assertTrue(results[1]['error'])
+        self.assertEqual(synced(), [('recipe1', False), ('collector-recipe', False)])
+        self.assertEqual(Badge.objects.get(slug='collector-recipe').users.count(), 2)
+        self.assertEqual(synced(), [('recipe1', False), ('collector-recipe', True)])
+
+        # Awards of recipe1 changed outside syncs (evaluate_user, admin...)
+        user3.love_python = True
+        user3.save()
+        Award.objects.create(user=user3, badge=Badge.objects.get(slug='recipe1'))
+        self.assertEqual(synced(), [('recipe1', False), ('collector-recipe', False)])
+        self.assertEqual(Badge.objects.get(slug='collector-recipe').users.count(), 3)
+
+    def test_sync_awards_tiered(self):
+        User = get_user_model()
+        user1 = User.objects.create_user('ab', 'ab@example.com', '$ecret')
+        user2 = User.objects.create_user('abcd', 'abcd@example.com', '$ecret')
+        user3 = User.objects.create_user('abcdefgh', 'abcdefgh@example.com', '$ecret')
+        User.objects.create_user('a', 'a@example.com', '$ecret')
+        registry.register(UsernameRecipe)
+        commands.sync_badges()
+
+        def awarded():
+            return dict((slug, sorted(Badge.objects.get(slug=slug).users.values_list('id', flat=True)))
+                        for slug in ['username-bronze', 'username-silver', 'username-gold'])
+
+        # Scores are evaluated once for the three tiers
+        for i in range(2):
+            with CaptureQueriesContext(connection) as queries:
+                results = commands.sync_awards()
+            self.assertFalse([r for r in results if r['error']])
+            self.assertEqual(len([q for q in queries if 'LENGTH' in q['sql']]), 1)
+            executions = [r['metrics']['executions'].get('user_ids') for r in results]
+            self.assertEqual(executions, [1, 0, 0])
+            self.assertEqual(awarded(), {
+                'username-bronze': [user1.pk, user2.pk, user3.pk],
+                'username-silver': [user2.pk, user3.pk],
+                'username-gold': [user3.pk],
+            })
+
+        user3.username = 'abc'
+        user3.save()
+        commands.sync_awards()
+        self.assertEqual(awarded()['username-silver'], [user2.pk])
+
+        # Realtime: only this user's score is checked
+        recipe = registry.get_recipe_instance('username-silver')
+        self.assertTrue(recipe.is_user_eligible(user2.pk))
+        self.assertFalse(recipe.is_user_eligible(user3.pk))
+
+    def test_sync_awards_use_replicas(self):
+        registry.register([Recipe1, Recipe2])
+        commands.sync_badges()
+        with mock.patch.object(commands, 'get_read_database', return_value='default') as get_read_database:
+            results = commands.sync_awards(use_replicas=True)
+        # Replicas lag is checked before each recipe
+        self.assertEqual(get_read_database.call_count, 2)
+        self.assertFalse([r for r in results if r['error']])
+
+        with mock.patch.object(commands, 'get_read_database') as get_read_database:
+            commands.sync_awards(use_replicas=True, db_read='default')
+        self.assertFalse(get_read_database.called)
+
+
+class ParallelCommandsTestCase(TransactionTestCase):
+    """
+    Parallel commands test case.
+    """
+
+    def setUp(self):
+        reload(settings)
+        catalogue.clear()
+        registry.clear()
+
+    def tearDown(self):
+        registry.clear()
+
+    def test_sync_awards_threads(self):
+        user = get_user_model().objects.create_user('user', 'user@example.com', '$ecret')
+        user.love_python = True
+        user.save()
+
+        registry.register([Recipe1, BrokenRecipe])
+        commands.sync_badges()
+        with self.assertLogs('badgify', level='ERROR'):
+            results = commands.sync_awards(workers=2, worker_type='thread')
+
+        self.assertEqual([r['badge'] for r in results], ['recipe1', 'broken-recipe'])
+        self.assertIsNone(results[0]['error'])
+        self.assertIsNotNone(results[1]['error'])
+        self.assertEqual(Badge.objects.get(slug='recipe1').users.count(), 1)
+
+    def test_sync_awards_tiered_threads(self):
+        User = get_user_model()
+        User.objects.create_user('abcd', 'abcd@example.com', '$ecret', love_python=True)
+        registry.register([UsernameRecipe, Recipe1])
+        commands.sync_badges()
+
+        # Tiers of a family are synced by the same job
+        slugs = ['username-bronze', 'recipe1', 'username-silver', 'username-gold']
+        self.assertEqual(commands._get_sync_jobs(slugs),
+                         [['username-bronze', 'username-silver', 'username-gold'], ['recipe1']])
+
+        threads = set()
+
+        def get_scores(recipe, *args, **kwargs):
+            threads.add(threading.get_ident())
+            return get_scores.wrapped(recipe, *args, **kwargs)
+
+        get_scores.wrapped = UsernameRecipe.get_scores
+        with mock.patch.object(UsernameRecipe, 'get_scores', get_scores), \
+                mock.patch.object(UsernameRecipe, 'get_scores_queryset', autospec=True,
+                                  side_effect=UsernameRecipe.get_scores_queryset) as get_scores_queryset:
+            results = commands.sync_awards(workers=4, worker_type='thread')
+
+        self.assertEqual([r['badge'] for r in results],
+                         ['username-bronze', 'username-silver', 'username-gold', 'recipe1'])
+        self.assertFalse([r for r in results if r['error']])
+        # Scores are evaluated once for the three tiers, in the same worker
+        self.assertEqual(get_scores_queryset.call_count, 1)
+        self.assertEqual(len(threads), 1)
+        self.assertEqual(sorted(Badge.objects.filter(users__isnull=False).values_list('slug', flat=True)),
+                         ['recipe1', 'username-bronze', 'username-silver'])
@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+
+from imp import reload
+
+from django.test import TestCase
+
+from .. import commands, registry, settings
+from ..catalogue import catalogue
+from ..compat import get_user_model
+from ..instrumentation import RecipeMetrics, format_prometheus, format_statsd
+from ..models import Award
+
+from .recipes import Recipe1
+
+
+class InstrumentationTestCase(TestCase):
+    """
+    Instrumentation test case.
+    """
+
+    def setUp(self):
+        reload(settings)
+        catalogue.clear()
+        registry.clear()
+        registry.register(Recipe1)
+        User = get_user_model()
+        self.recipe = Recipe1()
+        self.badge, created = self.recipe.create_badge()
+        self.user1 = User.objects.create_user('user1', 'user1@example.com', '$ecret', love_python=True)
+        self.user2 = User.objects.create_user('user2', 'user2@example.com', '$ecret')
+        Award.objects.create(user=self.user2, badge=self.badge)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_phase(self):
+        metrics = RecipeMetrics('foo')
+        with metrics.phase('diff'):
+            list(Award.objects.all())
+        with self.assertRaises(ValueError):
+            with metrics.phase('diff'):
+                list(Award.objects.all())
+                raise ValueError
+        metrics.incr('awarded', 2)
+        data = metrics.as_dict()
+        self.assertEqual(data['phases']['diff']['queries'], 2)
+        self.assertEqual(data['counters'], {'awarded': 2})
+
+    def test_create_awards_metrics(self):
+        metrics = self.recipe.create_awards()
+        data = metrics.as_dict()
+        self.assertEqual(data['counters'], {'awarded': 1, 'unawarded': 1})
+        for phase in ('badge', 'diff', 'delete', 'insert', 'denormalize', 'report'):
+            self.assertIn(phase, data['phases'])
+        self.assertEqual(data['phases']['diff']['queries'], 2)
+        # INSERT ... ON CONFLICT DO NOTHING
+        self.assertEqual(data['phases']['insert']['queries'], 1)
+        self.assertEqual(data['phases']['delete']['rows'], 1)
+
+    def test_sync_awards_metrics_file(self):
+        path = os.path.join(self.tmpdir, 'badgify.prom')
+        results = commands.sync_awards(metrics_file=path)
+        self.assertEqual(results[0]['metrics']['counters'], {'awarded': 1, 'unawarded': 1})
+        with open(path) as f:
+            content = f.read()
+        self.assertEqual(content, format_prometheus(results))
+        self.assertIn('badgify_phase_queries{badge="%s",phase="insert"} 1' % self.recipe.slug, content)
+        self.assertIn('badgify_recipe_failed{badge="%s"} 0' % self.recipe.slug, content)
+        # Atomic replacement: no temporary file left, readable by collectors
+        self.assertEqual(os.listdir(self.tmpdir), ['badgify.prom'])
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o644)
+
+        statsd = format_statsd(results)
+        self.assertIn('badgify.%s.insert.queries:1|g' % self.recipe.slug, statsd)
+        self.assertIn('badgify.%s.awarded:1|g' % self.recipe.slug, statsd)
@@ -0,0 +1,163 @@
+import shutil
+import tempfile
+
+from imp import reload
+from unittest import skipUnless
+
+from django.test import TestCase
+
+from .. import commands
+from .. import registry
+from .. import settings
+from ..catalogue import catalogue
+from ..compat import get_user_model, pyroaring
+from ..membership import RoaringIds, SortedIds, membership
+from ..models import Award, Badge
+
+from .recipes import Recipe1, Recipe2
+
+
+class SortedIdsTestCase(TestCase):
+    """
+    Sorted ids test case.
+    """
+
+    def test_set_algebra(self):
+        a = SortedIds([5, 1, 3, 3])
+        b = SortedIds([3, 4, 5])
+        self.assertEqual(list(a), [1, 3, 5])
+        self.assertIn(3, a)
+        self.assertNotIn(2, a)
+        self.assertEqual(list(a & b), [3, 5])
+        self.assertEqual(list(a | b), [1, 3, 4, 5])
+        self.assertEqual(list(a - b), [1])
+
+    def test_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = '%s/ids' % directory
+            for ids in ([], [2, 1, 9]):
+                with open(path, 'wb') as f:
+                    f.write(SortedIds(ids).serialize())
+                loaded = SortedIds.load(path)
+                self.assertEqual(list(loaded), sorted(ids))
+                self.assertEqual(len(loaded), len(ids))
+        finally:
+            shutil.rmtree(directory)
+
+
+class MembershipTestCase(TestCase):
+    """
+    Membership index test case (sorted ids).
+    """
+
+    bitmap_class = SortedIds
+
+    def setUp(self):
+        reload(settings)
+        catalogue.clear()
+        registry.clear()
+        settings.MEMBERSHIP_PATH = tempfile.mkdtemp()
+        membership.bitmap_class = self.bitmap_class
+        membership.clear()
+
+        User = get_user_model()
+        self.users = [User.objects.create_user('user%d' % i, 'user%d@example.com' % i, '$ecret', love_python=True)
+                      for i in range(3)]
+        registry.register([Recipe1, Recipe2])
+        commands.sync_badges()
+
+    def tearDown(self):
+        shutil.rmtree(settings.MEMBERSHIP_PATH)
+        membership.bitmap_class = None
+        membership.clear()
+        registry.clear()
+
+    def test_sync_awards(self):
+        results = commands.sync_awards()
+        self.assertIn('membership', results[0]['metrics']['phases'])
+        self.assertTrue(membership.exists('recipe1'))
+
+        user_ids = [user.pk for user in self.users]
+        with self.assertNumQueries(0):
+            self.assertTrue(membership.has_badge(user_ids[0], 'recipe1'))
+            self.assertFalse(membership.has_badge(user_ids[0], 'recipe2'))
+            self.assertEqual(membership.count('recipe1'), 3)
+            self.assertEqual(sorted(membership.union('recipe1', 'recipe2')), user_ids)
+            self.assertEqual(list(membership.intersection('recipe1', 'recipe2')), [])
+            self.assertEqual(sorted(membership.difference('recipe1', 'recipe2')), user_ids)
+
+    def test_sync_awards_unchanged(self):
+        commands.sync_awards()
+        results = commands.sync_awards()
+        # Nothing awarded / unawarded: bitmaps are not rebuilt
+        self.assertNotIn('membership', results[0]['metrics']['phases'])
+        self.assertEqual(membership.count('recipe1'), 3)
+
+        membership.invalidate('recipe1')
+        results = commands.sync_awards()
+        self.assertIn('membership', results[0]['metrics']['phases'])
+        self.assertTrue(membership.exists('recipe1'))
+
+    def test_missing(self):
+        commands.sync_awards()
+        membership.invalidate('recipe1')
+        user_ids = [user.pk for user in self.users]
+
+        # Answered from awards, not rebuilt on access
+        with self.assertNumQueries(1):
+            self.assertTrue(membership.has_badge(user_ids[0], 'recipe1'))
+        with self.assertNumQueries(1):
+            self.assertEqual(membership.count('recipe1'), 3)
+        with self.assertNumQueries(1):
+            self.assertEqual(sorted(membership.get('recipe1')), user_ids)
+        self.assertFalse(membership.exists('recipe1'))
+
+    def test_build(self):
+        bitmap = membership.build('recipe2')
+        self.assertEqual(list(bitmap), [])
+
+        # Persisted by another process while waiting for the lock: kept
+        with self.assertNumQueries(0):
+            self.assertEqual(list(membership.build('recipe2', force=False)), [])
+        with self.assertNumQueries(1):
+            membership.build('recipe2')
+
+    def test_signals(self):
+        commands.sync_awards()
+        recipe2 = Badge.objects.get(slug='recipe2')
+        self.assertTrue(membership.exists('recipe2'))
+
+        # Updated once committed
+        with self.captureOnCommitCallbacks(execute=True):
+            award = Award.objects.create(user=self.users[0], badge=recipe2)
+            self.assertEqual(list(membership.get('recipe2')), [])
+        self.assertEqual(list(membership.load('recipe2')), [self.users[0].pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Award.objects.create(user=self.users[1], badge=recipe2)
+        self.assertEqual(sorted(membership.load('recipe2')), [self.users[0].pk, self.users[1].pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            award.delete()
+        self.assertEqual(list(membership.load('recipe2')), [self.users[1].pk])
+
+        # Bulk deletes of known users
+        with self.captureOnCommitCallbacks(execute=True):
+            registry.get_recipe_instance('recipe1').unaward_users([self.users[2].pk])
+        self.assertEqual(membership.count('recipe1'), 2)
+
+        # Missing bitmaps are left to the next rebuild
+        membership.invalidate('recipe2')
+        with self.captureOnCommitCallbacks(execute=True):
+            Award.objects.create(user=self.users[2], badge=recipe2)
+        self.assertFalse(membership.exists('recipe2'))
+
+
+@skipUnless(pyroaring, 'pyroaring is not installed')
+class RoaringMembershipTestCase(MembershipTestCase):
+    """
+    Membership index test case (roaring bitmaps).
+    """
+
+    bitmap_class = RoaringIds
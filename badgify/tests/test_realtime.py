@@ -0,0 +1,136 @@
+from imp import reload
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+import badgify
+
+from .. import settings
+from ..catalogue import catalogue
+from .. import realtime
+from .. import registry
+from ..models import Badge
+from ..realtime import connect_triggers, disconnect_triggers
+from ..compat import get_user_model
+
+from .recipes import RealtimeRecipe
+
+
+class RealtimeTestCase(TestCase):
+    """
+    Real-time awarding test case.
+    """
+
+    def setUp(self):
+        reload(settings)
+        catalogue.clear()
+        registry.clear()
+        cache.clear()
+        registry.register(RealtimeRecipe)
+        self.recipe = registry.get_recipe_instance('realtime-recipe')
+        self.recipe.create_badge()
+        self.badge = Badge.objects.get(slug='realtime-recipe')
+        self.user = get_user_model().objects.create_user('user', 'user@example.com', '$ecret')
+
+    def tearDown(self):
+        disconnect_triggers()
+        registry.clear()
+        RealtimeRecipe.debounce = 0
+
+    def test_evaluate_user(self):
+        self.assertEqual(badgify.evaluate_user(self.user), {'realtime-recipe': None})
+
+        self.user.love_python = True
+        self.user.save()
+        self.assertEqual(badgify.evaluate_user(self.user), {'realtime-recipe': True})
+        self.assertEqual(badgify.evaluate_user(self.user.pk), {'realtime-recipe': None})
+        self.assertEqual(self.badge.users.count(), 1)
+
+        self.user.love_python = False
+        self.user.save()
+        self.assertEqual(badgify.evaluate_user(self.user, recipes=['realtime-recipe']),
+                         {'realtime-recipe': False})
+        self.assertEqual(self.badge.users.count(), 0)
+
+    def test_evaluate_user_queries(self):
+        recipe = RealtimeRecipe()
+        self.assertEqual(recipe.badge, self.badge)
+        # Eligibility probe + award lookup
+        with self.assertNumQueries(2):
+            badgify.evaluate_user(self.user, recipes=[recipe])
+
+    def test_debounce(self):
+        RealtimeRecipe.debounce = 60
+        settings.REALTIME_SCHEDULER = schedule = mock.Mock()
+        self.assertEqual(badgify.evaluate_user(self.user), {'realtime-recipe': None})
+        self.assertFalse(schedule.called)
+
+        # Debounced: evaluated once the window ends
+        self.user.love_python = True
+        self.user.save()
+        self.assertEqual(badgify.evaluate_user(self.user), {})
+        self.assertEqual(badgify.evaluate_user(self.user), {})
+        self.assertEqual(schedule.call_count, 1)
+        delay, slug, user_id = schedule.call_args[0]
+        self.assertTrue(0 < delay <= 60)
+        self.assertEqual((slug, user_id), ('realtime-recipe', self.user.pk))
+        self.assertEqual(self.badge.users.count(), 0)
+
+        # The last change of the window is not lost
+        self.assertEqual(realtime.evaluate_deferred(slug, user_id), {'realtime-recipe': True})
+        self.assertEqual(self.badge.users.count(), 1)
+
+        self.assertEqual(badgify.evaluate_user(self.user, debounce=False), {'realtime-recipe': None})
+
+    def test_debounce_synchronous_scheduler(self):
+        RealtimeRecipe.debounce = 60
+        badgify.evaluate_user(self.user)
+
+        # No scheduler: debounced changes are evaluated right away
+        self.user.love_python = True
+        self.user.save()
+        self.assertEqual(badgify.evaluate_user(self.user), {})
+        self.assertEqual(self.badge.users.count(), 1)
+
+    def test_timer_scheduler(self):
+        RealtimeRecipe.debounce = 60
+        settings.REALTIME_SCHEDULER = 'badgify.realtime.timer_scheduler'
+        badgify.evaluate_user(self.user)
+        with mock.patch.object(realtime.threading, 'Timer') as timer:
+            badgify.evaluate_user(self.user)
+        delay, func = timer.call_args[0]
+        self.assertTrue(0 < delay <= 60)
+        self.assertEqual(timer.call_args[1]['args'], (realtime.evaluate_deferred, 'realtime-recipe', self.user.pk))
+        self.assertTrue(timer.return_value.daemon)
+        timer.return_value.start.assert_called_once_with()
+
+        # The mocked timer never runs: release its slot
+        realtime._timers.release()
+
+        # Bounded: evaluated right away once MAX_TIMERS timers are pending
+        with mock.patch.object(realtime, '_timers') as timers:
+            timers.acquire.return_value = False
+            self.assertEqual(realtime.timer_scheduler(60, 'realtime-recipe', self.user.pk),
+                             {'realtime-recipe': None})
+
+    def test_debounce_key_prefix(self):
+        settings.CACHE_KEY_PREFIX = 'custom'
+        RealtimeRecipe.debounce = 60
+        badgify.evaluate_user(self.user)
+        self.assertIsNotNone(cache.get('custom:debounce:realtime-recipe:%s' % self.user.pk))
+
+    def test_triggers(self):
+        connect_triggers()
+
+        self.user.love_python = True
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.badge.users.count(), 1)
+        self.assertEqual(Badge.objects.get(pk=self.badge.pk).users_count, 1)
+
+        disconnect_triggers()
+        self.user.love_python = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.badge.users.count(), 1)
@@ -0,0 +1,427 @@
+from imp import reload
+from unittest import mock, skipUnless
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .. import settings
+from ..catalogue import catalogue
+from ..models import Award, Badge
+from .. import recipe as recipe_module
+from ..recipe import bulk_create_awards, can_copy_awards, copy_awards, _copy_user_ids, _insert_awards
+from ..signals import awards_bulk_created, awards_bulk_deleted
+from ..utils import BatchSize, get_checksum
+from ..compat import get_user_model, numpy
+
+from .recipes import Recipe1, Recipe2, AuditRecipe, IncrementalRecipe
+
+
+class RecipeTestCase(TestCase):
+    """
+    Recipe test case.
+    """
+
+    def setUp(self):
+        reload(settings)
+        catalogue.clear()
+        User = get_user_model()
+        self.recipe = Recipe1()
+        self.badge, created = self.recipe.create_badge()
+        self.user1 = User.objects.create_user('user1', 'user1@example.com', '$ecret', love_python=True)
+        self.user2 = User.objects.create_user('user2', 'user2@example.com', '$ecret', love_python=True)
+        self.user3 = User.objects.create_user('user3', 'user3@example.com', '$ecret')
+        Award.objects.create(user=self.user2, badge=self.badge)
+        Award.objects.create(user=self.user3, badge=self.badge)
+
+    def test_user_ids_diff(self):
+        for diff_engine in ('sql', 'python'):
+            unawarded_ids, obsolete_ids = self.recipe.get_user_ids_diff(diff_engine=diff_engine)
+            self.assertEqual(unawarded_ids, [self.user1.pk])
+            self.assertEqual(obsolete_ids, [self.user3.pk])
+
+    @skipUnless(numpy, 'NumPy is not installed')
+    def test_user_ids_diff_numpy(self):
+        unawarded_ids, obsolete_ids = self.recipe.get_user_ids_diff(diff_engine='numpy')
+        self.assertEqual(unawarded_ids.tolist(), [self.user1.pk])
+        self.assertEqual(obsolete_ids.tolist(), [self.user3.pk])
+
+        unawarded_ids, obsolete_ids = self.recipe.get_user_ids_diff(diff_engine='numpy',
+                                                                    user_ids=[self.user2.pk, self.user3.pk])
+        self.assertEqual((unawarded_ids.tolist(), obsolete_ids.tolist()), ([], [self.user3.pk]))
+
+        self.recipe.create_awards(diff_engine='numpy', batch_size=1)
+        self.assertEqual(
+            sorted(self.badge.users.values_list('id', flat=True)),
+            [self.user1.pk, self.user2.pk])
+
+    def test_user_ids_diff_numpy_fallback(self):
+        with mock.patch('badgify.recipe.numpy', None):
+            unawarded_ids, obsolete_ids = self.recipe.get_user_ids_diff(diff_engine='numpy')
+        self.assertEqual((unawarded_ids, obsolete_ids), ([self.user1.pk], [self.user3.pk]))
+
+    def test_unawarded_and_obsolete_user_ids(self):
+        for diff_engine in ('sql', 'python'):
+            ids, count = self.recipe.get_unawarded_user_ids(diff_engine=diff_engine)
+            self.assertEqual((ids, count), ([self.user1.pk], 1))
+            ids, count = self.recipe.get_obsolete_user_ids(diff_engine=diff_engine)
+            self.assertEqual((ids, count), ([self.user3.pk], 1))
+
+    def test_can_diff_in_database(self):
+        current_ids = self.recipe.get_current_user_ids()
+        self.assertTrue(self.recipe.can_diff_in_database(current_ids))
+        self.assertFalse(self.recipe.can_diff_in_database(current_ids, diff_engine='python'))
+        self.assertFalse(self.recipe.can_diff_in_database(list(current_ids)))
+        self.assertFalse(self.recipe.can_diff_in_database(current_ids[:1]))
+
+    def test_sql_diff_queries(self):
+        recipe = Recipe1()
+        self.assertEqual(recipe.badge, self.badge)
+        # One query for ids to award, one for ids to unaward
+        with self.assertNumQueries(2):
+            recipe.get_user_ids_diff()
+
+    def test_iter_user_ids_diff(self):
+        batches = list(self.recipe.iter_user_ids_diff(batch_size=1))
+        self.assertEqual(batches, [([self.user1.pk], []), ([], [self.user3.pk])])
+
+    def test_create_awards_stream(self):
+        self.recipe.create_awards(diff_engine='stream', batch_size=1)
+        self.assertEqual(
+            sorted(self.badge.users.values_list('id', flat=True)),
+            [self.user1.pk, self.user2.pk])
+
+    def test_unaward_users_scoped_to_badge(self):
+        settings.AUTO_DENORMALIZE = True
+        other_badge, created = Recipe2().create_badge()
+        Award.objects.create(user=self.user3, badge=other_badge)
+        self.badge.refresh_from_db()
+        self.assertEqual(self.badge.users_count, 2)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.recipe.unaward_users([self.user3.pk])
+        queries = [query['sql'] for query in ctx.captured_queries]
+        # One DELETE, one users_count UPDATE and one checkpoint UPDATE, no award loaded
+        self.assertEqual(len([sql for sql in queries if sql.startswith('DELETE')]), 1)
+        self.assertEqual(len([sql for sql in queries if sql.startswith('UPDATE') and 'badgify_badge' in sql]), 1)
+        self.assertEqual(len([sql for sql in queries if sql.startswith('UPDATE') and 'badgify_checkpoint' in sql]), 1)
+        self.assertFalse([sql for sql in queries if sql.startswith('SELECT') and 'badgify_award' in sql])
+
+        self.assertFalse(self.badge.users.filter(pk=self.user3.pk).exists())
+        self.assertTrue(other_badge.users.filter(pk=self.user3.pk).exists())
+        self.badge.refresh_from_db()
+        other_badge.refresh_from_db()
+        self.assertEqual(self.badge.users_count, 1)
+        self.assertEqual(other_badge.users_count, 1)
+
+    def test_bulk_create_awards_conflicts(self):
+        settings.AUTO_DENORMALIZE = True
+        for supports_ignore_conflicts in (True, False):
+            Award.objects.filter(user=self.user1).delete()
+            Badge.objects.filter(pk=self.badge.pk).update(users_count=2)
+            objects = [Award(user_id=user.pk, badge=self.badge)
+                       for user in (self.user1, self.user2, self.user3)]
+            with mock.patch.object(connection.features, 'supports_ignore_conflicts', supports_ignore_conflicts):
+                count = bulk_create_awards(objects)
+            self.assertEqual(count, 1)
+            self.assertEqual(self.badge.users.count(), 3)
+            self.badge.refresh_from_db()
+            self.assertEqual(self.badge.users_count, 3)
+
+    def test_insert_awards_ignore_conflicts(self):
+        objects = [Award(user_id=self.user1.pk, badge=self.badge)]
+        with CaptureQueriesContext(connection) as ctx:
+            created, count = _insert_awards(objects, batch_size=10, using='default')
+        self.assertEqual((created, count), (objects, 1))
+        # No existing awards check: the diff already excluded them
+        self.assertEqual([query['sql'] for query in ctx.captured_queries
+                          if query['sql'].startswith('SELECT')], [])
+
+    def test_insert_awards_race(self):
+        # Awards created by a concurrent sync after the existing awards check
+        objects = [Award(user_id=user.pk, badge=self.badge) for user in (self.user1, self.user2)]
+        for supports_ignore_conflicts in (True, False):
+            with mock.patch.object(connection.features, 'supports_ignore_conflicts', supports_ignore_conflicts):
+                with mock.patch('badgify.recipe._get_awarded_user_ids', return_value=set()):
+                    created, count = _insert_awards(objects, batch_size=10, using='default')
+            # user2 award already exists: only user1 award is inserted
+            self.assertEqual(count, 1)
+            if supports_ignore_conflicts:
+                # Inserted rows cannot be told apart
+                self.assertIsNone(created)
+            else:
+                self.assertEqual([obj.user_id for obj in created], [self.user1.pk])
+            self.assertEqual(self.badge.users.count(), 3)
+            Award.objects.filter(user=self.user1).delete()
+
+    def test_create_awards_copy_loader_fallback(self):
+        # Not PostgreSQL: batched inserts
+        self.assertFalse(can_copy_awards())
+        self.recipe.create_awards(loader='copy')
+        self.assertEqual(
+            sorted(self.badge.users.values_list('id', flat=True)),
+            [self.user1.pk, self.user2.pk])
+
+    def test_copy_user_ids(self):
+        consumed = []
+
+        def user_ids():
+            for user_id in [1, 2, 3]:
+                consumed.append(user_id)
+                yield user_id
+
+        # psycopg 3
+        cursor = mock.Mock(spec=['copy'])
+        cursor.copy.return_value = mock.MagicMock()
+        _copy_user_ids(cursor, user_ids(), chunk_size=2)
+        copy = cursor.copy.return_value.__enter__.return_value
+        self.assertEqual(copy.write.call_args_list, [mock.call('1\n2\n'), mock.call('3\n')])
+
+        # psycopg2: ids are read on demand
+        del consumed[:]
+        cursor = mock.Mock(spec=['copy_expert'])
+        _copy_user_ids(cursor, user_ids(), chunk_size=2)
+        sql, data = cursor.copy_expert.call_args[0]
+        self.assertEqual(sql, 'COPY badgify_award_copy (user_id) FROM STDIN')
+        self.assertEqual(consumed, [])
+        self.assertEqual(data.read(3), '1\n2')
+        self.assertEqual(consumed, [1, 2])
+        self.assertEqual(data.read(3), '\n')
+        self.assertEqual(data.read(3), '3\n')
+        self.assertEqual(data.read(3), '')
+        self.assertEqual(consumed, [1, 2, 3])
+
+    def test_copy_awards(self):
+        settings.AUTO_DENORMALIZE = True
+        connection = mock.MagicMock(vendor='postgresql')
+        connection.ops.quote_name.side_effect = lambda name: '"%s"' % name
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.rowcount = 2
+        user_ids = [self.user1.pk, self.user2.pk]
+        users_count = Badge.objects.get(pk=self.badge.pk).users_count
+
+        with mock.patch.object(recipe_module, 'connections', {'default': connection}), \
+                mock.patch.object(recipe_module.transaction, 'atomic'), \
+                mock.patch.object(recipe_module, '_copy_user_ids') as copy_user_ids:
+            self.assertTrue(can_copy_awards())
+            self.assertEqual(copy_awards(self.badge, user_ids, chunk_size=10), 2)
+
+        copy_user_ids.assert_called_once_with(cursor.cursor, user_ids, 10)
+        queries = [call[0][0] for call in cursor.execute.call_args_list]
+        self.assertEqual(queries[:2], [
+            'DROP TABLE IF EXISTS badgify_award_copy',
+            'CREATE TEMPORARY TABLE badgify_award_copy (user_id bigint NOT NULL) ON COMMIT DROP'])
+        self.assertEqual(queries[2],
+                         'INSERT INTO "badgify_award" ("user_id", "badge_id", "awarded_at") '
+                         'SELECT user_id, %s, %s FROM badgify_award_copy ON CONFLICT DO NOTHING')
+        self.assertEqual(cursor.execute.call_args_list[2][0][1][0], self.badge.pk)
+        # Counted once (awards_bulk_created)
+        self.assertEqual(Badge.objects.get(pk=self.badge.pk).users_count, users_count + 2)
+
+    def test_create_awards_sql_mode(self):
+        settings.AUTO_DENORMALIZE = True
+        current_ids = self.recipe.get_current_user_ids()
+        self.assertFalse(self.recipe.can_award_in_database(current_ids))
+        self.assertTrue(self.recipe.can_award_in_database(current_ids, post_save_signal=False))
+        self.assertFalse(self.recipe.can_award_in_database(list(current_ids), post_save_signal=False))
+
+        self.recipe.sql_mode = True
+        self.recipe.checksum = False
+        self.assertTrue(self.recipe.can_award_in_database(current_ids))
+        with CaptureQueriesContext(connection) as ctx:
+            metrics = self.recipe.create_awards()
+        self.assertEqual(metrics.counters, {'awarded': 1, 'unawarded': 1})
+        # No user id leaves the database (but the can_perform_awarding() exists() probe)
+        self.assertEqual(len([query for query in ctx.captured_queries
+                              if query['sql'].startswith('SELECT') and 'tests_badgifyuser' in query['sql']]), 1)
+        self.assertEqual(
+            sorted(self.badge.users.values_list('id', flat=True)),
+            [self.user1.pk, self.user2.pk])
+        self.badge.refresh_from_db()
+        self.assertEqual(self.badge.users_count, 2)
+
+        # Nothing to do: no bulk signal (receivers would invalidate caches)
+        receiver = mock.Mock()
+        awards_bulk_created.connect(receiver)
+        awards_bulk_deleted.connect(receiver)
+        try:
+            metrics = self.recipe.create_awards()
+        finally:
+            awards_bulk_created.disconnect(receiver)
+            awards_bulk_deleted.disconnect(receiver)
+        self.assertEqual(metrics.counters, {'awarded': 0, 'unawarded': 0})
+        self.assertFalse(receiver.called)
+
+    def test_create_awards_sql_mode_reported(self):
+        recipe = AuditRecipe()
+        recipe.create_badge()
+        recipe.sql_mode = True
+        recipe.checksum = False
+        current_ids = recipe.get_current_user_ids()
+        # Awarded users are audited: not synced in the database
+        self.assertFalse(recipe.can_award_in_database(current_ids))
+        recipe.create_awards()
+        self.assertEqual([(action, sorted(user_ids)) for action, user_ids, users in recipe.events],
+                         [('awarded', [self.user1.pk, self.user2.pk])])
+
+        # DEBUG logging reports users too
+        with mock.patch.object(Recipe1, 'sql_mode', True):
+            self.assertTrue(Recipe1().can_award_in_database(current_ids))
+            with self.assertLogs('badgify', level='DEBUG'):
+                self.assertFalse(Recipe1().can_award_in_database(current_ids))
+
+    def test_create_awards_evaluates_user_ids_once(self):
+        for diff_engine, executions in (
+                ('python', {'user_ids.exists': 1, 'user_ids': 1, 'awarded_ids': 1}),
+                # The queryset is built, not evaluated
+                ('sql', {'user_ids': 0, 'user_ids.exists': 1, 'unawarded_ids': 1, 'obsolete_ids': 1})):
+            recipe = Recipe1()
+            with mock.patch.object(Recipe1, 'user_ids', new_callable=mock.PropertyMock,
+                                   return_value=self.recipe.user_ids) as user_ids:
+                metrics = recipe.create_awards(diff_engine=diff_engine)
+            self.assertEqual(user_ids.call_count, 1)
+            self.assertEqual(metrics.executions, executions)
+            self.assertEqual(metrics.as_dict()['executions'], executions)
+            # Outside of a run, user_ids is built again
+            self.assertIsNot(recipe.get_current_user_ids(), recipe.get_current_user_ids())
+
+    def test_checksum(self):
+        User = get_user_model()
+        for pk in range(1001, 1008):
+            User.objects.create_user('checksum%d' % pk, 'checksum@example.com', '$ecret', id=pk)
+
+        # Same count, sum and sum of squares
+        first, second = [1001, 1005, 1006], [1002, 1003, 1007]
+        self.assertEqual((len(first), sum(first), sum(pk * pk for pk in first)),
+                         (len(second), sum(second), sum(pk * pk for pk in second)))
+
+        users = User.objects.values_list('id', flat=True)
+        self.assertNotEqual(get_checksum(users.filter(id__in=first), 'id'),
+                            get_checksum(users.filter(id__in=second), 'id'))
+        self.assertEqual(get_checksum(users.filter(id__in=first), 'id'),
+                         get_checksum(users.filter(id__in=list(reversed(first))), 'id'))
+
+        # Awards of the first users, recipe returning the second ones
+        Award.objects.filter(badge=self.badge).delete()
+        for pk in first:
+            Award.objects.create(user_id=pk, badge=self.badge)
+        self.recipe.checksum = True
+        with mock.patch.object(Recipe1, 'user_ids', new_callable=mock.PropertyMock,
+                               return_value=users.filter(id__in=second)):
+            metrics = self.recipe.create_awards()
+        self.assertEqual(metrics.counters, {'awarded': 3, 'unawarded': 3})
+        self.assertEqual(sorted(self.badge.users.values_list('id', flat=True)), second)
+
+    def test_create_awards_checksum(self):
+        self.recipe.checksum = True
+        current_ids = self.recipe.get_current_user_ids()
+        self.assertFalse(self.recipe.has_unchanged_awards(current_ids))
+        # Lists are diffed
+        self.assertFalse(self.recipe.has_unchanged_awards(list(current_ids)))
+
+        metrics = self.recipe.create_awards()
+        self.assertEqual(metrics.counters, {'awarded': 1, 'unawarded': 1})
+        self.assertTrue(self.recipe.has_unchanged_awards(current_ids))
+
+        # Only aggregates leave the database
+        with CaptureQueriesContext(connection) as ctx:
+            metrics = self.recipe.create_awards()
+        self.assertEqual(metrics.counters, {'unchanged': 1})
+        self.assertNotIn('diff', metrics.phases)
+        self.assertFalse([query for query in ctx.captured_queries
+                          if query['sql'].startswith('SELECT "tests_badgifyuser"."id"')])
+
+        # Same count, different users
+        self.user1.love_python = False
+        self.user1.save()
+        self.user3.love_python = True
+        self.user3.save()
+        metrics = self.recipe.create_awards()
+        self.assertEqual(metrics.counters, {'awarded': 1, 'unawarded': 1})
+
+    def test_can_perform_awarding_probe(self):
+        self.assertEqual(self.recipe.badge, self.badge)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertTrue(self.recipe.can_perform_awarding())
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertIn('LIMIT 1', ctx.captured_queries[0]['sql'])
+
+    def test_batch_size(self):
+        batch_size = BatchSize(100, maximum=300, adaptive=True, target_time=0.2)
+        # Fast batch: doubled at most
+        batch_size.record(100, 0.01)
+        self.assertEqual(batch_size.size, 200)
+        # Capped to the backend limit
+        batch_size.record(200, 0.01)
+        self.assertEqual(batch_size.size, 300)
+        # Slow batch: halved at most
+        batch_size.record(300, 10)
+        self.assertEqual(batch_size.size, 150)
+        # Toward the target time
+        batch_size.record(150, 0.25)
+        self.assertEqual(batch_size.size, 120)
+        self.assertEqual(batch_size.as_dict(), {'batches': 4, 'min': 100, 'max': 300, 'last': 150})
+
+        batch_size = BatchSize(100, maximum=50)
+        batch_size.record(50, 0.01)
+        self.assertEqual(batch_size.size, 50)
+
+    def test_get_batch_sizes(self):
+        batch_sizes = self.recipe.get_batch_sizes(batch_size=5000)
+        max_query_params = connection.features.max_query_params
+        self.assertEqual(batch_sizes['insert'].size, max_query_params // 3)
+        self.assertEqual(batch_sizes['delete'].size, max_query_params - 1)
+        self.assertFalse(batch_sizes['insert'].adaptive)
+
+    def test_create_awards_adaptive_batch_size(self):
+        User = get_user_model()
+        User.objects.bulk_create([User(username='user%d' % i, love_python=True) for i in range(4, 30)])
+        for diff_engine in ('sql', 'stream'):
+            Award.objects.all().delete()
+            metrics = self.recipe.create_awards(batch_size=1, diff_engine=diff_engine, adaptive_batch_size=True)
+            self.assertEqual(self.badge.users.count(), 28)
+            batch_sizes = metrics.as_dict()['batch_sizes']
+            self.assertGreater(batch_sizes['insert']['max'], 1)
+            self.assertLess(batch_sizes['insert']['batches'], 28)
+
+    def test_report_does_not_load_users(self):
+        # "badgify" logger is not enabled for DEBUG in tests settings
+        with CaptureQueriesContext(connection) as ctx:
+            self.recipe.create_awards()
+        # No full-row fetch of users (only ids, for the diff)
+        self.assertFalse([query for query in ctx.captured_queries
+                          if '"tests_badgifyuser"."password"' in query['sql']])
+
+    def test_report_audit_users(self):
+        recipe = AuditRecipe()
+        recipe.create_badge()
+        recipe.create_awards()
+        self.assertEqual(recipe.events, [('awarded', [self.user1.pk, self.user2.pk], [self.user1, self.user2])])
+
+    def test_create_awards_incremental(self):
+        recipe = IncrementalRecipe()
+        badge, created = recipe.create_badge()
+        self.assertIsNone(recipe.get_last_synced_at())
+
+        # No checkpoint: full sync
+        recipe.create_awards(incremental=True)
+        self.assertEqual(badge.users.count(), 2)
+        synced_at = recipe.get_last_synced_at()
+        self.assertIsNotNone(synced_at)
+
+        # Unchanged user (last_login) is not checked
+        self.user3.love_python = True
+        self.user3.save()
+        recipe.create_awards(incremental=True)
+        self.assertEqual(badge.users.count(), 2)
+        self.assertGreater(recipe.get_last_synced_at(), synced_at)
+
+        # Changed user is awarded, then unawarded
+        for diff_engine, love_python in (('python', True), ('sql', False)):
+            self.user3.love_python = love_python
+            self.user3.last_login = timezone.now()
+            self.user3.save()
+            recipe.create_awards(incremental=True, diff_engine=diff_engine)
+            self.assertEqual(badge.users.filter(pk=self.user3.pk).exists(), love_python)
+            self.assertEqual(badge.users.count(), 3 if love_python else 2)
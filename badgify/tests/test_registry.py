@@ -1,13 +1,15 @@
 from django.test import TestCase
 
-from ..exceptions import BadgeNotFound
+from ..exceptions import BadgeNotFound, CircularDependency
 from ..recipe import BaseRecipe
 from ..registry import BadgifyRegistry as Registry
 
 from .recipes import (
     Recipe1,
     Recipe2,
-    BadRecipe)
+    BadRecipe,
+    CollectorRecipe,
+    UsernameRecipe)
 
 
 class RegistryTestCase(TestCase):
@@ -21,6 +23,15 @@ class RegistryTestCase(TestCase):
         self.assertTrue(isinstance(registry.recipes, dict))
         self.assertEqual(len(registry.recipes), 1)
 
+    def test_register_tiered_recipe(self):
+        registry = Registry()
+        registry.register(UsernameRecipe)
+        self.assertEqual(sorted(registry.registered),
+                         ['username-bronze', 'username-gold', 'username-silver'])
+        self.assertEqual(registry.get_recipe_instance('username-silver').threshold, 4)
+        registry.unregister(UsernameRecipe)
+        self.assertEqual(registry.registered, [])
+
     def test_registered(self):
         registry = Registry()
         registry.register(Recipe1)
@@ -103,3 +114,26 @@ class RegistryTestCase(TestCase):
         instance = registry.get_recipe_instance_from_class(Recipe1)
         self.assertTrue(isinstance(instance, Recipe1))
         self.assertRaises(AssertionError, registry.get_recipe_instance_from_class, BadRecipe)
+
+    def test_get_recipe_levels(self):
+        registry = Registry()
+        registry.register([CollectorRecipe, Recipe1, Recipe2])
+        levels = registry.get_recipe_levels(registry.get_recipe_instances())
+        self.assertEqual([[r.slug for r in level] for level in levels],
+                         [['recipe1', 'recipe2'], ['collector-recipe']])
+
+        # Dependencies not selected are ignored
+        levels = registry.get_recipe_levels(registry.get_recipe_instances(badges=['collector-recipe']))
+        self.assertEqual([[r.slug for r in level] for level in levels], [['collector-recipe']])
+
+    def test_get_recipe_levels_circular(self):
+        class CircularRecipe(Recipe2):
+            slug = 'circular-recipe'
+            depends_on = ['collector-recipe', 'unknown']
+
+        class CollectorCircularRecipe(CollectorRecipe):
+            depends_on = ['circular-recipe']
+
+        registry = Registry()
+        registry.register([CircularRecipe, CollectorCircularRecipe, Recipe1])
+        self.assertRaises(CircularDependency, registry.get_recipe_levels, registry.get_recipe_instances())
@@ -0,0 +1,90 @@
+from imp import reload
+from unittest import mock
+
+from django.db import DatabaseError
+from django.test import TestCase
+
+from .. import routers, settings
+from ..models import Award
+from ..routers import BadgifyRouter, get_read_database, get_replica_lag
+
+from .models import BadgifyUser
+
+
+class RoutersTestCase(TestCase):
+    """
+    Routers test case.
+    """
+
+    def setUp(self):
+        reload(settings)
+
+    def test_router(self):
+        router = BadgifyRouter()
+        self.assertEqual(router.db_for_write(Award), 'default')
+        self.assertEqual(router.db_for_read(Award), 'default')
+        self.assertIsNone(router.db_for_write(BadgifyUser))
+        self.assertIsNone(router.allow_migrate('replica', 'badgify'))
+
+        settings.DB_WRITE = 'primary'
+        self.assertEqual(router.db_for_write(Award), 'primary')
+        self.assertEqual(router.db_for_read(Award), 'primary')
+        self.assertFalse(router.allow_migrate('replica', 'badgify'))
+        self.assertTrue(router.allow_migrate('primary', 'badgify'))
+        self.assertIsNone(router.allow_migrate('replica', 'tests'))
+
+    def test_get_replica_lag(self):
+        # Not a replica
+        self.assertEqual(get_replica_lag('default'), 0)
+
+    def check_replica_lag(self, vendor, rows, columns=(), errors=()):
+        connection = mock.MagicMock(vendor=vendor)
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.description = [(column, ) for column in columns]
+        cursor.fetchone.side_effect = rows
+
+        def execute(sql):
+            if sql in errors:
+                raise DatabaseError(sql)
+
+        cursor.execute.side_effect = execute
+        with mock.patch.object(routers, 'connections', {'replica': connection}):
+            return get_replica_lag('replica'), [call[0][0] for call in cursor.execute.call_args_list]
+
+    def test_get_replica_lag_postgresql(self):
+        lag, queries = self.check_replica_lag('postgresql', [(12, )])
+        self.assertEqual(lag, 12.0)
+        # Replayed all received WAL: not lagging, even if the primary is idle
+        self.assertIn('pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0', queries[0])
+        self.assertIsNone(self.check_replica_lag('postgresql', [(None, )])[0])
+
+    def test_get_replica_lag_mysql(self):
+        lag, queries = self.check_replica_lag('mysql', [(3, 'Yes')], columns=['Seconds_Behind_Source', 'Replica_IO_Running'])
+        self.assertEqual(lag, 3.0)
+        self.assertEqual(queries, ['SHOW REPLICA STATUS'])
+
+        # Older MySQL / MariaDB
+        lag, queries = self.check_replica_lag('mysql', [(None, )], columns=['Seconds_Behind_Master'],
+                                            errors=['SHOW REPLICA STATUS'])
+        self.assertIsNone(lag)
+        self.assertEqual(queries, ['SHOW REPLICA STATUS', 'SHOW SLAVE STATUS'])
+
+        # Not a replica
+        self.assertEqual(self.check_replica_lag('mysql', [None])[0], 0)
+
+    def test_get_read_database(self):
+        self.assertEqual(get_read_database(), 'default')
+
+        lags = {'replica1': 30, 'replica2': 1}
+        with mock.patch.object(routers, 'get_replica_lag', side_effect=lags.get):
+            self.assertEqual(get_read_database(['replica1', 'replica2'], max_lag=5), 'replica2')
+            self.assertEqual(get_read_database(['replica1'], max_lag=5), 'default')
+            self.assertEqual(get_read_database(['replica1'], max_lag=60), 'replica1')
+            self.assertEqual(get_read_database(['replica3'], max_lag=60), 'default')
+
+    def test_get_read_database_wait(self):
+        lags = iter([30, 10, 2])
+        with mock.patch.object(routers, 'get_replica_lag', side_effect=lambda alias: next(lags)):
+            with mock.patch.object(routers.time, 'sleep') as sleep:
+                self.assertEqual(get_read_database(['replica1'], max_lag=5, wait=10), 'replica1')
+                self.assertEqual(sleep.call_count, 2)
@@ -3,6 +3,7 @@ from django.test import TestCase
 
 from ..models import Award
 from ..templatetags.badgify_tags import badgify_badges as badges_tag
+from ..shortcuts import get_badges_for_users
 
 from .models import BadgifyUser as User
 from .mixins import BadgeFixturesMixin, UserFixturesMixin
@@ -60,3 +61,45 @@ class BadgesTagTestCase(TestCase, BadgeFixturesMixin, UserFixturesMixin):
         rendered = template.render(Context({'user': self.user}))
         self.assertIn(self.badge.name, rendered)
         self.assertIn(self.badge.slug, rendered)
+
+
+class PrefetchBadgesTagTestCase(TestCase, BadgeFixturesMixin, UserFixturesMixin):
+    """
+    ``badgify_prefetch_badges`` templatetag test case.
+    """
+
+    def setUp(self):
+        badges, slugs = self.get_dummy_badges(count=2)
+        for badge in badges:
+            badge.save()
+        self.badges = badges
+        self.create_users()
+        Award.objects.create(badge=self.badges[0], user=self.user1)
+        Award.objects.create(badge=self.badges[1], user=self.user1)
+        Award.objects.create(badge=self.badges[0], user=self.user2)
+
+    def test_get_badges_for_users(self):
+        with self.assertNumQueries(2):
+            badges = get_badges_for_users([self.user1, self.user2.pk, self.user3.pk])
+        self.assertEqual(badges[self.user1.pk], self.badges)
+        self.assertEqual(badges[self.user2.pk], self.badges[:1])
+        self.assertEqual(badges[self.user3.pk], [])
+        # Same badge, same object
+        self.assertIs(badges[self.user1.pk][0], badges[self.user2.pk][0])
+
+    def test_prefetch(self):
+        template = Template('''
+            {% load badgify_tags %}
+            {% badgify_prefetch_badges users as users %}
+            {% for user in users %}
+                {% badgify_badges user=user as badges %}
+                {{ user.username }}:{% for badge in badges %}{{ badge.slug }},{% endfor %}
+            {% endfor %}
+        ''')
+        users = User.objects.order_by('pk')
+        # Users, awards and badges
+        with self.assertNumQueries(3):
+            rendered = template.render(Context({'users': users}))
+        self.assertIn('johndoe:%s,%s,' % (self.badges[0].slug, self.badges[1].slug), rendered)
+        self.assertIn('mikedavis:%s,' % self.badges[0].slug, rendered)
+        self.assertIn('banana:\n', rendered)
@@ -1,9 +1,13 @@
+import itertools
 import logging
 
 from importlib import import_module
 
 from django.core import exceptions
 from django.db import connection
+from django.db.models import BigIntegerField, Count, F, Sum
+from django.db.models.functions import Cast
+from django.db.models.query import QuerySet
 
 import six
 
@@ -100,12 +104,171 @@ def get_model_string(model_name):
     return '%s.%s' % (app_label, model_name)
 
 
-def chunks(l, n):
+def chunks(items, n):
     """
-    Yields successive n-sized chunks from l.
+    Yields successive n-sized chunks (lists) from items (any iterable,
+    consumed lazily).
     """
-    for i in range(0, len(l), n):
-        yield l[i:i + n]
+    iterator = iter(items)
+    while True:
+        chunk = list(itertools.islice(iterator, n))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_batches(items, batch_size):
+    """
+    Yields successive chunks (lists) from items (list or NumPy array), sized
+    by ``batch_size.size`` (a ``BatchSize``) at the time each chunk is yielded.
+    """
+    i = 0
+    while i < len(items):
+        size = batch_size.size
+        yield to_list(items[i:i + size])
+        i += size
+
+
+def to_list(ids):
+    """
+    Returns ids as a list of Python objects (NumPy arrays are converted).
+    """
+    if hasattr(ids, 'tolist'):
+        return ids.tolist()
+    return ids
+
+
+def get_max_batch_size(connection, params_per_row):
+    """
+    Returns how many rows of ``params_per_row`` query parameters fit in a
+    single query on the given connection (``None`` if unlimited), eg. 333
+    awards per INSERT on SQLite (999 parameters).
+    """
+    max_query_params = connection.features.max_query_params
+    if not max_query_params:
+        return None
+    return max(max_query_params // params_per_row, 1)
+
+
+class BatchSize(object):
+    """
+    Batch size of award writes, capped to ``maximum`` (backend parameter
+    limit). If ``adaptive`` is ``True``, the size grows or shrinks after each
+    batch (at most doubled or halved) toward ``target_time`` seconds per batch.
+    """
+
+    def __init__(self, size, maximum=None, adaptive=False, target_time=0.2, minimum=10):
+        self.maximum = maximum
+        self.minimum = min(minimum, size)
+        self.adaptive = adaptive
+        self.target_time = target_time
+        self.size = self.clamp(size)
+        self.sizes = []
+
+    def clamp(self, size):
+        size = max(int(size), self.minimum, 1)
+        if self.maximum:
+            size = min(size, self.maximum)
+        return size
+
+    def record(self, count, duration):
+        """
+        Records a batch of ``count`` rows written in ``duration`` seconds.
+        """
+        self.sizes.append(count)
+        if not self.adaptive or not count:
+            return
+        if duration <= 0:
+            ideal = self.size * 2
+        else:
+            ideal = count * self.target_time / duration
+        self.size = self.clamp(min(max(ideal, self.size / 2), self.size * 2))
+
+    def as_dict(self):
+        return {
+            'batches': len(self.sizes),
+            'min': min(self.sizes) if self.sizes else 0,
+            'max': max(self.sizes) if self.sizes else 0,
+            'last': self.sizes[-1] if self.sizes else 0,
+        }
+
+
+def get_values_list_field(queryset):
+    """
+    Returns the field name selected by a flat ``values_list()`` queryset.
+    Returns ``None`` if ``queryset`` is not a queryset we can filter on
+    (Python list, sliced or combined queryset, several fields...).
+    """
+    if not isinstance(queryset, QuerySet):
+        return None
+    if queryset.query.is_sliced or queryset.query.combinator:
+        return None
+    fields = getattr(queryset, '_fields', None)
+    if not fields or len(fields) != 1:
+        return None
+    return fields[0]
+
+
+# 31-bit multipliers of the two id hashes of checksums
+CHECKSUM_HASHES = ((0x5BD1E995, 0x27D4EB2F), (0x2C1B3C6D, 0x297A2D39))
+
+CHECKSUM_MASK = 0x7FFFFFFF
+
+
+def get_id_hash(field, multipliers):
+    """
+    Returns an expression hashing the integer ``field`` (xor-shift-multiply
+    mixer on 31 bits, evaluated as ``bigint`` so no product overflows).
+    """
+    first, second = multipliers
+    value = Cast(F(field), BigIntegerField())
+    value = value.bitxor(value.bitrightshift(31)).bitand(CHECKSUM_MASK)
+    value = (value * first).bitand(CHECKSUM_MASK)
+    value = value.bitxor(value.bitrightshift(15))
+    value = (value * second).bitand(CHECKSUM_MASK)
+    return value.bitxor(value.bitrightshift(13))
+
+
+def get_checksum(queryset, field):
+    """
+    Returns a fingerprint of the integer values of ``field`` computed by the
+    database (only the aggregates leave it): count, sum and sums of two
+    hashes of each value. Two sets of distinct values with the same
+    fingerprint are (almost certainly) equal.
+    """
+    aggregates = {'count': Count(field), 'sum': Sum(Cast(F(field), BigIntegerField()))}
+    for i, multipliers in enumerate(CHECKSUM_HASHES):
+        aggregates['hash%d' % i] = Sum(get_id_hash(field, multipliers))
+    checksum = queryset.order_by().aggregate(**aggregates)
+    return tuple(int(checksum[name] or 0) for name in ['count', 'sum'] + [
+        'hash%d' % i for i in range(len(CHECKSUM_HASHES))])
+
+
+def merge_sorted_diff(current, previous):
+    """
+    Merge-joins two iterables of ids sorted in ascending order and yields
+    ``(id, True)`` for ids only in ``current`` and ``(id, False)`` for ids
+    only in ``previous``. Only one id of each iterable is held in memory.
+    """
+    sentinel = object()
+    current, previous = iter(current), iter(previous)
+    left, right = next(current, sentinel), next(previous, sentinel)
+
+    while left is not sentinel or right is not sentinel:
+        if right is sentinel or (left is not sentinel and left < right):
+            yield (left, True)
+            value, left = left, next(current, sentinel)
+        elif left is sentinel or right < left:
+            yield (right, False)
+            value, right = right, next(previous, sentinel)
+        else:
+            value = left
+            left, right = next(current, sentinel), next(previous, sentinel)
+        # Skips duplicates
+        while left is not sentinel and left == value:
+            left = next(current, sentinel)
+        while right is not sentinel and right == value:
+            right = next(previous, sentinel)
 
 
 def log_queries(recipe):
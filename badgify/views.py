@@ -1,7 +1,9 @@
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django.utils.functional import cached_property
 from django.views.generic import ListView
 
+from .catalogue import catalogue
 from .models import Badge
 from . import settings
 
@@ -27,7 +29,13 @@ class BadgeDetailView(ListView):
 
     @cached_property
     def badge(self):
-        return get_object_or_404(self.model, slug=self.kwargs.get('slug', None))
+        slug = self.kwargs.get('slug', None)
+        if self.model is not Badge:
+            return get_object_or_404(self.model, slug=slug)
+        badge = catalogue.get(slug)
+        if badge is None:
+            raise Http404('No badge found matching the query')
+        return badge
 
     def get_queryset(self):
         return self.badge.users.all()
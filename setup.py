@@ -24,6 +24,10 @@ setup(
         "pytz",
         "six",
     ],
+    extras_require={
+        "numpy": ["numpy"],
+        "roaring": ["pyroaring"],
+    },
     tests_require=["coverage", "RandomWords"],
     classifiers=[
         "Environment :: Web Environment",